@@ -0,0 +1,103 @@
+"""
+Latency of dashboard requests when the Dash app is rebuilt for every request, as it used to be, and with the process
+wide app. Requests are dispatched in process with the database configured by DJANGO_SETTINGS_MODULE (kuro.settings by
+default), so run some experiments first, for example with demo.py, to have groups and experiments to query.
+
+    python benchmarks/dash_callbacks.py --repeat 50
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kuro.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from django.test import RequestFactory  # noqa: E402
+
+from kuro.web.dash_app import create_app, dispatch, dispatcher  # noqa: E402
+from kuro.web.models import Experiment  # noqa: E402
+
+
+def update_component(output, inputs, state=()):
+    return {
+        'output': {'id': output[0], 'property': output[1]},
+        'inputs': [{'id': i, 'property': p, 'value': v} for i, p, v in inputs],
+        'state': [{'id': i, 'property': p, 'value': v} for i, p, v in state]
+    }
+
+
+def requests_to_time(n_experiments):
+    factory = RequestFactory()
+    experiment_rows = [{'id': e} for e in Experiment.objects.order_by('id').values_list('id', flat=True)[:n_experiments]]
+
+    def post(body):
+        return factory.post('/_dash-update-component', json.dumps(body), content_type='application/json')
+
+    def trials_json(held):
+        return post(update_component(
+            ('experiment-trials-json', 'children'),
+            [('update-tables-plots', 'n_clicks', 1), ('interval-component', 'n_intervals', 0)],
+            [
+                ('experiment-detail-table', 'rows', experiment_rows),
+                ('experiment-detail-table', 'selected_row_indices', list(range(len(experiment_rows)))),
+                ('experiment-trials-json', 'children', held)
+            ]
+        ))
+
+    # The series held by a page that already loaded them, which an auto refresh only brings up to date
+    held = json.loads(dispatcher(trials_json(None)))['response']['props']['children']
+    return {
+        'layout': factory.get('/_dash-layout'),
+        'refresh interval': post(update_component(
+            ('interval-component', 'interval'), [('refresh-interval', 'value', 60)]
+        )),
+        'aggregate plots': post(update_component(
+            ('experiment-aggregate-trials-plots', 'children'), [('experiment-aggregate-trials-table', 'rows', [])]
+        )),
+        f'trials json ({len(experiment_rows)} experiments)': trials_json(None),
+        'trials json refresh': trials_json(held),
+    }
+
+
+def time_requests(handle, requests, repeat):
+    latencies = {}
+    for name, request in requests.items():
+        handle(request)
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            handle(request)
+            samples.append(time.perf_counter() - start)
+        latencies[name] = np.array(samples) * 1000
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20, help='number of times each request is timed')
+    parser.add_argument('--experiments', type=int, default=5, help='number of experiments selected in trials json')
+    args = parser.parse_args()
+
+    requests = requests_to_time(args.experiments)
+    modes = {
+        'rebuilt per request': lambda request: dispatch(create_app(), request),
+        'process wide app': dispatcher
+    }
+    print(f'{"request":<32}{"mode":<22}{"mean ms":>10}{"p50 ms":>10}{"p95 ms":>10}')
+    for mode, handle in modes.items():
+        for name, samples in time_requests(handle, requests, args.repeat).items():
+            print(
+                f'{name:<32}{mode:<22}{samples.mean():>10.2f}{np.percentile(samples, 50):>10.2f}'
+                f'{np.percentile(samples, 95):>10.2f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,387 @@
+"""
+asyncio version of the kuro client for code running in an event loop, such as async data loaders or RL actors. It
+mirrors KuroClient, Worker, Experiment, and Trial from kuro.client but every call that talks to the server is a
+coroutine. Requests from all trials share one aiohttp session and at most max_concurrency of them are in flight at a
+time, so one process can report for many trials at once without threads.
+
+This module requires aiohttp, which is installed with `pip install kuro[async]`.
+"""
+from typing import Dict, Optional
+from urllib.parse import urlencode, urlsplit
+import asyncio
+import random
+import time
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from kuro.client import (
+    KURO_SERVER, MAX_QUERY_LENGTH, Metric, TooManyTrials, format_since, get_worker_hardware, parse_metrics,
+    since_values, validate_metrics
+)
+from kuro.policies import ReportPolicy
+from kuro.transport import LatencyStats, RETRY_STATUSES
+
+
+API_PREFIX = 'api/v1.0/'
+
+
+class KuroRequestError(Exception):
+    def __init__(self, status, content):
+        self.status = status
+        self.content = content
+        super().__init__(f'{status}: {content}')
+
+
+class AsyncKuroClient:
+    """
+    :param server: url of the kuro server
+    :param max_concurrency: maximum number of requests in flight at once
+    :param timeout: total seconds to wait for each request
+    :param max_retries: number of times requests are retried, GET requests after a connection error, timeout, or 5xx
+    response and others only if they could not connect
+    :param backoff_factor: the n-th retry sleeps up to backoff_factor * 2 ** (n - 1) seconds, see kuro.transport
+    """
+    def __init__(self, server=KURO_SERVER, max_concurrency=10, timeout=30, max_retries=3, backoff_factor=0.5):
+        if aiohttp is None:
+            raise ImportError('AsyncKuroClient requires aiohttp, install it with pip install kuro[async]')
+        self.api_root = server.rstrip('/') + '/' + API_PREFIX
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.latency = LatencyStats()
+        self._semaphore = None
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        # The session and semaphore must be created inside the event loop that uses them
+        if self._session is None:
+            self._semaphore = asyncio.BoundedSemaphore(self.max_concurrency)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def request(self, method, path, data=None):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self._request(method, path, data)
+            except (aiohttp.ClientError, asyncio.TimeoutError, KuroRequestError) as e:
+                # Like kuro.transport.Transport, other methods are only retried if the server never received them
+                if method == 'GET':
+                    retryable = not isinstance(e, KuroRequestError) or e.status in RETRY_STATUSES
+                else:
+                    retryable = isinstance(e, aiohttp.ClientConnectorError)
+                if not retryable or attempt == self.max_retries:
+                    raise
+            # Sleep outside of the semaphore so waiting retries do not block other requests
+            await asyncio.sleep(random.uniform(0, self.backoff_factor * 2 ** attempt))
+
+    async def _request(self, method, path, data):
+        session = self._get_session()
+        async with self._semaphore:
+            start = time.perf_counter()
+            error = True
+            try:
+                async with session.request(method, self.api_root + path, json=data) as response:
+                    if response.status >= 400:
+                        raise KuroRequestError(response.status, await response.text())
+                    content = await response.json()
+                    error = False
+                    return content
+            finally:
+                self.latency.record(f'{method} {path}', time.perf_counter() - start, error=error)
+
+    async def get_or_create_worker(self, name, cpu_brand, memory, gpus):
+        return await self.request(
+            'POST', 'workers/get-or-create/',
+            {'name': name, 'cpu_brand': cpu_brand, 'memory': memory, 'gpus': gpus}
+        )
+
+    async def get_trial(self, trial_id):
+        return await self.request('GET', f'trials/{trial_id}/?expand=worker,experiment')
+
+    async def iterate(self, resource, **filters):
+        """
+        See KuroClient.iterate
+        """
+        query = urlencode(filters)
+        while True:
+            page = await self.request('GET', f'{resource}/?{query}')
+            for item in page['results']:
+                yield item
+            if page['next'] is None:
+                return
+            query = urlsplit(page['next']).query
+
+    async def list_metrics(self, name=None):
+        filters = {} if name is None else {'name': name}
+        return [m async for m in self.iterate('metrics', **filters)]
+
+    async def experiment_summary(self, experiment_id):
+        return await self.request('GET', f'experiments/{experiment_id}/summary/')
+
+    async def experiment_summaries(self, experiment_ids):
+        ids = ','.join(str(i) for i in experiment_ids)
+        return (await self.request('GET', f'experiments/summaries/?ids={ids}'))['experiments']
+
+    async def result_series_updates(self, experiment_ids, since=None):
+        """
+        See KuroClient.result_series_updates
+        """
+        params = {'experiments': ','.join(str(i) for i in experiment_ids)}
+        if since:
+            params['since'] = format_since(since)
+        query = urlencode(params)
+        if len(query) <= MAX_QUERY_LENGTH:
+            return await self.request('GET', f'results/updates/?{query}')
+        return await self.request('POST', 'results/updates-query/', {
+            'experiments': list(experiment_ids), 'since': since_values(since) if since else []
+        })
+
+    async def get_or_create_metric(self, name, mode=None):
+        return await self.request('POST', 'metrics/get-or-create/', {'name': name, 'mode': mode})
+
+    async def get_or_create_metrics(self, metrics: Dict[str, str]):
+        """
+        See KuroClient.get_or_create_metrics
+        """
+        response = await self.request(
+            'POST', 'metrics/bulk-get-or-create/',
+            {'metrics': [{'name': name, 'mode': mode} for name, mode in metrics.items()]}
+        )
+        return response['metrics']
+
+    async def get_update_create_experiment(self, group, identifier, hyper_parameters=None, metrics=None, n_trials=None):
+        """
+        See KuroClient.get_update_create_experiment
+        """
+        params = {
+            'group': group,
+            'identifier': identifier,
+        }
+
+        if hyper_parameters is not None:
+            params['hyper_parameters'] = hyper_parameters
+
+        if metrics is not None:
+            params['metrics'] = metrics
+
+        if n_trials is not None:
+            params['n_trials'] = n_trials
+
+        return await self.request('POST', 'experiments/get-or-create/', params)
+
+    async def get_or_create_trial(self, worker_url, experiment_url):
+        return await self.request(
+            'POST', 'trials/get-or-create/',
+            {'worker': worker_url, 'experiment': experiment_url}
+        )
+
+    async def create_result_value(self, trial_url, metric_url, step, value):
+        if step is None:
+            step = 0
+        return await self.request(
+            'POST', 'result_values/report/',
+            {'trial': trial_url, 'metric': metric_url, 'step': step, 'value': value}
+        )
+
+    async def create_result_values(self, points):
+        """
+        See KuroClient.create_result_values
+        """
+        return await self.request(
+            'POST', 'result_values/bulk-report/',
+            {
+                'points': [
+                    {'trial': trial_url, 'metric': metric_url, 'step': 0 if step is None else step, 'value': value}
+                    for trial_url, metric_url, step, value in points
+                ]
+            }
+        )
+
+    async def trial_complete(self, trial_url):
+        return await self.request('POST', 'trials/complete/', {'trial': trial_url})
+
+    async def trial_failed(self, trial_url):
+        return await self.request('POST', 'trials/fail/', {'trial': trial_url})
+
+
+class AsyncWorker:
+    def __init__(self, client: AsyncKuroClient, worker):
+        self.client = client
+        self.name = worker['name']
+        self.created_at = worker['created_at']
+        self.active = worker['active']
+        self.cpu_brand = worker['cpu_brand']
+        self.memory = worker['memory']
+        self.gpus = worker['gpus']
+        self.url = worker['url']
+
+    @classmethod
+    async def create(cls, name, client: AsyncKuroClient) -> 'AsyncWorker':
+        loop = asyncio.get_event_loop()
+        cpu_brand, memory, gpus = await loop.run_in_executor(None, get_worker_hardware)
+        worker = await client.get_or_create_worker(name, cpu_brand, memory, gpus)
+        return cls(client, worker)
+
+    async def experiment(self, group, identifier, hyper_parameters=None, metrics=None, n_trials=1) -> 'AsyncExperiment':
+        return await AsyncExperiment.create(
+            self, group, identifier, hyper_parameters=hyper_parameters, metrics=metrics, n_trials=n_trials
+        )
+
+
+class AsyncExperiment:
+    def __init__(self, worker: AsyncWorker, group, identifier, hyper_parameters, experiment, policies=None):
+        self.worker = worker
+        self.client = worker.client
+        self.group = group
+        self.identifier = identifier
+        self.hyper_parameters = hyper_parameters
+        self.metrics = {e['name']: Metric(e['url'], e['name'], e['mode']) for e in experiment['metrics']}
+        self.n_trials = experiment['n_trials']
+        self.url = experiment['url']
+        self.policies = policies if policies is not None else {}
+        self._pending_metrics = {}
+
+    @classmethod
+    async def create(cls, worker: AsyncWorker, group, identifier, hyper_parameters=None, metrics=None, n_trials=None):
+        if hyper_parameters is None:
+            hyper_parameters = {}
+        initial_metrics = await init_metrics(worker.client, metrics)
+        metric_urls = [m.url for m in initial_metrics.values()]
+        experiment = await worker.client.get_update_create_experiment(
+            group, identifier, hyper_parameters=hyper_parameters, metrics=metric_urls, n_trials=n_trials
+        )
+        policies = parse_metrics(metrics)[1] if metrics is not None else {}
+        return cls(worker, group, identifier, hyper_parameters, experiment, policies=policies)
+
+    async def get_metric(self, name, mode=None) -> Metric:
+        """
+        Return the metric, creating it if it is new to this experiment, see get_metrics
+        """
+        return (await self.get_metrics({name: mode}))[name]
+
+    async def get_metrics(self, metrics: Dict[str, Optional[str]]) -> Dict[str, Metric]:
+        """
+        Return the metrics, creating the ones new to this experiment with one request. Concurrent calls that need the
+        same new metric share the request creating it.
+        :param metrics: dictionary from metric name to mode, the mode is only used for new metrics
+        """
+        new_metrics = {
+            name: mode for name, mode in metrics.items()
+            if name not in self.metrics and name not in self._pending_metrics
+        }
+        if len(new_metrics) > 0:
+            future = asyncio.ensure_future(init_metrics(self.client, new_metrics))
+            for name in new_metrics:
+                self._pending_metrics[name] = future
+
+        pending = {name: self._pending_metrics[name] for name in metrics if name not in self.metrics}
+        try:
+            for name, future in pending.items():
+                self.metrics[name] = (await future)[name]
+        finally:
+            for name, future in pending.items():
+                if self._pending_metrics.get(name) is future:
+                    del self._pending_metrics[name]
+        return {name: self.metrics[name] for name in metrics}
+
+    async def trial(self) -> Optional['AsyncTrial']:
+        try:
+            return await AsyncTrial.from_worker_experiment(self.worker, self)
+        except TooManyTrials:
+            return None
+
+
+async def init_metrics(client: AsyncKuroClient, metrics) -> Dict[str, Metric]:
+    """
+    Get or create all metrics in one request, see kuro.client.parse_metrics for the accepted formats
+    """
+    if metrics is None:
+        return {}
+    validated_metrics = validate_metrics(metrics)
+    if len(validated_metrics) == 0:
+        return {}
+    responses = await client.get_or_create_metrics(validated_metrics)
+    return {m['name']: Metric(m['url'], m['name'], m['mode']) for m in responses}
+
+
+class AsyncTrial:
+    def __init__(self, worker: AsyncWorker, experiment: AsyncExperiment, trial_instance):
+        self.kuro_worker = worker
+        self.kuro_experiment = experiment
+        self.client = worker.client
+        self.url = trial_instance['url']
+        self.id = trial_instance['id']
+        self.worker = trial_instance['worker']
+        self.experiment = trial_instance['experiment']
+        self.started_at = trial_instance['started_at']
+        self.complete = trial_instance['complete']
+        self.policies = {}
+
+    @classmethod
+    async def from_worker_experiment(cls, worker: AsyncWorker, experiment: AsyncExperiment) -> 'AsyncTrial':
+        trial_instance = await worker.client.get_or_create_trial(worker.url, experiment.url)
+        if 'error' in trial_instance and trial_instance['error'] == 'TooManyTrials':
+            raise TooManyTrials()
+        return cls(worker, experiment, trial_instance)
+
+    async def report_metric(self, name, value, step=None, mode=None, policy: Optional[ReportPolicy] = None):
+        """
+        See Trial.report_metric
+        """
+        metric = await self.kuro_experiment.get_metric(name, mode)
+        await self._send_values(self._policy_points(metric, step, value, policy))
+
+    async def report_metrics(self, values: Dict[str, float], step=None, modes: Optional[Dict[str, str]] = None):
+        """
+        See Trial.report_metrics
+        """
+        if modes is None:
+            modes = {}
+        metrics = await self.kuro_experiment.get_metrics({name: modes.get(name) for name in values})
+        points = []
+        for name, value in values.items():
+            points.extend(self._policy_points(metrics[name], step, value))
+        await self._send_values(points)
+
+    def _policy_points(self, metric: Metric, step, value, policy: Optional[ReportPolicy] = None):
+        if metric.name not in self.policies:
+            if policy is None:
+                policy = self.kuro_experiment.policies.get(metric.name)
+            self.policies[metric.name] = policy.new() if policy is not None else None
+
+        if self.policies[metric.name] is None:
+            return [(self.url, metric.url, step, value)]
+        return [(self.url, metric.url, s, v) for s, v in self.policies[metric.name].offer(step, value, metric.mode)]
+
+    async def _send_values(self, points):
+        if len(points) == 1:
+            await self.client.create_result_value(*points[0])
+        elif len(points) > 1:
+            await self.client.create_result_values(points)
+
+    async def end(self):
+        points = []
+        for name, policy in self.policies.items():
+            if policy is not None:
+                metric_url = self.kuro_experiment.metrics[name].url
+                points.extend((self.url, metric_url, s, v) for s, v in policy.finish())
+        await self._send_values(points)
+        await self.client.trial_complete(self.url)
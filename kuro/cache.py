@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+
+KURO_CACHE_DIR = os.environ.get('KURO_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'kuro'))
+if len(KURO_CACHE_DIR) == 0:
+    KURO_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'kuro')
+
+# Bump when the layout of the cache file changes so files written by older clients are ignored
+CACHE_FORMAT = 1
+
+
+def experiment_key(group, identifier, hyper_parameters):
+    return json.dumps([group, identifier, hyper_parameters], sort_keys=True)
+
+
+class ClientCache:
+    """
+    On-disk cache of a server's API schema, workers, metrics, and experiments so that starting a job does not need to
+    download them again. There is one JSON file per server. The cached workers, metrics, and experiments are only valid
+    for the schema version they were stored with, when the server reports a different version the cache is cleared.
+    KuroClient also drops them when the server answers that an object does not exist, such as after its database was
+    reset.
+
+    Writes replace the file atomically, so concurrent jobs sharing the cache never read a partial file. If two jobs
+    write at the same time the last one wins, which only costs the other job's entries a round trip next time.
+
+    A cache may be shared by threads of the same job, such as trials run by Experiment.run_trials with the thread
+    backend, so every read and write of the entries holds a lock.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self.schema_version = None
+        self.schema = None
+        self.workers = {}
+        self.metrics = {}
+        self.experiments = {}
+        self.load()
+
+    @classmethod
+    def for_server(cls, server, directory=KURO_CACHE_DIR):
+        digest = hashlib.sha1(server.rstrip('/').encode('utf8')).hexdigest()[:16]
+        return cls(os.path.join(directory, f'{digest}.json'))
+
+    def load(self):
+        with self._lock:
+            try:
+                with open(self.path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                return
+            if data.get('format') != CACHE_FORMAT:
+                return
+            self.schema_version = data.get('schema_version')
+            self.schema = data.get('schema')
+            self.workers = data.get('workers', {})
+            self.metrics = data.get('metrics', {})
+            self.experiments = data.get('experiments', {})
+
+    def save(self):
+        with self._lock:
+            data = {
+                'format': CACHE_FORMAT,
+                'schema_version': self.schema_version,
+                'schema': self.schema,
+                'workers': self.workers,
+                'metrics': self.metrics,
+                'experiments': self.experiments
+            }
+            try:
+                directory = os.path.dirname(self.path)
+                os.makedirs(directory, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                # The cache is an optimization, failing to write it should never fail the job
+                pass
+
+    def set_schema(self, version, schema):
+        with self._lock:
+            if version != self.schema_version:
+                self.workers = {}
+                self.metrics = {}
+                self.experiments = {}
+            self.schema_version = version
+            self.schema = schema
+            self.save()
+
+    def clear_objects(self):
+        """
+        Drop the cached workers, metrics, and experiments but keep the schema, for when the server no longer has them
+        """
+        with self._lock:
+            self.workers = {}
+            self.metrics = {}
+            self.experiments = {}
+            self.save()
+
+    def get_worker(self, name):
+        with self._lock:
+            return self.workers.get(name)
+
+    def set_worker(self, worker):
+        with self._lock:
+            self.workers[worker['name']] = dict(worker)
+            self.save()
+
+    def get_metric(self, name, mode):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                return None
+            if mode is None or mode == 'auto' or mode == metric['mode']:
+                return metric
+            # Let the server validate the mode mismatch
+            return None
+
+    def set_metric(self, metric):
+        with self._lock:
+            self.metrics[metric['name']] = {'url': metric['url'], 'name': metric['name'], 'mode': metric['mode']}
+            self.save()
+
+    def get_experiment(self, group, identifier, hyper_parameters, metric_urls, n_trials):
+        with self._lock:
+            experiment = self.experiments.get(experiment_key(group, identifier, hyper_parameters))
+            if experiment is None:
+                return None
+            if n_trials is not None and n_trials != experiment['n_trials']:
+                return None
+            cached_metric_urls = {m['url'] for m in experiment['metrics']}
+            if metric_urls is not None and not set(metric_urls) <= cached_metric_urls:
+                return None
+            return experiment
+
+    def set_experiment(self, group, identifier, hyper_parameters, experiment):
+        with self._lock:
+            for m in experiment['metrics']:
+                self.metrics[m['name']] = {'url': m['url'], 'name': m['name'], 'mode': m['mode']}
+            self.experiments[experiment_key(group, identifier, hyper_parameters)] = {
+                'url': experiment['url'],
+                'n_trials': experiment['n_trials'],
+                'metrics': [{'url': m['url'], 'name': m['name'], 'mode': m['mode']} for m in experiment['metrics']]
+            }
+            self.save()
+
+    def clear(self):
+        with self._lock:
+            self.schema_version = None
+            self.schema = None
+            self.workers = {}
+            self.metrics = {}
+            self.experiments = {}
+            self.save()
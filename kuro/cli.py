@@ -0,0 +1,42 @@
+import argparse
+import sys
+
+from kuro.client import KuroClient, KURO_SERVER
+from kuro.spool import replay_directory
+
+
+def replay(args):
+    client = KuroClient(server=args.server)
+    outcomes = replay_directory(args.directory, client)
+    failed = False
+    for path, outcome in outcomes.items():
+        if isinstance(outcome, Exception):
+            failed = True
+            print(f'{path}: failed, {outcome!r}')
+        else:
+            print(f'{path}: replayed {outcome} values')
+    if len(outcomes) == 0:
+        print(f'No spool files found in {args.directory}')
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='kuro', description='Command line tools for kuro')
+    subparsers = parser.add_subparsers(dest='command')
+
+    replay_parser = subparsers.add_parser(
+        'replay', help='Send result values spooled by trials that could not reach the server'
+    )
+    replay_parser.add_argument('directory', help='Directory containing spool files')
+    replay_parser.add_argument('--server', default=KURO_SERVER, help='Kuro server to send values to')
+    replay_parser.set_defaults(func=replay)
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 1
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,20 +1,36 @@
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 import json
 import os
+import queue
+import threading
+import time
 from collections import defaultdict, namedtuple
+from collections.abc import Sequence
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from urllib.parse import urlencode
 
 import coreapi
 import cpuinfo
 import psutil
 from gpustat import GPUStatCollection
 
+from kuro.cache import ClientCache
+from kuro.policies import ReportPolicy
+from kuro.spool import Spool, KURO_SPOOL_DIR, is_server_unavailable
+from kuro.transport import Transport
+
 
 KURO_SERVER = os.environ.get('KURO_SERVER', 'http://localhost:8000')
 if len(KURO_SERVER) == 0:
     KURO_SERVER = 'http://localhost:8000'
 
 
+# Longer queries of result_series_updates are sent in a POST body, servers such as gunicorn limit the request line to
+# about 4KB
+MAX_QUERY_LENGTH = 2000
+
 Metric = namedtuple('Metric', ['url', 'name', 'mode'])
+TrialOutcome = namedtuple('TrialOutcome', ['trial_id', 'result', 'error'])
 
 
 def get_gpu_list():
@@ -35,21 +51,392 @@ def get_gpu_list():
         return {'gpus': []}
 
 
+def get_worker_hardware():
+    """
+    Collect the cpu brand, memory in GB, and json encoded gpu list of this machine. This can take over a second.
+    """
+    cpu_data = cpuinfo.get_cpu_info()
+    cpu_brand = cpu_data['brand'] if 'brand' in cpu_data else ''
+    memory = psutil.virtual_memory().total / 1073741824
+    gpus = json.dumps(get_gpu_list())
+    return cpu_brand, memory, gpus
+
+
+def parse_metrics(metrics) -> Tuple[Dict[str, str], Dict[str, ReportPolicy]]:
+    """
+    Parse the metrics argument of an experiment into a dictionary from metric name to mode and a dictionary from
+    metric name to reporting policy. Metrics can be given as a dictionary from name to mode or (mode, policy) tuple,
+    or a list of names, (name, mode) tuples, and (name, mode, policy) tuples. Missing modes are set to auto.
+    """
+    modes = {}
+    policies = {}
+    if isinstance(metrics, dict):
+        for name, mode in metrics.items():
+            if isinstance(mode, (tuple, list)) and len(mode) == 2:
+                mode, policies[name] = mode
+            modes[name] = mode if mode is not None else 'auto'
+    elif isinstance(metrics, list) or isinstance(metrics, tuple):
+        for m in metrics:
+            if isinstance(m, str):
+                modes[m] = 'auto'
+            elif (isinstance(m, tuple) or isinstance(m, list)) and len(m) == 2:
+                modes[m[0]] = m[1]
+            elif (isinstance(m, tuple) or isinstance(m, list)) and len(m) == 3:
+                modes[m[0]] = m[1] if m[1] is not None else 'auto'
+                policies[m[0]] = m[2]
+            else:
+                raise ValueError('Invalid metric, expected string, 2-tuple of strings, or (name, mode, policy)')
+    else:
+        raise ValueError('Incompatible metrics input')
+
+    for name, policy in policies.items():
+        if not isinstance(policy, ReportPolicy):
+            raise ValueError(f'Invalid policy for metric {name}, expected a ReportPolicy')
+    return modes, policies
+
+
+def validate_metrics(metrics) -> Dict[str, str]:
+    """
+    Normalize the metrics argument of an experiment to a dictionary from metric name to mode, see parse_metrics
+    """
+    return parse_metrics(metrics)[0]
+
+
 class TooManyTrials(Exception):
     pass
 
 
+def is_missing_object_error(error: Exception):
+    """
+    True if the server answered that an object the request refers to does not exist, such as the url of an object
+    cached before the server's database was reset
+    """
+    if not isinstance(error, coreapi.exceptions.ErrorMessage):
+        return False
+    if error.error.title.startswith('404') or error.error.get('error') == 'DoesNotExist':
+        return True
+    # Hyperlinks to objects that do not exist fail the validation of the field they were sent in
+    return any(
+        isinstance(messages, Sequence) and 'Invalid hyperlink - Object does not exist.' in messages
+        for messages in error.error.values()
+    )
+
+
+class BatchReporter:
+    """
+    Buffers result values in memory and sends them to the server from a background thread so that reporting a metric
+    does not block on an HTTP round trip. The buffer is flushed every flush_interval seconds or as soon as it holds
+    max_buffer_size values, whichever comes first. When the buffer is full report blocks until the background thread
+    has taken the pending values, which bounds memory if the server falls behind.
+
+    Errors raised while sending are stored and re-raised by the next call to flush or close. If a spool is given then
+    batches that cannot be sent because the server is unavailable are written to it instead.
+    """
+    def __init__(self, client: 'KuroClient', flush_interval=1.0, max_buffer_size=1000, spool: Optional[Spool] = None):
+        if flush_interval <= 0:
+            raise ValueError('flush_interval must be positive')
+        if max_buffer_size < 1:
+            raise ValueError('max_buffer_size must be at least 1')
+        self.client = client
+        self.flush_interval = flush_interval
+        self.max_buffer_size = max_buffer_size
+        self.spool = spool
+        self._buffer = []
+        self._condition = threading.Condition()
+        self._n_reported = 0
+        self._n_sent = 0
+        self._flush_requested = False
+        self._closed = False
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='kuro-batch-reporter', daemon=True)
+        self._thread.start()
+
+    def report(self, trial_url, metric_url, step, value):
+        with self._condition:
+            if self._closed:
+                raise ValueError('Cannot report to a closed BatchReporter')
+            while len(self._buffer) >= self.max_buffer_size:
+                self._condition.wait()
+            self._buffer.append((trial_url, metric_url, step, value))
+            self._n_reported += 1
+            if len(self._buffer) >= self.max_buffer_size:
+                self._condition.notify_all()
+
+    def flush(self):
+        """
+        Block until every value reported before this call has been sent to the server
+        """
+        with self._condition:
+            target = self._n_reported
+            self._flush_requested = True
+            self._condition.notify_all()
+            while self._n_sent < target and self._thread.is_alive():
+                self._condition.wait()
+            self._raise_error()
+
+    def close(self):
+        """
+        Send all buffered values and stop the background thread. Calling close more than once is safe.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        with self._condition:
+            self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+    def _next_batch(self):
+        with self._condition:
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if self._closed or self._flush_requested or len(self._buffer) >= self.max_buffer_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = self._buffer
+            self._buffer = []
+            self._flush_requested = False
+            self._condition.notify_all()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if len(batch) > 0:
+                try:
+                    self._send(batch)
+                except Exception as e:
+                    with self._condition:
+                        self._error = e
+            with self._condition:
+                self._n_sent += len(batch)
+                self._condition.notify_all()
+                if self._closed and len(self._buffer) == 0:
+                    return
+
+    def _send(self, batch):
+        if self.spool is None:
+            self.client.create_result_values(batch)
+        else:
+            self.spool.send(self.client, batch)
+
+
+class StreamReporter:
+    """
+    Sends the result values of one trial on a streaming request that stays open while values are reported, so
+    reporting does not pay for an HTTP request per value or per batch. Values are written to the request body as
+    newline delimited JSON from a background thread and the server commits them in batches as they arrive.
+
+    The stream is ended and the server's acknowledgement read after max_stream_values values or max_stream_seconds
+    seconds, whichever comes first, then the next stream reuses the same keep-alive connection. This bounds the values
+    awaiting acknowledgement and keeps each request shorter than server worker timeouts. Values the server did not
+    acknowledge, because the stream failed or their batch was rejected, are sent again with the bulk endpoint, which
+    replaces existing values. Errors are stored and re-raised by the next call to flush or close, if a spool is given
+    then values that cannot be sent because the server is unavailable are written to it instead.
+    """
+    def __init__(self, client: 'KuroClient', trial_url, max_stream_values=10000, max_stream_seconds=10.0,
+                 spool: Optional[Spool] = None):
+        if max_stream_values < 1:
+            raise ValueError('max_stream_values must be at least 1')
+        if max_stream_seconds <= 0:
+            raise ValueError('max_stream_seconds must be positive')
+        self.client = client
+        self.trial_url = trial_url
+        self.max_stream_values = max_stream_values
+        self.max_stream_seconds = max_stream_seconds
+        self.spool = spool
+        # Bounded so that report blocks instead of buffering without limit if the server falls behind
+        self._queue = queue.Queue(maxsize=max_stream_values)
+        self._closed = False
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='kuro-stream-reporter', daemon=True)
+        self._thread.start()
+
+    def report(self, trial_url, metric_url, step, value):
+        if self._closed:
+            raise ValueError('Cannot report to a closed StreamReporter')
+        if trial_url != self.trial_url:
+            raise ValueError(f'StreamReporter for {self.trial_url} cannot report values of {trial_url}')
+        self._queue.put((metric_url, step, value))
+
+    def flush(self):
+        """
+        Block until every value reported before this call has been acknowledged by the server
+        """
+        done = threading.Event()
+        self._queue.put(done)
+        while not done.wait(.1):
+            if not self._thread.is_alive():
+                break
+        self._raise_error()
+
+    def close(self):
+        """
+        Send all reported values and stop the background thread. Calling close more than once is safe.
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+
+            sent = [item]
+            markers = []
+            deadline = time.monotonic() + self.max_stream_seconds
+
+            def stream():
+                yield item
+                while len(sent) < self.max_stream_values:
+                    try:
+                        chunk = [self._queue.get(timeout=max(deadline - time.monotonic(), 0))]
+                    except queue.Empty:
+                        return
+                    # Write every value already queued as one chunk instead of one chunk per value
+                    while len(sent) + len(chunk) < self.max_stream_values:
+                        try:
+                            chunk.append(self._queue.get_nowait())
+                        except queue.Empty:
+                            break
+                    values = [v for v in chunk if isinstance(v, tuple)]
+                    markers.extend(v for v in chunk if not isinstance(v, tuple))
+                    if len(values) > 0:
+                        sent.extend(values)
+                        yield values
+                    if len(markers) > 0:
+                        return
+
+            try:
+                self._acknowledge(sent, self.client.stream_result_values(self.trial_url, stream()))
+            except Exception:
+                self._resend(sent)
+            for m in markers:
+                if m is None:
+                    return
+                m.set()
+
+    def _acknowledge(self, sent, ack):
+        acknowledged = set()
+        for batch in ack['batches']:
+            if 'error' not in batch:
+                acknowledged.update(range(batch['first_line'], batch['first_line'] + batch['n_lines']))
+        if len(acknowledged) < len(sent):
+            self._resend([p for i, p in enumerate(sent) if i not in acknowledged])
+
+    def _resend(self, values):
+        points = [(self.trial_url, metric_url, step, value) for metric_url, step, value in values]
+        try:
+            if self.spool is None:
+                self.client.create_result_values(points)
+            else:
+                self.spool.send(self.client, points)
+        except Exception as e:
+            self._error = e
+
+
 class KuroClient:
-    def __init__(self, server=KURO_SERVER):
-        self.schema_endpoint = os.path.join(server, 'schema')
-        self.client = coreapi.Client()
-        self.schema = self.client.get(self.schema_endpoint)
+    def __init__(self, server=KURO_SERVER, cache=True, transport: Optional[Transport] = None):
+        """
+        :param server: url of the kuro server
+        :param cache: if True the schema, metrics, and experiments are cached on disk (see ClientCache) so that
+        creating a client only checks the schema version with the server instead of downloading the schema
+        :param transport: HTTP transport used for every request, defaults to a Transport with default settings. Its
+        latency statistics are available from KuroClient.latency
+        """
+        self.server = server
+        self.schema_endpoint = os.path.join(server, 'schema/')
+        self.schema_version_endpoint = os.path.join(server, 'schema', 'version/')
+        self.transport = transport if transport is not None else Transport()
+        self.client = self.transport.coreapi_client()
+        self.cache = ClientCache.for_server(server) if cache else None
+        self.schema = self._load_schema()
+
+    @property
+    def latency(self):
+        return self.transport.latency
+
+    def get(self, url):
+        with self.transport.timed(url):
+            return self._forget_missing_objects(self.client.get, url)
+
+    def _load_schema(self):
+        if self.cache is None:
+            return self.get(self.schema_endpoint)
+
+        codec = coreapi.codecs.CoreJSONCodec()
+        try:
+            version = self.get(self.schema_version_endpoint)['version']
+        except coreapi.exceptions.ErrorMessage:
+            # Servers without a schema version cannot be cached safely
+            self.cache = None
+            return self.get(self.schema_endpoint)
+
+        if version == self.cache.schema_version and self.cache.schema is not None:
+            return codec.decode(self.cache.schema.encode('utf8'))
+
+        schema = self.get(self.schema_endpoint)
+        self.cache.set_schema(version, codec.encode(schema).decode('utf8'))
+        return schema
 
     def query(self, args, params=None):
-        return self.client.action(self.schema, args, params)
+        with self.transport.timed('/'.join(args)):
+            return self._forget_missing_objects(self.client.action, self.schema, args, params)
+
+    def _forget_missing_objects(self, request, *args):
+        try:
+            return request(*args)
+        except coreapi.exceptions.ErrorMessage as e:
+            if self.cache is not None and is_missing_object_error(e):
+                # The cached workers, metrics, and experiments may be of a database that was reset since they were
+                # cached, so they are looked up again by the next request that needs them
+                self.cache.clear_objects()
+            raise
+
+    def iterate(self, resource, **filters):
+        """
+        Iterate over the objects of a list endpoint one page at a time, so memory use does not depend on how many
+        objects there are
+        :param resource: name of the endpoint such as workers, trials, or result_values
+        :param filters: query parameters of the endpoint such as experiment=1 or step__gt=10, see the API schema
+        """
+        page = self.query([resource, 'list'], params=filters)
+        while True:
+            yield from page['results']
+            if page['next'] is None:
+                return
+            with self.transport.timed(f'{resource}/list'):
+                page = self.client.get(page['next'])
+
+    def list_workers(self, **filters):
+        return list(self.iterate('workers', **filters))
+
+    def list_experiments(self, **filters):
+        return list(self.iterate('experiments', **filters))
 
-    def list_workers(self):
-        return self.client.action(self.schema, ['workers', 'list'])
+    def list_trials(self, **filters):
+        return list(self.iterate('trials', **filters))
 
     def create_worker(self, name, cpu_brand, memory, gpus):
         return self.query(
@@ -57,17 +444,93 @@ class KuroClient:
             params={'name': name, 'cpu_brand': cpu_brand, 'memory': memory, 'gpus': gpus, 'active': True}
         )
 
-    def get_trial(self, trial_id):
-        return self.query(['trials', 'read'], params={'id': trial_id})
+    def get_or_create_worker(self, name, cpu_brand, memory, gpus):
+        """
+        Find the worker with the given name or create it with the given hardware information if it does not exist
+        """
+        worker = self.query(
+            ['workers', 'get-or-create', 'create'],
+            params={'name': name, 'cpu_brand': cpu_brand, 'memory': memory, 'gpus': gpus}
+        )
+        if self.cache is not None:
+            self.cache.set_worker(worker)
+        return worker
+
+    def get_trial(self, trial_id, expand=True):
+        """
+        :param expand: if True the trial's worker and experiment are included as objects rather than urls
+        """
+        params = {'id': trial_id}
+        if expand:
+            params['expand'] = 'worker,experiment'
+        return self.query(['trials', 'read'], params=params)
 
     def list_metrics(self, name=None):
-        metrics = self.query(['metrics', 'list'])
-        return [
-            m for m in metrics if name is None or m['name'] == name
-        ]
+        if name is None:
+            return list(self.iterate('metrics'))
+        return list(self.iterate('metrics', name=name))
+
+    def experiment_summary(self, experiment_id):
+        """
+        Statistics across trials of the best value of each of the experiment's metrics and the best value of each
+        trial's metrics, computed by the server without downloading series
+        """
+        return self.query(['experiments', 'summary'], params={'id': experiment_id})
+
+    def experiment_summaries(self, experiment_ids):
+        """
+        The summaries of many experiments with one request, see experiment_summary
+        """
+        return self.query(
+            ['experiments', 'summaries'], params={'ids': ','.join(str(i) for i in experiment_ids)}
+        )['experiments']
+
+    def result_series_updates(self, experiment_ids, since=None):
+        """
+        The series of the experiments' results that changed since the revisions in since, a dictionary from result id
+        to the revision and last step of the series held, or None if it has no values. A result with replace true
+        replaces the held series, otherwise its steps and values are appended to it. removed lists results of since
+        that no longer exist.
+        """
+        params = {'experiments': ','.join(str(i) for i in experiment_ids)}
+        if since:
+            params['since'] = format_since(since)
+        if len(urlencode(params)) <= MAX_QUERY_LENGTH:
+            return self.query(['results', 'updates'], params=params)
+        return self.query(['results', 'updates_query'], params={
+            'experiments': list(experiment_ids), 'since': since_values(since) if since else []
+        })
 
     def get_or_create_metric(self, name, mode=None):
-        return self.query(['metrics', 'get-or-create', 'create'], params={'name': name, 'mode': mode})
+        if self.cache is not None:
+            metric = self.cache.get_metric(name, mode)
+            if metric is not None:
+                return metric
+        metric = self.query(['metrics', 'get-or-create', 'create'], params={'name': name, 'mode': mode})
+        if self.cache is not None:
+            self.cache.set_metric(metric)
+        return metric
+
+    def get_or_create_metrics(self, metrics: Dict[str, str]):
+        """
+        Get or create many metrics in a single request, metrics in the cache are not sent to the server
+        :param metrics: dictionary from metric name to mode
+        :return: list of metrics in the same order as the input
+        """
+        found = {}
+        if self.cache is not None:
+            for name, mode in metrics.items():
+                metric = self.cache.get_metric(name, mode)
+                if metric is not None:
+                    found[name] = metric
+        missing = [{'name': name, 'mode': mode} for name, mode in metrics.items() if name not in found]
+        if len(missing) > 0:
+            response = self.query(['metrics', 'bulk-get-or-create', 'create'], params={'metrics': missing})
+            for metric in response['metrics']:
+                found[metric['name']] = metric
+                if self.cache is not None:
+                    self.cache.set_metric(metric)
+        return [found[name] for name in metrics]
 
     def get_update_create_experiment(self, group, identifier, hyper_parameters=None, metrics=None, n_trials=None):
         """
@@ -77,6 +540,9 @@ class KuroClient:
 
         If the experiment does not exist then one is created based on the input parameters. If hyper_parameters is
         None then an empty set of parameters is used represented by a blank dictionary
+
+        When the client has a cache and a previous call returned the same experiment with all of the given metrics and
+        the same n_trials the cached experiment is returned without contacting the server.
         :param group:
         :param identifier:
         :param hyper_parameters:
@@ -98,7 +564,16 @@ class KuroClient:
         if n_trials is not None:
             params['n_trials'] = n_trials
 
-        return self.query(['experiments', 'get-or-create', 'create'], params=params)
+        cache_hyper_parameters = hyper_parameters if hyper_parameters is not None else {}
+        if self.cache is not None:
+            experiment = self.cache.get_experiment(group, identifier, cache_hyper_parameters, metrics, n_trials)
+            if experiment is not None:
+                return experiment
+
+        experiment = self.query(['experiments', 'get-or-create', 'create'], params=params)
+        if self.cache is not None:
+            self.cache.set_experiment(group, identifier, cache_hyper_parameters, experiment)
+        return experiment
 
     def get_or_create_trial(self, worker_url, experiment_url):
         return self.query(
@@ -119,12 +594,71 @@ class KuroClient:
             }
         )
 
+    def create_result_values(self, points):
+        """
+        Report many result values in a single request. Values for a (trial, metric, step) that already exist are
+        replaced, if the same (trial, metric, step) appears more than once the last value is kept.
+        :param points: iterable of (trial_url, metric_url, step, value) tuples, a step of None is stored as 0
+        :return: response with the number of values written
+        """
+        return self.query(
+            ['result_values', 'bulk-report', 'create'],
+            params={
+                'points': [
+                    {'trial': trial_url, 'metric': metric_url, 'step': 0 if step is None else step, 'value': value}
+                    for trial_url, metric_url, step, value in points
+                ]
+            }
+        )
+
+    def stream_result_values(self, trial_url, points):
+        """
+        Send the result values of a trial on one streaming request. The body is written as newline delimited JSON
+        while points is consumed, so points may be a generator that blocks waiting for new values, and the server
+        commits the values in batches as they arrive.
+        :param trial_url: url of the trial the values belong to
+        :param points: iterable of (metric_url, step, value) tuples or lists of them, each list is sent as one chunk
+        :return: acknowledgement with the number of lines read, values written, and the result of each batch
+        """
+        def body():
+            for chunk in points:
+                if isinstance(chunk, tuple):
+                    chunk = [chunk]
+                yield ''.join(
+                    json.dumps({'metric': metric_url, 'step': 0 if step is None else step, 'value': value}) + '\n'
+                    for metric_url, step, value in chunk
+                ).encode('utf8')
+
+        with self.transport.timed('trials/stream/create'):
+            response = self.transport.session.post(
+                trial_url + 'stream/', data=body(), headers={'Content-Type': 'application/x-ndjson'}
+            )
+        if response.status_code >= 400:
+            raise coreapi.exceptions.ErrorMessage(
+                coreapi.Error(title=f'{response.status_code} {response.reason}', content=response.json())
+            )
+        return response.json()
+
     def trial_complete(self, trial_url):
         return self.query(
             ['trials', 'complete', 'create'],
             params={'trial': trial_url}
         )
 
+    def trial_failed(self, trial_url):
+        return self.query(
+            ['trials', 'fail', 'create'],
+            params={'trial': trial_url}
+        )
+
+
+def since_values(since):
+    return [f'{result_id}:{revision}:{"" if step is None else step}' for result_id, (revision, step) in since.items()]
+
+
+def format_since(since):
+    return ','.join(since_values(since))
+
 
 class Experiment:
     def __init__(self, worker: 'Worker', group, identifier, hyper_parameters=None, metrics=None, n_trials=None):
@@ -138,10 +672,15 @@ class Experiment:
             self.hyper_parameters = hyper_parameters
 
         self.n_trials = n_trials
+        self.policies = parse_metrics(metrics)[1] if metrics is not None else {}
+        self._load(metrics, n_trials)
+
+    def _load(self, metrics, n_trials):
         initial_metrics = self._init_metrics(metrics)
         metric_urls = [m.url for m in initial_metrics.values()]
         experiment = self.client.get_update_create_experiment(
-            group, identifier, hyper_parameters=hyper_parameters, metrics=metric_urls, n_trials=n_trials
+            self.group, self.identifier, hyper_parameters=self.hyper_parameters, metrics=metric_urls,
+            n_trials=n_trials
         )
 
         self.metrics = {e['name']: Metric(e['url'], e['name'], e['mode']) for e in experiment['metrics']}
@@ -151,49 +690,167 @@ class Experiment:
     def _init_metrics(self, metrics):
         if metrics is None:
             return {}
-        metric_lookup = {}
-        validated_metrics = {}
-        if isinstance(metrics, dict):
-            for name, mode in metrics.items():
-                validated_metrics[name] = mode if mode is not None else 'auto'
-        elif isinstance(metrics, list) or isinstance(metrics, tuple):
-            for m in metrics:
-                if isinstance(m, str):
-                    validated_metrics[m] = 'auto'
-                elif (isinstance(m, tuple) or isinstance(m, list)) and len(m) == 2:
-                    validated_metrics[m[0]] = m[1]
-                else:
-                    raise ValueError('Invalid metric, expected string or 2-tuple of strings')
-        else:
-            raise ValueError('Incompatible metrics input')
+        validated_metrics = validate_metrics(metrics)
+        if len(validated_metrics) == 0:
+            return {}
+        return {
+            m['name']: Metric(m['url'], m['name'], m['mode'])
+            for m in self.client.get_or_create_metrics(validated_metrics)
+        }
 
-        for name, mode in validated_metrics.items():
-            m = self.client.get_or_create_metric(name, mode)
-            metric_lookup[name] = Metric(m['url'], m['name'], m['mode'])
-        return metric_lookup
+    def trial(self, buffered=False, flush_interval=1.0, max_buffer_size=1000, spool_dir=KURO_SPOOL_DIR,
+              streaming=False) -> Optional['Trial']:
+        """
+        Get or create a trial for this experiment on the worker, returning None if all trials have been claimed.
+        If buffered is True then metrics are sent from a background thread using a BatchReporter configured with
+        flush_interval and max_buffer_size, see BatchReporter for details. If streaming is True then metrics are
+        instead written to a streaming request that stays open for the life of the trial, see StreamReporter.
 
-    def trial(self) -> Optional['Trial']:
+        If spool_dir is not None, which defaults to the KURO_SPOOL_DIR environment variable, then values that cannot
+        be sent because the server is unavailable are written to a spool file for the trial in that directory and
+        replayed once the server is reachable again, see Spool for details.
+        """
         try:
-            return Trial.from_worker_experiment(self.worker, self)
+            trial = Trial.from_worker_experiment(self.worker, self)
         except TooManyTrials:
             return None
+        return self._setup_trial(
+            trial, buffered=buffered, flush_interval=flush_interval, max_buffer_size=max_buffer_size,
+            spool_dir=spool_dir, streaming=streaming
+        )
+
+    def _setup_trial(self, trial, buffered=False, flush_interval=1.0, max_buffer_size=1000, spool_dir=KURO_SPOOL_DIR,
+                     streaming=False):
+        if buffered and streaming:
+            raise ValueError('A trial cannot be both buffered and streaming')
+        if spool_dir is not None:
+            trial.spool = Spool.for_trial(spool_dir, trial.id)
+        if streaming:
+            trial.reporter = StreamReporter(self.client, trial.url, spool=trial.spool)
+        elif buffered:
+            trial.reporter = BatchReporter(
+                self.client, flush_interval=flush_interval, max_buffer_size=max_buffer_size, spool=trial.spool
+            )
+        return trial
+
+    def run_trials(self, fn, n_parallel=None, backend='process', **trial_kwargs) -> List[TrialOutcome]:
+        """
+        Claim trials of this experiment and run fn(trial) for each of them in a pool of n_parallel threads or
+        processes, until all n_trials have been claimed. When fn returns the trial is ended, when it raises the trial
+        is marked failed on the server (see Trial.fail) and left incomplete so the worker resumes it the next time it
+        claims a trial of this experiment.
+
+        With the thread backend every trial shares this experiment's client, whose cache is safe to use from many
+        threads.
+
+        With the process backend fn must be picklable (a module level function) and so must its return value. Each
+        process builds its own client and experiment, so fn receives a Trial that is independent of this object.
+
+        :param fn: function called with a Trial
+        :param n_parallel: number of trials run at once, defaults to the number of cpus
+        :param backend: 'process' or 'thread'
+        :param trial_kwargs: passed to Experiment.trial, such as buffered=True
+        :return: a TrialOutcome with the return value or exception of fn for each trial run, in the order they finished
+        """
+        if backend == 'process':
+            executor_cls = ProcessPoolExecutor
+        elif backend == 'thread':
+            executor_cls = ThreadPoolExecutor
+        else:
+            raise ValueError(f'Invalid backend {backend}, expected process or thread')
+        if n_parallel is None:
+            n_parallel = os.cpu_count() or 1
+
+        outcomes = []
+        claimed = set()
+        running = {}
+        exhausted = False
+        with executor_cls(max_workers=n_parallel) as executor:
+            while True:
+                while not exhausted and len(running) < n_parallel:
+                    try:
+                        trial = Trial.from_worker_experiment(self.worker, self)
+                    except TooManyTrials:
+                        exhausted = True
+                        break
+                    if trial.id in claimed:
+                        # Once all trials are created the server returns the worker's first incomplete trial. If that
+                        # trial is still running another may be resumable after it ends, if it failed there is none
+                        if trial.id not in running.values():
+                            exhausted = True
+                        break
+                    claimed.add(trial.id)
+                    if backend == 'process':
+                        future = executor.submit(
+                            _run_trial_in_process, fn, self._process_args(), trial.id, trial_kwargs
+                        )
+                    else:
+                        future = executor.submit(_run_trial, fn, self._setup_trial(trial, **trial_kwargs))
+                    running[future] = trial.id
+
+                if len(running) == 0:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    trial_id = running.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        outcomes.append(TrialOutcome(trial_id, future.result(), None))
+                    else:
+                        outcomes.append(TrialOutcome(trial_id, None, error))
+        return outcomes
+
+    def _process_args(self):
+        metrics = {
+            name: (m.mode, self.policies[name]) if name in self.policies else m.mode
+            for name, m in self.metrics.items()
+        }
+        return (
+            self.client.server, self.worker.name, self.group, self.identifier, self.hyper_parameters, metrics,
+            self.n_trials
+        )
+
+
+def _run_trial(fn, trial: 'Trial'):
+    try:
+        result = fn(trial)
+    except Exception:
+        try:
+            trial.fail()
+        except Exception:
+            # The trial is resumed by the next claim whether or not the failure was recorded, so the error of fn is
+            # the one returned in its TrialOutcome
+            pass
+        raise
+    trial.end()
+    return result
+
+
+def _run_trial_in_process(fn, experiment_args, trial_id, trial_kwargs):
+    server, worker_name, group, identifier, hyper_parameters, metrics, n_trials = experiment_args
+    worker = Worker(worker_name, server=server)
+    experiment = worker.experiment(
+        group, identifier, hyper_parameters=hyper_parameters, metrics=metrics, n_trials=n_trials
+    )
+    # Without expand the trial's worker and experiment are urls like those of trials the thread backend runs
+    trial = Trial.from_instance(worker, experiment, worker.client.get_trial(trial_id, expand=False))
+    return _run_trial(fn, experiment._setup_trial(trial, **trial_kwargs))
 
 
 class Worker:
     def __init__(self, name, server=KURO_SERVER):
         self.client = KuroClient(server=server)
-        workers = self.client.list_workers()
+        self._load(name)
+
+    def _load(self, name):
         worker = None
-        for w in workers:
-            if w['name'] == name:
-                worker = w
+        if self.client.cache is not None:
+            worker = self.client.cache.get_worker(name)
 
         if worker is None:
-            cpu_data = cpuinfo.get_cpu_info()
-            cpu_brand = cpu_data['brand'] if 'brand' in cpu_data else ''
-            memory = psutil.virtual_memory().total / 1073741824
-            gpus = json.dumps(get_gpu_list())
-            worker = self.client.create_worker(name, cpu_brand, memory, gpus)
+            # Hardware information is only collected when the worker is not cached since it can take over a second
+            cpu_brand, memory, gpus = get_worker_hardware()
+            worker = self.client.get_or_create_worker(name, cpu_brand, memory, gpus)
 
         self.name = worker['name']
         self.created_at = worker['created_at']
@@ -221,30 +878,150 @@ class Trial:
         self.experiment = None
         self.started_at = None
         self.complete = None
+        self.reporter = None
+        self.spool = None
+        self.policies = {}
+
+    def report_metric(self, name, value, step=None, mode=None, policy: Optional[ReportPolicy] = None):
+        """
+        Report the value of a metric at a step. If the metric has a reporting policy, either given here the first time
+        the metric is reported or in the experiment's metrics, the policy decides which values are sent to the server
+        (see kuro.policies).
+
+        If the metric is new to the experiment and the trial has a spool, values reported while the server is
+        unavailable are spooled with the metric's name and the metric is created when the spool is replayed. Policies
+        need the metric's mode, so they do not apply to these values.
+        """
+        if name not in self.kuro_experiment.metrics and not self._init_new_metrics({name: mode}):
+            self.spool.append_metric_value(self.url, name, mode if mode is not None else 'auto', step, value)
+            return
+
+        self._send_values(self._policy_points(name, step, value, policy))
+
+    def report_metrics(self, values: Dict[str, float], step=None, modes: Optional[Dict[str, str]] = None):
+        """
+        Report the values of many metrics at the same step. Metrics new to the experiment are created with a single
+        request and all values are sent with a single request.
+        :param values: dictionary from metric name to value
+        :param step: step of all the values
+        :param modes: dictionary from metric name to mode for new metrics, missing modes are inferred by the server
+        """
+        if modes is None:
+            modes = {}
+        new_metrics = {name: modes.get(name) for name in values if name not in self.kuro_experiment.metrics}
+        if len(new_metrics) > 0 and not self._init_new_metrics(new_metrics):
+            # Spooled like in report_metric
+            for name, mode in new_metrics.items():
+                self.spool.append_metric_value(self.url, name, mode if mode is not None else 'auto', step, values[name])
+            values = {name: value for name, value in values.items() if name not in new_metrics}
+
+        points = []
+        for name, value in values.items():
+            points.extend(self._policy_points(name, step, value))
+        self._send_values(points)
 
-    def report_metric(self, name, value, step=None, mode=None):
-        if name not in self.kuro_experiment.metrics:
-            metric = self.kuro_experiment._init_metrics({name: mode})[name]
-            self.kuro_experiment.metrics[name] = metric
+    def _init_new_metrics(self, metrics: Dict[str, Optional[str]]):
+        """
+        Create metrics new to the experiment, returning False instead if the trial has a spool and the server is
+        unavailable. While the spool waits to retry the server no request is made, so reports do not each wait for a
+        connection timeout.
+        """
+        if self.spool is not None and self.spool.waiting:
+            return False
+        try:
+            self.kuro_experiment.metrics.update(self.kuro_experiment._init_metrics(metrics))
+        except Exception as e:
+            if self.spool is None or not is_server_unavailable(e):
+                raise
+            self.spool.defer()
+            return False
+        return True
+
+    def _policy_points(self, name, step, value, policy: Optional[ReportPolicy] = None):
+        metric = self.kuro_experiment.metrics[name]
+        if name not in self.policies:
+            if policy is None:
+                policy = self.kuro_experiment.policies.get(name)
+            self.policies[name] = policy.new() if policy is not None else None
+
+        if self.policies[name] is None:
+            return [(self.url, metric.url, step, value)]
+        return [(self.url, metric.url, s, v) for s, v in self.policies[name].offer(step, value, metric.mode)]
+
+    def _send_values(self, points):
+        if len(points) == 0:
+            return
+        if self.reporter is not None:
+            for p in points:
+                self.reporter.report(*p)
+        elif self.spool is not None:
+            self.spool.send(self.client, points)
+        elif len(points) == 1:
+            self.client.create_result_value(*points[0])
         else:
-            metric = self.kuro_experiment.metrics[name]
+            self.client.create_result_values(points)
 
-        self.client.create_result_value(self.url, metric.url, step, value)
+    def flush(self):
+        if self.reporter is not None:
+            self.reporter.flush()
 
     def end(self):
-        self.client.trial_complete(self.url)
+        points = []
+        for name, policy in self.policies.items():
+            if policy is not None:
+                metric_url = self.kuro_experiment.metrics[name].url
+                points.extend((self.url, metric_url, step, value) for step, value in policy.finish())
+        self._send_values(points)
+        if self.reporter is not None:
+            self.reporter.close()
+        if self.spool is None:
+            self.client.trial_complete(self.url)
+        else:
+            try:
+                self.spool.replay(self.client)
+                self.client.trial_complete(self.url)
+            except Exception as e:
+                if not is_server_unavailable(e):
+                    raise
+                self.spool.append_complete(self.url)
+
+    def fail(self):
+        """
+        Record on the server that the trial failed. Values already reported are sent first, but not the values report
+        policies hold until the end since the trial did not finish. The trial stays incomplete so the worker resumes
+        it the next time it claims a trial of the experiment, the failure is cleared once the trial ends.
+        """
+        if self.reporter is not None:
+            self.reporter.close()
+        try:
+            self.client.trial_failed(self.url)
+        except Exception as e:
+            if self.spool is None or not is_server_unavailable(e):
+                raise
 
     @classmethod
     def from_worker_experiment(cls, worker: Worker, experiment: Experiment):
+        try:
+            trial_instance = worker.client.get_or_create_trial(worker.url, experiment.url)
+        except coreapi.exceptions.ErrorMessage as e:
+            if worker.client.cache is None or not is_missing_object_error(e):
+                raise
+            # The worker or experiment came from a cache of a database that has been reset since. The failed request
+            # dropped the cached objects, so they are looked up on the server again.
+            worker._load(worker.name)
+            experiment._load({name: m.mode for name, m in experiment.metrics.items()}, experiment.n_trials)
+            trial_instance = worker.client.get_or_create_trial(worker.url, experiment.url)
+        if 'error' in trial_instance and trial_instance['error'] == 'TooManyTrials':
+            raise TooManyTrials()
+        return cls.from_instance(worker, experiment, trial_instance)
+
+    @classmethod
+    def from_instance(cls, worker: Worker, experiment: Experiment, trial_instance):
         trial = cls()
         trial.kuro_worker = worker
         trial.kuro_experiment = experiment
         trial.client = worker.client
         trial.results = defaultdict(list)
-
-        trial_instance = trial.client.get_or_create_trial(worker.url, experiment.url)
-        if 'error' in trial_instance and trial_instance['error'] == 'TooManyTrials':
-            raise TooManyTrials()
         trial.url = trial_instance['url']
         trial.id = trial_instance['id']
         trial.worker = trial_instance['worker']
@@ -0,0 +1,188 @@
+"""
+Client-side policies that decide which reported values of a metric are sent to the server. They are useful for
+metrics such as per-batch loss that are reported far more often than they need to be stored. Every policy keeps a
+constant amount of state per metric, always sends a point at the last step reported, and by default also sends the
+best value (the minimum or maximum according to the metric's mode) so the best value stored by the server is exact.
+A new best value is sent along with the next points the policy sends rather than when the trial ends, so a trial that
+dies only loses the values reported since the policy last sent points.
+
+Policies given to an Experiment are templates, each trial gets its own copy from ReportPolicy.new.
+"""
+from typing import List, Tuple
+import copy
+import time
+
+
+Point = Tuple[int, float]
+REDUCTIONS = ('mean', 'min', 'max', 'last', 'best')
+
+
+def _better(value, other, mode):
+    if mode == 'min':
+        return value < other
+    return value > other
+
+
+class ReportPolicy:
+    """
+    Base class for policies. Subclasses implement _offer, returning the points to send for a new value, and may
+    implement _finish to return points still pending when the trial ends. Points are stored with upsert semantics so
+    if the best value shares a step with an aggregated point it replaces it.
+    :param keep_best: if True the best value reported is sent with the next points the policy sends, or when the trial
+    ends, if it was not sent already
+    """
+    def __init__(self, keep_best=True):
+        self.keep_best = keep_best
+        self._best = None
+        self._best_sent = False
+        self._last = None
+        self._last_sent = False
+
+    def new(self) -> 'ReportPolicy':
+        policy = copy.copy(self)
+        policy._reset()
+        return policy
+
+    def _reset(self):
+        self._best = None
+        self._best_sent = False
+        self._last = None
+        self._last_sent = False
+
+    def offer(self, step, value, mode) -> List[Point]:
+        """
+        Record a reported value and return the (step, value) points that should be sent now
+        """
+        point = (step, value)
+        if self._best is None or _better(value, self._best[1], mode):
+            self._best = point
+            self._best_sent = False
+        self._last = point
+        self._last_sent = False
+        points = self._offer(step, value, mode)
+        if self.keep_best and len(points) > 0 and not self._best_sent and self._best not in points:
+            # Sent after the policy's points so it replaces an aggregate at the same step
+            points.append(self._best)
+        return self._mark_sent(points)
+
+    def finish(self) -> List[Point]:
+        """
+        Return the points that still need to be sent when the trial ends
+        """
+        points = self._mark_sent(self._finish())
+        if self._last is not None and not self._last_sent:
+            points.append(self._last)
+        if self.keep_best and self._best is not None and not self._best_sent and self._best != self._last:
+            points.append(self._best)
+        return self._mark_sent(points)
+
+    def _mark_sent(self, points):
+        for p in points:
+            if p == self._best:
+                self._best_sent = True
+            # An aggregate at the last step already ends the curve there, sending the raw value would replace it
+            if self._last is not None and p[0] == self._last[0]:
+                self._last_sent = True
+        return points
+
+    def _offer(self, step, value, mode) -> List[Point]:
+        raise NotImplementedError()
+
+    def _finish(self) -> List[Point]:
+        return []
+
+
+class EveryN(ReportPolicy):
+    """
+    Send the first value and then every n-th value reported
+    """
+    def __init__(self, n, keep_best=True):
+        if n < 1:
+            raise ValueError('n must be at least 1')
+        super().__init__(keep_best=keep_best)
+        self.n = n
+        self._count = 0
+
+    def _reset(self):
+        super()._reset()
+        self._count = 0
+
+    def _offer(self, step, value, mode):
+        send = self._count % self.n == 0
+        self._count += 1
+        return [(step, value)] if send else []
+
+
+class Window(ReportPolicy):
+    """
+    Aggregate every window of size values into one point. The reduction is one of mean, min, max, last, or best which
+    is min or max depending on the metric's mode. The mean and last are sent at the window's last step, the other
+    reductions at the step of the value they selected.
+    """
+    def __init__(self, size, reduce='mean', keep_best=True):
+        if size < 1:
+            raise ValueError('size must be at least 1')
+        if reduce not in REDUCTIONS:
+            raise ValueError(f'reduce must be one of {REDUCTIONS}')
+        super().__init__(keep_best=keep_best)
+        self.size = size
+        self.reduce = reduce
+        self._count = 0
+        self._total = 0.0
+        self._selected = None
+        self._last_step = None
+
+    def _reset(self):
+        super()._reset()
+        self._count = 0
+        self._total = 0.0
+        self._selected = None
+        self._last_step = None
+
+    def _offer(self, step, value, mode):
+        self._count += 1
+        self._total += value
+        self._last_step = step
+        reduce = mode if self.reduce == 'best' else self.reduce
+        if self._selected is None or reduce == 'last' or (
+                reduce in ('min', 'max') and _better(value, self._selected[1], reduce)):
+            self._selected = (step, value)
+        if self._count == self.size:
+            return self._finish()
+        return []
+
+    def _finish(self):
+        if self._count == 0:
+            return []
+        if self.reduce == 'mean':
+            point = (self._last_step, self._total / self._count)
+        else:
+            point = self._selected
+        self._count = 0
+        self._total = 0.0
+        self._selected = None
+        return [point]
+
+
+class Throttle(ReportPolicy):
+    """
+    Send at most one value every interval seconds, values reported in between are dropped except for the last one
+    which is sent when the trial ends
+    """
+    def __init__(self, interval, keep_best=True):
+        if interval <= 0:
+            raise ValueError('interval must be positive')
+        super().__init__(keep_best=keep_best)
+        self.interval = interval
+        self._next_time = 0
+
+    def _reset(self):
+        super()._reset()
+        self._next_time = 0
+
+    def _offer(self, step, value, mode):
+        now = time.monotonic()
+        if now < self._next_time:
+            return []
+        self._next_time = now + self.interval
+        return [(step, value)]
@@ -93,6 +93,8 @@ POSTGRES_CONFIG = {
 SQLITE_CONFIG = {
     'ENGINE': 'django.db.backends.sqlite3',
     'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+    # In-memory test databases lock whole tables between connections, a file behaves like the real database
+    'TEST': {'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3')}
 }
 
 USE_POSTGRES = bool(os.environ.get('KURO_USE_POSTGRES', False))
@@ -101,6 +103,23 @@ DATABASES = {
     'default':  POSTGRES_CONFIG if USE_POSTGRES else SQLITE_CONFIG
 }
 
+# How result values are stored, rows or chunks, see kuro.web.storage
+KURO_RESULT_STORAGE = os.environ.get('KURO_RESULT_STORAGE', 'rows')
+
+# Server side buffering of result values, off, sync, or async, see kuro.web.buffer
+KURO_WRITE_BUFFER = os.environ.get('KURO_WRITE_BUFFER', 'off')
+KURO_WRITE_BUFFER_SIZE = int(os.environ.get('KURO_WRITE_BUFFER_SIZE', 5000))
+KURO_WRITE_BUFFER_INTERVAL = float(os.environ.get('KURO_WRITE_BUFFER_INTERVAL', 0.05))
+
+# Seconds between bumps of the result values data version by a server process, see kuro.web.versions
+KURO_RESULT_VALUES_VERSION_INTERVAL = float(os.environ.get('KURO_RESULT_VALUES_VERSION_INTERVAL', 1.0))
+
+
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'kuro.web.filters.IdCursorPagination',
+    'DEFAULT_FILTER_BACKENDS': ('kuro.web.filters.QueryFilterBackend', 'kuro.web.filters.ExpansionBackend'),
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
@@ -0,0 +1,177 @@
+import glob
+import json
+import os
+import threading
+import time
+
+import coreapi
+import requests
+
+
+KURO_SPOOL_DIR = os.environ.get('KURO_SPOOL_DIR')
+if KURO_SPOOL_DIR is not None and len(KURO_SPOOL_DIR) == 0:
+    KURO_SPOOL_DIR = None
+
+SPOOL_EXTENSION = '.spool'
+
+
+def is_server_unavailable(error: Exception):
+    """
+    True if the error means the server could not be reached or failed on its side, in which case retrying the same
+    request later may succeed. Client errors such as validation failures are not considered unavailability.
+    """
+    if isinstance(error, requests.exceptions.RequestException):
+        return True
+    if isinstance(error, coreapi.exceptions.ErrorMessage):
+        return error.error.title.startswith('5')
+    return False
+
+
+class Spool:
+    """
+    Append-only log of the result values a trial could not send to the server. Each line of the file is a JSON
+    object that is either a result value or a marker that the trial was completed. Every append is flushed and synced
+    to disk before returning so values survive the process dying. Replaying sends the values with the bulk endpoint,
+    which replaces existing values, so replaying the same file more than once is safe.
+
+    Values may be recorded with only the metric name and mode if the metric url is not known yet, the metric is
+    created on replay. These values are sent as they were reported since report policies need the metric's mode.
+    """
+    def __init__(self, path, retry_interval=30.0):
+        self.path = path
+        self.retry_interval = retry_interval
+        self._retry_at = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_trial(cls, directory, trial_id, **kwargs):
+        os.makedirs(directory, exist_ok=True)
+        return cls(os.path.join(directory, f'trial-{trial_id}{SPOOL_EXTENSION}'), **kwargs)
+
+    @property
+    def pending(self):
+        return os.path.exists(self.path)
+
+    @property
+    def waiting(self):
+        """
+        True until retry_interval seconds have passed since the server was last found unavailable, during which
+        requests should not be attempted
+        """
+        with self._lock:
+            return time.monotonic() < self._retry_at
+
+    def defer(self):
+        """
+        Record that the server is unavailable so it is not retried for retry_interval seconds
+        """
+        with self._lock:
+            self._retry_at = time.monotonic() + self.retry_interval
+
+    def append(self, entries):
+        lines = ''.join(json.dumps(e) + '\n' for e in entries)
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            self._retry_at = time.monotonic() + self.retry_interval
+
+    def append_points(self, points):
+        """
+        :param points: iterable of (trial_url, metric_url, step, value) tuples
+        """
+        self.append(
+            {'trial': trial_url, 'metric': metric_url, 'step': step, 'value': value}
+            for trial_url, metric_url, step, value in points
+        )
+
+    def append_metric_value(self, trial_url, name, mode, step, value):
+        self.append([{'trial': trial_url, 'name': name, 'mode': mode, 'step': step, 'value': value}])
+
+    def append_complete(self, trial_url):
+        self.append([{'trial': trial_url, 'complete': True}])
+
+    def read(self):
+        """
+        Read all entries in the spool, skipping a partially written last line left by a crash
+        """
+        entries = []
+        if not self.pending:
+            return entries
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+        return entries
+
+    def send(self, client, points):
+        """
+        Send points to the server, appending them to the spool instead if the server is unavailable. While the spool
+        has entries the server is only retried once every retry_interval seconds, and when it is reachable again the
+        spooled entries are replayed before the new points so the order of reports is kept.
+        :param client: KuroClient
+        :param points: list of (trial_url, metric_url, step, value) tuples
+        """
+        if self.waiting:
+            self.append_points(points)
+            return
+        try:
+            self.replay(client)
+            client.create_result_values(points)
+        except Exception as e:
+            if not is_server_unavailable(e):
+                raise
+            self.append_points(points)
+
+    def replay(self, client, batch_size=1000):
+        """
+        Send every spooled entry to the server and remove the spool file once they have all been stored. If this
+        raises then the spool file is left untouched and can be replayed again later.
+        :param client: KuroClient
+        :return: number of result values replayed
+        """
+        with self._lock:
+            entries = self.read()
+            if len(entries) == 0:
+                return 0
+
+            metric_urls = {}
+            points = []
+            completed = []
+            for e in entries:
+                if e.get('complete', False):
+                    completed.append(e['trial'])
+                    continue
+                metric_url = e.get('metric')
+                if metric_url is None:
+                    if e['name'] not in metric_urls:
+                        metric_urls[e['name']] = client.get_or_create_metric(e['name'], e['mode'])['url']
+                    metric_url = metric_urls[e['name']]
+                points.append((e['trial'], metric_url, e['step'], e['value']))
+
+            for i in range(0, len(points), batch_size):
+                client.create_result_values(points[i:i + batch_size])
+            for trial_url in completed:
+                client.trial_complete(trial_url)
+
+            os.remove(self.path)
+            self._retry_at = 0
+            return len(points)
+
+
+def replay_directory(directory, client):
+    """
+    Replay every spool file in directory, for example spools left behind by jobs that died while the server was
+    unreachable. Spools that fail to replay are kept and reported in the returned dictionary.
+    :return: dictionary mapping spool path to the number of values replayed or the exception that was raised
+    """
+    outcomes = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*' + SPOOL_EXTENSION))):
+        try:
+            outcomes[path] = Spool(path).replay(client)
+        except Exception as e:
+            outcomes[path] = e
+    return outcomes
@@ -0,0 +1,210 @@
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import coreapi
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+
+
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+class JitteredRetry(Retry):
+    """
+    Retry policy with exponential backoff and full jitter: each sleep is drawn uniformly between zero and the
+    exponential backoff so that many clients retrying after the same failure do not hit the server in lockstep.
+    """
+    def get_backoff_time(self):
+        return random.uniform(0, super().get_backoff_time())
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that applies a default timeout to every request, requests otherwise waits forever by default
+    """
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+class ConditionalCacheAdapter(TimeoutHTTPAdapter):
+    """
+    TimeoutHTTPAdapter that keeps the most recent GET responses that have an ETag and revalidates them with
+    If-None-Match, so a poll of unchanged data gets an empty 304 response from the server and is answered from memory.
+    Responses are cached by url and Accept header.
+
+    :param cache_size: maximum number of responses kept, 0 disables the cache
+    """
+    def __init__(self, cache_size=256, **kwargs):
+        self.cache_size = cache_size
+        self.hits = 0
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if self.cache_size <= 0 or request.method != 'GET':
+            return super().send(request, **kwargs)
+        key = (request.url, request.headers.get('Accept', ''))
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+        if cached is not None and 'If-None-Match' not in request.headers:
+            request.headers['If-None-Match'] = cached['headers']['ETag']
+
+        response = super().send(request, **kwargs)
+        if response.status_code == 304 and cached is not None:
+            # Read the empty body so the connection is returned to the pool
+            response.content
+            response.close()
+            with self._cache_lock:
+                self.hits += 1
+            return self._cached_response(cached, request, response)
+        if response.status_code == 200 and 'ETag' in response.headers and not kwargs.get('stream'):
+            entry = {
+                'headers': dict(response.headers), 'content': response.content,
+                'encoding': response.encoding, 'reason': response.reason
+            }
+            with self._cache_lock:
+                self._cache[key] = entry
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        elif cached is not None:
+            with self._cache_lock:
+                self._cache.pop(key, None)
+        return response
+
+    def _cached_response(self, cached, request, not_modified):
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = cached['reason']
+        response.headers = CaseInsensitiveDict(cached['headers'])
+        response.encoding = cached['encoding']
+        response._content = cached['content']
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.elapsed = not_modified.elapsed
+        return response
+
+    def clear(self):
+        with self._cache_lock:
+            self._cache.clear()
+
+
+class LatencyStats:
+    """
+    Thread safe latency statistics for requests grouped by a key such as the API action. Percentiles are computed over
+    the most recent window requests for each key so memory use is bounded.
+    """
+    def __init__(self, window=1000):
+        self.window = window
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, key, seconds, error=False):
+        with self._lock:
+            if key not in self._stats:
+                self._stats[key] = {
+                    'count': 0, 'errors': 0, 'total': 0.0, 'min': seconds, 'max': seconds,
+                    'recent': deque(maxlen=self.window)
+                }
+            stats = self._stats[key]
+            stats['count'] += 1
+            stats['errors'] += int(error)
+            stats['total'] += seconds
+            stats['min'] = min(stats['min'], seconds)
+            stats['max'] = max(stats['max'], seconds)
+            stats['recent'].append(seconds)
+
+    def summary(self):
+        """
+        :return: dictionary from key to count, errors, mean, min, max, p50, p95, and p99 latency in seconds
+        """
+        with self._lock:
+            summary = {}
+            for key, stats in self._stats.items():
+                recent = sorted(stats['recent'])
+                summary[key] = {
+                    'count': stats['count'],
+                    'errors': stats['errors'],
+                    'mean': stats['total'] / stats['count'],
+                    'min': stats['min'],
+                    'max': stats['max'],
+                    'p50': _percentile(recent, .5),
+                    'p95': _percentile(recent, .95),
+                    'p99': _percentile(recent, .99)
+                }
+            return summary
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+
+def _percentile(sorted_values, q):
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
+
+
+class Transport:
+    """
+    HTTP transport shared by every request a KuroClient makes. It keeps a pool of keep-alive connections to the
+    server, applies a timeout to every request, and retries with exponential backoff and jitter. Requests of every
+    method are retried when the connection could not be established, since the server never received them. Read
+    timeouts and 5xx responses are only retried for idempotent methods such as GET: a POST may have been applied
+    before its response was lost, and some writes such as claiming a trial slot are not safe to repeat.
+    GET responses are revalidated with their ETag so polling data that has not changed transfers no body.
+
+    :param pool_size: maximum number of connections kept open to the server
+    :param timeout: seconds to wait for a response, or a (connect, read) tuple
+    :param max_retries: number of times a failed request is retried
+    :param backoff_factor: the n-th retry sleeps up to backoff_factor * 2 ** (n - 1) seconds
+    :param cache_size: number of GET responses kept to be revalidated, 0 disables conditional requests
+    """
+    def __init__(self, pool_size=10, timeout=(3.05, 30), max_retries=3, backoff_factor=0.5, cache_size=256):
+        self.timeout = timeout
+        self.latency = LatencyStats()
+        retry = JitteredRetry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            raise_on_status=False
+        )
+        adapter = ConditionalCacheAdapter(
+            cache_size=cache_size, timeout=timeout, pool_connections=pool_size, pool_maxsize=pool_size,
+            max_retries=retry
+        )
+        self.adapter = adapter
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def coreapi_client(self):
+        return coreapi.Client(transports=[coreapi.transports.HTTPTransport(session=self.session)])
+
+    @contextmanager
+    def timed(self, key):
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.latency.record(key, time.perf_counter() - start, error=error)
+
+    def close(self):
+        self.session.close()
@@ -26,14 +26,18 @@ router.register(r'users', views.UserViewSet)
 router.register(r'groups', views.GroupViewSet)
 router.register(r'experiments/get-or-create', views.ExperimentGetOrCreateViewSet, base_name='experiment')
 router.register(r'experiments', views.ExperimentViewSet)
+router.register(r'workers/get-or-create', views.WorkerGetOrCreateViewSet, base_name='worker')
 router.register(r'workers', views.WorkerViewSet)
 router.register(r'trials/get-or-create', views.TrialGetOrCreateViewSet, base_name='trial')
 router.register(r'trials/complete', views.TrialCompleteViewSet, base_name='trial')
+router.register(r'trials/fail', views.TrialFailViewSet, base_name='trial')
 router.register(r'trials', views.TrialViewSet)
 router.register(r'results', views.ResultViewSet)
 router.register(r'result_values/report', views.ResultValueCreateViewSet, base_name='result_value')
+router.register(r'result_values/bulk-report', views.ResultValueBulkCreateViewSet, base_name='result_value')
 router.register(r'result_values', views.ResultValueViewSet)
 router.register(r'metrics/get-or-create', views.MetricGetOrCreateViewSet, base_name='metric')
+router.register(r'metrics/bulk-get-or-create', views.MetricBulkGetOrCreateViewSet, base_name='metric')
 router.register(r'metrics', views.MetricViewSet)
 
 schema_view = get_schema_view(title='Kuro API')
@@ -41,6 +45,8 @@ schema_view = get_schema_view(title='Kuro API')
 urlpatterns = [
     path('admin/', admin.site.urls),
     url(r'^schema/$', schema_view),
+    url(r'^schema/version/$', views.schema_version),
+    url(r'^api/v1.0/trials/(?P<trial_id>[0-9]+)/stream/$', views.trial_stream),
     url(r'^api/v1.0/', include(router.urls)),
     url(r'^api-auth/', include('rest_framework.urls', namespace='rest_framework')),
     url(r'^dash-', views.dash),
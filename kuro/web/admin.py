@@ -4,7 +4,7 @@ import json
 from pygments import highlight
 from pygments.lexers import JsonLexer
 from pygments.formatters import HtmlFormatter
-from kuro.web.models import Worker, Metric, Experiment, Trial, Result, ResultValue
+from kuro.web.models import Worker, Metric, Experiment, Trial, Result, ResultValue, ResultChunk, ResultTailValue
 
 
 class WorkerAdmin(admin.ModelAdmin):
@@ -49,16 +49,27 @@ class TrialAdmin(admin.ModelAdmin):
 
 
 class ResultAdmin(admin.ModelAdmin):
-    list_display = ('id', 'trial', 'metric')
+    list_display = ('id', 'trial', 'metric', 'count', 'best_value', 'last_value', 'updated_at')
 
 
 class ResultValueAdmin(admin.ModelAdmin):
     list_display = ('id', 'result', 'step', 'value')
 
 
+class ResultChunkAdmin(admin.ModelAdmin):
+    list_display = ('id', 'result', 'index', 'count', 'min_step', 'max_step', 'min_value', 'max_value')
+    exclude = ('step_data', 'value_data')
+
+
+class ResultTailValueAdmin(admin.ModelAdmin):
+    list_display = ('id', 'result', 'step', 'value')
+
+
 admin.site.register(Worker, WorkerAdmin)
 admin.site.register(Metric, MetricAdmin)
 admin.site.register(Experiment, ExperimentAdmin)
 admin.site.register(Trial, TrialAdmin)
 admin.site.register(Result, ResultAdmin)
 admin.site.register(ResultValue, ResultValueAdmin)
+admin.site.register(ResultChunk, ResultChunkAdmin)
+admin.site.register(ResultTailValue, ResultTailValueAdmin)
@@ -0,0 +1,217 @@
+"""
+Optional write-behind buffer for result values, enabled with the KURO_WRITE_BUFFER setting:
+
+* off: every request writes its values in its own transaction, the default
+* sync: requests hand their values to the buffer and wait until the flush containing them has committed, so many
+  requests arriving at once share one transaction and their responses still mean the values are stored
+* async: requests return as soon as their values are queued, values queued when the process dies are lost
+
+Each server process has one buffer whose background thread flushes the values of all requests with write_points once
+KURO_WRITE_BUFFER_SIZE values are queued or KURO_WRITE_BUFFER_INTERVAL seconds after the oldest queued value arrived.
+Values for the same (trial, metric, step) are coalesced with the last value winning. Queued values are drained when
+the process exits normally, such as when gunicorn stops a worker.
+"""
+from typing import Optional
+import atexit
+import logging
+import os
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import OperationalError, close_old_connections, connection, transaction
+
+from kuro.web.ingest import write_points
+
+
+logger = logging.getLogger(__name__)
+
+DURABILITIES = ('sync', 'async')
+
+
+class _Submission:
+    def __init__(self, points):
+        self.points = points
+        self.n_values = len({(trial_id, metric_id, step) for trial_id, metric_id, step, _ in points})
+        self.error = None
+        self.done = threading.Event()
+
+
+class WriteBuffer:
+    """
+    :param durability: sync to make write wait for the values to be committed, async to return once they are queued
+    :param max_size: number of queued values that triggers a flush
+    :param interval: seconds after the oldest queued value arrived that trigger a flush
+    :param max_pending: number of queued values above which write blocks until a flush has taken them, this bounds
+    memory in async mode when the database falls behind
+    :param max_retries: number of times a flush failing with an OperationalError is retried
+    :param backoff_factor: the n-th retry sleeps up to backoff_factor * 2 ** (n - 1) seconds
+    """
+    def __init__(self, durability='sync', max_size=5000, interval=0.05, max_pending=None, max_retries=8,
+                 backoff_factor=0.05):
+        if durability not in DURABILITIES:
+            raise ValueError(f'durability must be one of {DURABILITIES}')
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+        if interval <= 0:
+            raise ValueError('interval must be positive')
+        self.durability = durability
+        self.max_size = max_size
+        self.interval = interval
+        self.max_pending = max_pending if max_pending is not None else 10 * max_size
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.pid = os.getpid()
+        self._pending = []
+        self._n_pending = 0
+        self._oldest = None
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='kuro-write-buffer', daemon=True)
+        self._thread.start()
+
+    def write(self, points) -> int:
+        """
+        Queue values to be written with upsert semantics, in sync mode this blocks until they are committed and raises
+        the error that prevented it such as MissingObjects
+        :param points: iterable of (trial_id, metric_id, step, value) tuples
+        :return: number of distinct values written
+        """
+        submission = _Submission(list(points))
+        if len(submission.points) == 0:
+            return 0
+        with self._condition:
+            closed = self._closed
+            while not closed and self._n_pending >= self.max_pending:
+                self._condition.wait()
+                closed = self._closed
+            if not closed:
+                first = self._oldest is None
+                if first:
+                    self._oldest = time.monotonic()
+                self._pending.append(submission)
+                self._n_pending += len(submission.points)
+                # The flush thread waits without a timeout while the buffer is empty
+                if first or self._n_pending >= self.max_size:
+                    self._condition.notify_all()
+        if closed:
+            # Requests still running while the process shuts down write directly
+            with transaction.atomic():
+                return write_points(submission.points)
+
+        if self.durability == 'sync':
+            submission.done.wait()
+            if submission.error is not None:
+                raise submission.error
+        return submission.n_values
+
+    def drain(self):
+        """
+        Flush every queued value and stop the background thread. Calling drain more than once is safe.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def _next_batch(self):
+        with self._condition:
+            while True:
+                if self._n_pending >= self.max_size or (self._closed and self._oldest is None):
+                    break
+                if self._oldest is None:
+                    self._condition.wait()
+                    continue
+                remaining = self._oldest + self.interval - time.monotonic()
+                if remaining <= 0 or self._closed:
+                    break
+                self._condition.wait(remaining)
+            batch = self._pending
+            self._pending = []
+            self._n_pending = 0
+            self._oldest = None
+            self._condition.notify_all()
+            return batch
+
+    def _run(self):
+        try:
+            while True:
+                batch = self._next_batch()
+                if len(batch) > 0:
+                    self._flush(batch)
+                with self._condition:
+                    if self._closed and self._oldest is None:
+                        return
+        finally:
+            connection.close()
+
+    def _flush(self, batch):
+        try:
+            self._write([p for s in batch for p in s.points])
+        except Exception as e:
+            if len(batch) == 1:
+                self._fail(batch[0], e)
+            else:
+                # One request's invalid values must not fail the others, so retry each request on its own
+                for submission in batch:
+                    try:
+                        self._write(submission.points)
+                    except Exception as e:
+                        self._fail(submission, e)
+        finally:
+            for submission in batch:
+                submission.done.set()
+
+    def _write(self, points):
+        for attempt in range(self.max_retries + 1):
+            # Drop the connection if it has exceeded CONN_MAX_AGE or was broken by a previous error
+            close_old_connections()
+            try:
+                with transaction.atomic():
+                    return write_points(points)
+            except OperationalError:
+                # Transient errors such as SQLite's database is locked when another process writes at the same time
+                if attempt == self.max_retries:
+                    raise
+            time.sleep(random.uniform(0, self.backoff_factor * 2 ** attempt))
+
+    def _fail(self, submission, error):
+        submission.error = error
+        if self.durability == 'async':
+            logger.error('Dropped %d buffered result values: %s', len(submission.points), error)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_write_buffer() -> Optional[WriteBuffer]:
+    """
+    :return: this process's WriteBuffer, or None if KURO_WRITE_BUFFER is off
+    """
+    global _buffer
+    durability = getattr(settings, 'KURO_WRITE_BUFFER', 'off')
+    if durability == 'off':
+        return None
+    if durability not in DURABILITIES:
+        raise ImproperlyConfigured(f'Invalid KURO_WRITE_BUFFER={durability}, expected off, sync, or async')
+    with _buffer_lock:
+        # A buffer inherited from the parent of a forked process has no thread, each process gets its own
+        if _buffer is None or _buffer.pid != os.getpid() or _buffer.durability != durability:
+            if _buffer is not None and _buffer.pid == os.getpid():
+                _buffer.drain()
+            _buffer = WriteBuffer(
+                durability=durability,
+                max_size=getattr(settings, 'KURO_WRITE_BUFFER_SIZE', 5000),
+                interval=getattr(settings, 'KURO_WRITE_BUFFER_INTERVAL', 0.05)
+            )
+        return _buffer
+
+
+@atexit.register
+def drain_write_buffer():
+    with _buffer_lock:
+        if _buffer is not None and _buffer.pid == os.getpid():
+            _buffer.drain()
@@ -0,0 +1,65 @@
+"""
+Downsampling of result series for `python manage.py kuro_compact`. Series are reduced with Largest-Triangle-Three-Buckets
+(LTTB), which keeps the points that contribute most to the visual shape of a curve, plus the best value according to
+the metric's mode and the last value, which summaries and the dashboard depend on.
+"""
+import numpy as np
+
+from kuro.web.models import Metric
+
+
+def lttb(steps: np.ndarray, values: np.ndarray, n_points: int) -> np.ndarray:
+    """
+    Select n_points points of a series with Largest-Triangle-Three-Buckets. The first and last points are always
+    selected, the others are split into n_points - 2 buckets and from each the point forming the largest triangle
+    with the previously selected point and the average of the next bucket is selected.
+    :param steps: steps sorted in increasing order
+    :param values: values of the steps
+    :return: sorted indices of the selected points
+    """
+    n = len(steps)
+    if n_points >= n:
+        return np.arange(n)
+    if n_points < 3:
+        return np.array([0, n - 1][-n_points:] if n_points > 0 else [], dtype=np.int64)
+
+    x = steps.astype(np.float64)
+    y = values.astype(np.float64)
+    every = (n - 2) / (n_points - 2)
+    selected = np.empty(n_points, dtype=np.int64)
+    selected[0] = 0
+    a = 0
+    for i in range(n_points - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        next_x = x[end:next_end].mean()
+        next_y = y[end:next_end].mean()
+        areas = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    selected[-1] = n - 1
+    return selected
+
+
+def best_index(values: np.ndarray, mode: str) -> int:
+    """
+    :return: index of the first best value for a metric with the given mode, NaN values are never best
+    """
+    if mode == Metric.MAX:
+        return int(np.argmax(np.where(np.isnan(values), -np.inf, values)))
+    return int(np.argmin(np.where(np.isnan(values), np.inf, values)))
+
+
+def downsample(steps: np.ndarray, values: np.ndarray, n_points: int, mode: str) -> np.ndarray:
+    """
+    Select at most n_points points of a series with LTTB that always include the best and the last value
+    :return: sorted indices of the selected points
+    """
+    if len(steps) <= n_points:
+        return np.arange(len(steps))
+    if n_points < 2:
+        raise ValueError('n_points must be at least 2 to keep the best and the last value')
+    # LTTB already keeps the last point, one point is set aside for the best value in case it is not selected
+    selected = lttb(steps, values, n_points - 1)
+    return np.union1d(selected, [best_index(values, mode), len(steps) - 1])
@@ -1,27 +1,54 @@
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 import json
-from collections import defaultdict
+import threading
+import uuid
+from collections import OrderedDict, defaultdict
 from functional import seq
 
 from kuro.web.models import Experiment
+from kuro.web.series import series_updates
+from kuro.web.summaries import summarize_experiments
 
 import numpy as np
 
 import dash
 from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_table_experiments as dt
 
 
+_app = None
+_app_lock = threading.Lock()
+
+# Most pages whose series are held in memory, the least recently refreshed are dropped beyond this
+MAX_HELD_PAGES = 32
+_held_pages = OrderedDict()
+_held_pages_lock = threading.Lock()
+
+
+def get_app():
+    """
+    The Dash app shared by every request of this process. It is created on first use rather than at import so that
+    loading the url configuration, such as for migrate, does not query the database.
+    """
+    global _app
+    with _app_lock:
+        if _app is None:
+            _app = create_app()
+        return _app
+
+
 def dispatcher(request):
     '''
     Main function
     @param request: Request object
     '''
+    return dispatch(get_app(), request)
 
-    app = create_app()
-    app.css.append_css({"external_url": "https://codepen.io/chriddyp/pen/bWLwgP.css"})
+
+def dispatch(app, request):
     params = {
         'data': request.body,
         'method': request.method,
@@ -37,7 +64,7 @@ def dispatcher(request):
 
 
 class MetricSeries:
-    def __init__(self, identifier, experiment_id, trial_id, name, mode, values, steps):
+    def __init__(self, identifier, experiment_id, trial_id, name, mode, values, steps, result_id=None, revision=0):
         self.identifier = identifier
         self.experiment_id = experiment_id
         self.trial_id = trial_id
@@ -45,6 +72,8 @@ class MetricSeries:
         self.mode = mode
         self.values = values
         self.steps = steps
+        self.result_id = result_id
+        self.revision = revision
 
     def to_json(self):
         return {
@@ -54,7 +83,9 @@ class MetricSeries:
             'name': self.name,
             'mode': self.mode,
             'values': self.values,
-            'steps': self.steps
+            'steps': self.steps,
+            'result_id': self.result_id,
+            'revision': self.revision
         }
 
     @classmethod
@@ -66,7 +97,9 @@ class MetricSeries:
             json_obj['name'],
             json_obj['mode'],
             json_obj['values'],
-            json_obj['steps']
+            json_obj['steps'],
+            json_obj.get('result_id'),
+            json_obj.get('revision', 0)
         )
 
 
@@ -120,83 +153,140 @@ class MetricSeries:
         return graph
 
 
+class HeldSeries:
+    """
+    The series of the experiments selected on one dashboard page, held by the server between refreshes so the page
+    does not send them back with every refresh. Each page load has its own key, see get_held_series.
+    """
+    def __init__(self, experiment_ids):
+        self.experiment_ids = experiment_ids
+        self.series: Dict[int, MetricSeries] = {}
+        self.version = None
+        self.lock = threading.Lock()
+
+
+def get_held_series(page_key) -> Optional[HeldSeries]:
+    """
+    The series held for a page, None if the page has none in this process because it was dropped or its refreshes
+    were served by another process
+    """
+    with _held_pages_lock:
+        held = _held_pages.get(page_key)
+        if held is not None:
+            _held_pages.move_to_end(page_key)
+        return held
+
+
+def hold_series(page_key, held: HeldSeries):
+    with _held_pages_lock:
+        _held_pages[page_key] = held
+        _held_pages.move_to_end(page_key)
+        while len(_held_pages) > MAX_HELD_PAGES:
+            _held_pages.popitem(last=False)
+
+
+def refresh_held_series(page_key, experiment_ids) -> Tuple[HeldSeries, bool]:
+    """
+    Bring the series held for a page up to date with the selected experiments, reading only values written since the
+    last refresh if the page already holds series of the same experiments
+    :return: the held series and whether they changed
+    """
+    held = get_held_series(page_key)
+    if held is None or held.experiment_ids != experiment_ids:
+        held = HeldSeries(experiment_ids)
+        hold_series(page_key, held)
+    with held.lock:
+        changed = update_metric_series(experiment_ids, held.series) or held.version is None
+        if changed:
+            held.version = uuid.uuid4().hex
+    return held, changed
+
+
 def create_app():
     app = dash.Dash(csrf_protect=False)
-    app.layout = index()
+    app.css.append_css({"external_url": "https://codepen.io/chriddyp/pen/bWLwgP.css"})
+    # Dash calls the layout function on every page load so groups and experiments are current, while callbacks are
+    # registered once with the app
+    app.layout = index
     app.title = 'Kuro Dashboard'
 
     @app.callback(
         Output('content', 'children'),
+        [Input('experiment-trials-json', 'children'), Input('aggregate-mode', 'value')]
+    )
+    def update_experiment_plot(trials_json, aggregate_mode):
+        if trials_json is None or trials_json == '':
+            return html.H5('No Experiments Selected')
+        trials = json.loads(trials_json)
+        if len(trials['experiments']) == 0:
+            return html.H5('No Experiments Selected')
+        held = get_held_series(trials['page'])
+        if held is None or held.experiment_ids != trials['experiments']:
+            held, _ = refresh_held_series(trials['page'], trials['experiments'])
+        with held.lock:
+            step_metric_data, summary_metric_data = split_metric_series(held.series)
+            return html.Div(plot_experiments(step_metric_data, aggregate_mode))
+
+    @app.callback(
+        Output('experiment-trials-json', 'children'),
+        [Input('update-tables-plots', 'n_clicks'), Input('interval-component', 'n_intervals')],
         [
-            Input('aggregate-mode', 'value'),
-            Input('update-tables-plots', 'n_clicks'),
-            Input('interval-component', 'n_intervals')
-        ],
-        [State('experiment-detail-table', 'rows'), State('experiment-detail-table', 'selected_row_indices')]
+            State('experiment-detail-table', 'rows'), State('experiment-detail-table', 'selected_row_indices'),
+            State('page-key', 'children'), State('experiment-trials-json', 'children')
+        ]
     )
-    def update_experiment_plot(aggregate_mode, n_clicks, n_intervals, exp_rows, exp_selected_rows):
+    def update_experiment_trials_json(n_clicks, n_intervals, exp_rows, exp_selected_rows, page_key, trials_json):
         if exp_selected_rows is None:
             exp_selected_rows = []
-        selected_experiments = []
-        for i in exp_selected_rows:
-            selected_experiments.append(exp_rows[i])
-        if len(selected_experiments) == 0:
-            return html.H5('No Experiments Selected')
-        experiment_ids = [int(exp['id']) for exp in selected_experiments]
-        step_metric_data, summary_metric_data = create_metric_series(experiment_ids)
-        return html.Div(plot_experiments(step_metric_data, aggregate_mode))
+        experiment_ids = [int(exp_rows[i]['id']) for i in exp_selected_rows]
+        # The page only holds the key of its series, the series are held by the server and each refresh only reads
+        # values written since the last one
+        held, changed = refresh_held_series(page_key, experiment_ids)
+        if not changed and trials_json is not None and json.loads(trials_json)['experiments'] == experiment_ids:
+            # Nothing changed, the page keeps its plots
+            raise PreventUpdate()
+        return json.dumps({'page': page_key, 'experiments': experiment_ids, 'version': held.version})
 
     @app.callback(
-        Output('experiment-trials-json', 'children'),
+        Output('experiment-summary-json', 'children'),
         [
             Input('aggregate-mode', 'value'),
             Input('update-tables-plots', 'n_clicks'), Input('interval-component', 'n_intervals')
         ],
         [State('experiment-detail-table', 'rows'), State('experiment-detail-table', 'selected_row_indices')]
     )
-    def update_experiment_trials_json(aggregate_mode, n_clicks, n_intervals, exp_rows, exp_selected_rows):
+    def update_experiment_summary_json(aggregate_mode, n_clicks, n_intervals, exp_rows, exp_selected_rows):
         if exp_selected_rows is None:
             exp_selected_rows = []
-        selected_experiments = []
-        for i in exp_selected_rows:
-            selected_experiments.append(exp_rows[i])
-        experiment_ids = [int(exp['id']) for exp in selected_experiments]
-        step_metric_data, summary_metric_data = create_metric_series(experiment_ids)
-        json_step_data = {json.dumps(key): [v.to_json() for v in value] for key, value in step_metric_data.items()}
-        json_summary_data = {json.dumps(key): [v.to_json() for v in value] for key, value in summary_metric_data.items()}
-        return json.dumps([json_step_data, json_summary_data])
+        experiment_ids = [int(exp_rows[i]['id']) for i in exp_selected_rows]
+        return json.dumps(summarize_experiments(experiment_ids))
 
     @app.callback(
         Output('experiment-trials-table', 'rows'),
         [
-            Input('experiment-trials-json', 'children'),
+            Input('experiment-summary-json', 'children'),
         ]
     )
-    def update_experiment_trials_table(metric_json):
-        step_metric_data, summary_metric_data = load_json_metrics(metric_json)
-        return experiment_table(summary_metric_data, step_metric_data)
+    def update_experiment_trials_table(summary_json):
+        if summary_json is None or summary_json == '':
+            return []
+        return experiment_table(json.loads(summary_json))
 
     @app.callback(
         Output('experiment-aggregate-trials-table', 'rows'),
-        [Input('experiment-trials-json', 'children'), Input('metric-name-filter', 'value')]
+        [Input('experiment-summary-json', 'children'), Input('metric-name-filter', 'value')]
     )
-    def update_experiment_aggregate_trials_table(metric_json, metric_name_filter):
-        if metric_json == '':
+    def update_experiment_aggregate_trials_table(summary_json, metric_name_filter):
+        if summary_json is None or summary_json == '':
             return []
-        step_metric_data, summary_metric_data = load_json_metrics(metric_json)
-        metric_statistics, metric_names = compute_experiment_aggregate_rows(step_metric_data, summary_metric_data)
         rows = []
-        for exp_id, metric_dict in metric_statistics.items():
-            for name in metric_names:
-                if metric_name_filter is None or metric_name_filter in name:
-                    r = {'experiment_id': exp_id, 'metric': name}
-                    if name in metric_dict:
-                        m_mean, m_max, m_std = metric_dict[name]
-                        r['avg'] = m_mean
-                        r['max'] = m_max
-                        r['std'] = m_std
-                        rows.append(r)
-
+        for summary in json.loads(summary_json):
+            for metric in summary['metrics']:
+                if metric_name_filter is None or metric_name_filter in metric['metric']:
+                    rows.append({
+                        'experiment_id': summary['experiment'], 'metric': metric['metric'],
+                        'avg': metric['mean'], 'max': metric['max'], 'std': metric['std']
+                    })
         return rows
 
     @app.callback(
@@ -260,50 +350,6 @@ def create_app():
     return app
 
 
-MetricDataLookup = Dict[Tuple[int, str], List[MetricSeries]]
-
-
-def compute_experiment_aggregate_rows(step_metric_data, summary_metric_data):
-    metric_statistics = defaultdict(dict)
-    metric_names = set()
-
-    for (experiment_id, metric_name), val in step_metric_data.items():
-        metric_statistics[experiment_id][metric_name] = compute_experiment_statistics(val)
-        metric_names.add(metric_name)
-
-    for (experiment_id, metric_name), val in summary_metric_data.items():
-        metric_statistics[experiment_id][metric_name] = compute_experiment_statistics(val)
-        metric_names.add(metric_name)
-
-    return metric_statistics, metric_names
-
-
-def load_json_metrics(metric_json) -> Tuple[MetricDataLookup, MetricDataLookup]:
-    json_step_metric_data, json_summary_metric_data = json.loads(metric_json)
-    step_metric_data = {
-        tuple(json.loads(key)): [MetricSeries.from_json(v) for v in value] for key, value in json_step_metric_data.items()
-    }
-    summary_metric_data = {
-        tuple(json.loads(key)): [MetricSeries.from_json(v) for v in value] for key, value in json_summary_metric_data.items()
-    }
-    return step_metric_data, summary_metric_data
-
-def compute_experiment_statistics(trial_metric_series: List[MetricSeries]):
-    values = []
-    for ms in trial_metric_series:
-        if len(ms.values) == 0:
-            continue
-        elif len(ms.values) == 1:
-            values.append(ms.values[0])
-        else:
-            if ms.mode == 'max':
-                values.append(max(ms.values))
-            elif ms.mode == 'min':
-                values.append(min(ms.values))
-            else:
-                raise ValueError(f'Invalid mode {ms.mode}')
-    return np.mean(values), np.max(values), np.std(values)
-
 def filter_dictionaries(dictionaries):
     all_kvs = []
     for curr_dict in dictionaries:
@@ -429,7 +475,9 @@ def index():
         min_height=1000
     )
 
+    page_key = html.Div(uuid.uuid4().hex, id='page-key', style={'display': 'none'})
     experiment_trials_json = html.Div(id='experiment-trials-json', style={'display': 'none'})
+    experiment_summary_json = html.Div(id='experiment-summary-json', style={'display': 'none'})
     experiment_aggregate_trials_table = dt.DataTable(
         rows=[{}], id='experiment-aggregate-trials-table',
         selected_row_indices=[],
@@ -437,9 +485,11 @@ def index():
         min_height=1000
     )
     experiment_trials_div = html.Div(
-        id='experiment-trials-json',
+        id='experiment-trials-div',
         children=[
+            page_key,
             experiment_trials_json,
+            experiment_summary_json,
             html.H5('All Trials'),
             experiment_trials_table,
             html.H5('Aggregated Trials'),
@@ -466,70 +516,68 @@ MetricData = Dict[Tuple[int, str], List[MetricSeries]]
 
 
 def create_metric_series(experiment_ids):
-    step_metric_data: MetricData = defaultdict(list)
-    summary_metric_data: MetricData = defaultdict(list)
+    """
+    Load the series of every result of the selected experiments with two queries however many experiments, trials,
+    and metrics are selected: one for the results with their trial, experiment, and metric, and one for their values.
+    """
+    series = {}
+    update_metric_series(experiment_ids, series)
+    return split_metric_series(series)
+
+
+def update_metric_series(experiment_ids, series: Dict[int, MetricSeries]) -> bool:
+    """
+    Bring series, a dictionary from result id to its series, up to date in place with the results of the selected
+    experiments. Only series that changed since their revision are read, and those that were only appended to since
+    then only read their new values (see kuro.web.series).
+    :return: whether any series changed
+    """
+    since = {
+        result_id: (m.revision, m.steps[-1] if len(m.steps) > 0 else None) for result_id, m in series.items()
+    }
+    updates = series_updates(experiment_ids, since)
+    for result_id in updates['removed']:
+        del series[result_id]
+    for update in updates['results']:
+        held = series.get(update['result'])
+        if update['replace'] or held is None:
+            series[update['result']] = MetricSeries(
+                update['identifier'], update['experiment'], update['trial'], update['metric'], update['mode'],
+                update['values'], update['steps'], update['result'], update['revision']
+            )
+        else:
+            held.steps.extend(update['steps'])
+            held.values.extend(update['values'])
+            held.revision = update['revision']
+    return len(updates['removed']) > 0 or len(updates['results']) > 0
 
-    for experiment in Experiment.objects.filter(id__in=experiment_ids):
-        for trial in experiment.trials.all():
-            for r in trial.results.all():
-                metric_name = r.metric.name
-                metric_mode = r.metric.mode
-                result_values = r.result_values.all()
-                steps = [v.step for v in result_values]
-                values = [v.value for v in result_values]
-                if len(steps) == 1:
-                    summary_metric_data[(experiment.id, metric_name)].append(MetricSeries(
-                        experiment.identifier, experiment.id, trial.id, metric_name, metric_mode, values, steps
-                    ))
-                else:
-                    step_metric_data[(experiment.id, metric_name)].append(MetricSeries(
-                        experiment.identifier, experiment.id, trial.id, metric_name, metric_mode, values, steps
-                    ))
 
+def split_metric_series(series: Dict[int, MetricSeries]) -> Tuple[MetricData, MetricData]:
+    """
+    Group series by experiment and metric name ordered by trial. Results with exactly one value are summary metrics,
+    the others are step metrics.
+    """
+    step_metric_data: MetricData = defaultdict(list)
+    summary_metric_data: MetricData = defaultdict(list)
+    for m in sorted(series.values(), key=lambda m: (m.experiment_id, m.trial_id, m.result_id)):
+        metric_data = summary_metric_data if len(m.steps) == 1 else step_metric_data
+        metric_data[(m.experiment_id, m.name)].append(m)
     return step_metric_data, summary_metric_data
 
 
-def extract_metric_series_value(metric: MetricSeries):
-    if len(metric.values) == 1:
-        return metric.values[0]
-    elif len(metric.values) == 0:
-        raise ValueError('Missing metric values')
-    else:
-        if metric.mode == 'max':
-            return max(metric.values)
-        elif metric.mode == 'min':
-            return min(metric.values)
-        else:
-            raise ValueError('Invalid mode, must be max or min')
-
-def experiment_table(summary_metric_data: MetricData, step_metric_data: MetricData):
-    metric_names = set()
-    for ms_list in summary_metric_data.values():
-        for ms in ms_list:
-            metric_names.add(ms.name)
-
-    for ms_list in step_metric_data.values():
-        for ms in ms_list:
-            metric_names.add(ms.name)
-
-    exp_trial_lookup = defaultdict(dict)
-    for ms_list in summary_metric_data.values():
-        for ms in ms_list:
-            exp_trial_lookup[(ms.experiment_id, ms.trial_id)][ms.name] = ms
-    for ms_list in step_metric_data.values():
-        for ms in ms_list:
-            exp_trial_lookup[(ms.experiment_id, ms.trial_id)][ms.name] = ms
-
+def experiment_table(summaries):
+    """
+    Rows of the trials table from experiment summaries (see kuro.web.summaries), one per trial with the best value of
+    each metric
+    """
+    metric_names = {name for summary in summaries for trial in summary['trials'] for name in trial['values']}
     rows = []
-    for (experiment_id, trial_id), metric_dict in exp_trial_lookup.items():
-        r = {'experiment_id': experiment_id, 'trial_id': trial_id}
-        for name in metric_names:
-            if name in metric_dict:
-                r[name] = extract_metric_series_value(metric_dict[name])
-            else:
-                r[name] = None
-        rows.append(r)
-
+    for summary in summaries:
+        for trial in summary['trials']:
+            r = {'experiment_id': summary['experiment'], 'trial_id': trial['trial']}
+            for name in metric_names:
+                r[name] = trial['values'].get(name)
+            rows.append(r)
     return rows
 
 
@@ -0,0 +1,124 @@
+"""
+Pagination and filtering shared by the list endpoints. Every list is paginated with a cursor over the primary key, so
+pages stay stable while new rows are inserted and each page is one indexed range query however deep it is. Views
+declare the query parameters they can be filtered by in query_filters, which are also published in the API schema so
+that coreapi clients can send them, as are the fields and expand parameters of ExpansionBackend.
+"""
+import coreapi
+import coreschema
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.pagination import CursorPagination
+
+
+def query_list(request, name):
+    """
+    :return: the comma separated values of a query parameter, or None if it is not given
+    """
+    if request is None:
+        return None
+    value = getattr(request, 'query_params', request.GET).get(name)
+    if value is None:
+        return None
+    return [v.strip() for v in value.split(',') if len(v.strip()) > 0]
+
+
+class IdCursorPagination(CursorPagination):
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+def _parse_bool(value):
+    if value.lower() in ('true', '1'):
+        return True
+    if value.lower() in ('false', '0'):
+        return False
+    raise ValueError(value)
+
+
+class QueryFilter:
+    """
+    A query parameter that filters the queryset with an ORM lookup
+    :param lookup: ORM lookup the parameter filters on, such as result__trial_id or step__gt
+    :param kind: integer, string, or boolean
+    :param description: description shown in the API schema
+    """
+    parsers = {'integer': int, 'string': str, 'boolean': _parse_bool}
+    schemas = {'integer': coreschema.Integer, 'string': coreschema.String, 'boolean': coreschema.Boolean}
+
+    def __init__(self, lookup, kind='integer', description=''):
+        if kind not in self.parsers:
+            raise ValueError(f'kind must be one of {tuple(self.parsers)}')
+        self.lookup = lookup
+        self.kind = kind
+        self.description = description
+
+    def parse(self, name, value):
+        try:
+            return self.parsers[self.kind](value)
+        except ValueError:
+            raise ValidationError({name: f'Expected {self.kind}'})
+
+
+class QueryFilterBackend(BaseFilterBackend):
+    """
+    Filters a view's queryset by the query parameters in its query_filters, a dictionary from parameter name to
+    QueryFilter. Parameters that are not given do not filter.
+    """
+    def filter_queryset(self, request, queryset, view):
+        lookups = {}
+        for name, query_filter in getattr(view, 'query_filters', {}).items():
+            if name in request.query_params:
+                lookups[query_filter.lookup] = query_filter.parse(name, request.query_params[name])
+        if len(lookups) == 0:
+            return queryset
+        return queryset.filter(**lookups)
+
+    def get_schema_fields(self, view):
+        return [
+            coreapi.Field(
+                name=name, required=False, location='query',
+                schema=query_filter.schemas[query_filter.kind](description=query_filter.description)
+            )
+            for name, query_filter in getattr(view, 'query_filters', {}).items()
+        ]
+
+
+class ExpansionBackend(BaseFilterBackend):
+    """
+    Loads the related objects rendered by a view with select_related and prefetch_related according to the fields and
+    expand query parameters of its serializer (see ExpandableFieldsMixin), so lists take a constant number of queries
+    however many objects they return
+    """
+    def filter_queryset(self, request, queryset, view):
+        serializer_class = view.get_serializer_class()
+        if not hasattr(serializer_class, 'related_lookups'):
+            return queryset
+        select, prefetch = serializer_class.related_lookups(
+            query_list(request, 'fields'), query_list(request, 'expand')
+        )
+        if len(select) > 0:
+            queryset = queryset.select_related(*select)
+        if len(prefetch) > 0:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
+
+    def get_schema_fields(self, view):
+        serializer_class = view.get_serializer_class()
+        if not hasattr(serializer_class, 'related_lookups'):
+            return []
+        return [
+            coreapi.Field(
+                name='fields', required=False, location='query',
+                schema=coreschema.String(description='Comma separated fields to include, defaults to all')
+            ),
+            coreapi.Field(
+                name='expand', required=False, location='query',
+                schema=coreschema.String(
+                    description='Comma separated related fields to render as objects instead of hyperlinks, '
+                                'use dots to expand their fields such as experiment.metrics'
+                )
+            ),
+        ]
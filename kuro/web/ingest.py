@@ -0,0 +1,284 @@
+from collections import OrderedDict
+
+import numpy as np
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, FloatField, BigIntegerField, Q, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from kuro.web.models import Experiment, Trial, Metric, Result
+from kuro.web.storage import get_storage
+from kuro.web.summaries import series_summary
+from kuro.web.versions import RESULT_VALUES, bump_versions
+
+
+# Process level caches for write_point. Trials never change experiment and results are never moved, so entries only
+# become stale when rows are deleted, which clears the caches below. Entries for rows created by a request are only
+# added once its transaction commits so a rollback cannot leave ids of rows that do not exist. Metric modes are
+# dropped when a metric is saved. Deletes by other server processes do not clear these caches, write_point_atomic
+# recovers from the failed foreign key checks they cause.
+MAX_CACHE_SIZE = 100000
+_trial_experiments = {}
+_experiment_metrics = set()
+_results = {}
+_metric_modes = {}
+# Results whose series are read at once when the summaries of a metric's results are recomputed
+RECOMPUTE_BATCH_SIZE = 500
+
+
+class MissingObjects(Exception):
+    def __init__(self, model, ids):
+        self.model = model
+        self.ids = sorted(ids)
+        super().__init__(f'{model.__name__} objects do not exist: {self.ids}')
+
+
+def write_points(points):
+    """
+    Store many result values with upsert semantics: a point for a (trial, metric, step) that already has a value
+    replaces it. Results are created and metrics are added to experiments as needed. The number of queries depends on
+    the number of distinct results touched, not on the number of points. Callers are responsible for running this
+    inside a transaction.
+
+    :param points: iterable of (trial_id, metric_id, step, value) tuples, later points win over earlier ones
+    :return: number of distinct values written
+    """
+    values = OrderedDict()
+    for trial_id, metric_id, step, value in points:
+        values[(trial_id, metric_id, step)] = value
+    if len(values) == 0:
+        return 0
+
+    trial_ids = {trial_id for trial_id, _, _ in values}
+    metric_ids = {metric_id for _, metric_id, _ in values}
+    trial_experiments = dict(Trial.objects.filter(id__in=trial_ids).values_list('id', 'experiment_id'))
+    if len(trial_experiments) != len(trial_ids):
+        raise MissingObjects(Trial, trial_ids - set(trial_experiments))
+    metric_modes = dict(Metric.objects.filter(id__in=metric_ids).values_list('id', 'mode'))
+    if len(metric_modes) != len(metric_ids):
+        raise MissingObjects(Metric, metric_ids - set(metric_modes))
+
+    experiment_metrics = {(trial_experiments[t], m) for t, m, _ in values}
+    _add_experiment_metrics(experiment_metrics)
+
+    result_ids = _get_or_create_results({(t, m) for t, m, _ in values})
+    result_values = {}
+    for (trial_id, metric_id, step), value in values.items():
+        result_values.setdefault(result_ids[(trial_id, metric_id)], {})[step] = value
+    get_storage().write_values(result_values)
+    update_summaries(result_values, {result_ids[(t, m)]: metric_modes[m] for t, m, _ in values})
+    bump_versions(RESULT_VALUES)
+    return len(values)
+
+
+def _add_experiment_metrics(experiment_metrics):
+    through = Experiment.metrics.through
+    experiment_ids = {e for e, _ in experiment_metrics}
+    existing = set(
+        through.objects.filter(experiment_id__in=experiment_ids).values_list('experiment_id', 'metric_id')
+    )
+    missing = experiment_metrics - existing
+    if len(missing) != 0:
+        through.objects.bulk_create([through(experiment_id=e, metric_id=m) for e, m in missing])
+        bump_versions('experiment')
+
+
+def _get_or_create_results(trial_metrics):
+    trial_ids = {t for t, _ in trial_metrics}
+
+    def lookup():
+        return {
+            (t, m): r for r, t, m in Result.objects.filter(trial_id__in=trial_ids).values_list('id', 'trial_id', 'metric_id')
+            if (t, m) in trial_metrics
+        }
+
+    result_ids = lookup()
+    missing = trial_metrics - set(result_ids)
+    if len(missing) != 0:
+        try:
+            with transaction.atomic():
+                Result.objects.bulk_create([Result(trial_id=t, metric_id=m) for t, m in missing])
+        except IntegrityError:
+            # A concurrent request created some of these results first, get_or_create reads those it committed
+            for t, m in missing:
+                Result.objects.get_or_create(trial_id=t, metric_id=m)
+        bump_versions('result')
+        # bulk_create does not return primary keys on every database so they are looked up again
+        result_ids = lookup()
+    return result_ids
+
+
+def write_point(trial_id, metric_id, step, value):
+    """
+    Store a single result value with upsert semantics. This is the hot path for clients reporting one value at a
+    time, once a trial and metric have been seen by this process it costs a single INSERT ... ON CONFLICT statement
+    with row storage.
+    Callers are responsible for running this inside a transaction.
+
+    :return: (result_id, result_value_id), result_value_id is None with chunk storage
+    """
+    experiment_id = _trial_experiments.get(trial_id)
+    if experiment_id is None:
+        experiment_id = Trial.objects.filter(id=trial_id).values_list('experiment_id', flat=True).first()
+        if experiment_id is None:
+            raise MissingObjects(Trial, [trial_id])
+        _cache_set(_trial_experiments, trial_id, experiment_id)
+
+    mode = _metric_modes.get(metric_id)
+    if mode is None:
+        mode = Metric.objects.filter(id=metric_id).values_list('mode', flat=True).first()
+        if mode is None:
+            raise MissingObjects(Metric, [metric_id])
+        _cache_set(_metric_modes, metric_id, mode)
+
+    result_id = _results.get((trial_id, metric_id))
+    if result_id is None:
+        result, created = Result.objects.get_or_create(trial_id=trial_id, metric_id=metric_id)
+        result_id = result.id
+        _cache_on_commit(created, lambda: _cache_set(_results, (trial_id, metric_id), result_id))
+
+    if (experiment_id, metric_id) not in _experiment_metrics:
+        _, created = Experiment.metrics.through.objects.get_or_create(experiment_id=experiment_id, metric_id=metric_id)
+        if created:
+            bump_versions('experiment')
+        _cache_on_commit(created, lambda: _cache_add(_experiment_metrics, (experiment_id, metric_id)))
+
+    result_value_id = get_storage().write_value(result_id, step, value)
+    update_summaries({result_id: {step: value}}, {result_id: mode})
+    bump_versions(RESULT_VALUES)
+    return result_id, result_value_id
+
+
+def write_point_atomic(trial_id, metric_id, step, value):
+    """
+    Run write_point in its own transaction. A trial or result deleted by another server process can still be cached
+    by this one, writing with its id then fails the foreign key checks when the transaction commits. The caches are
+    then cleared and the write is retried once, so a deleted trial raises MissingObjects instead of IntegrityError.
+    This must not be called inside a transaction, where the checks are deferred until the outer transaction commits.
+    """
+    try:
+        with transaction.atomic():
+            return write_point(trial_id, metric_id, step, value)
+    except IntegrityError:
+        clear_caches()
+        with transaction.atomic():
+            return write_point(trial_id, metric_id, step, value)
+
+
+def update_summaries(result_values, result_modes):
+    """
+    Update the summary fields of results after their values were written. Values after a result's last step are
+    merged into its summary by a single conditional UPDATE, which is atomic with concurrent appends to the same
+    result. Results where a value was written at or before the last step, replacing a value or filling a gap, have
+    their summary recomputed from their series while the result is locked, see recompute_summaries.
+    :param result_values: dictionary from result id to a dictionary from step to value
+    :param result_modes: dictionary from result id to the mode of its metric
+    """
+    now = timezone.now()
+    stale = []
+    for result_id, points in result_values.items():
+        steps = sorted(points)
+        values = np.array([points[step] for step in steps], dtype=np.float64)
+        batch = series_summary(steps, values, result_modes[result_id])
+        if np.isnan(batch['best_value']):
+            better = Q(pk__in=[])
+        elif result_modes[result_id] == Metric.MAX:
+            better = Q(best_value__isnull=True) | Q(best_value__lt=batch['best_value'])
+        else:
+            better = Q(best_value__isnull=True) | Q(best_value__gt=batch['best_value'])
+        appended = Result.objects.filter(
+            Q(last_step__isnull=True) | Q(last_step__lt=batch['first_step']), id=result_id
+        ).update(
+            count=F('count') + batch['count'],
+            first_step=Coalesce(F('first_step'), Value(batch['first_step'])),
+            last_step=batch['last_step'],
+            last_value=batch['last_value'],
+            best_step=Case(
+                When(better, then=Value(batch['best_step'])), default=F('best_step'), output_field=BigIntegerField()
+            ),
+            best_value=Case(
+                When(better, then=Value(batch['best_value'])), default=F('best_value'), output_field=FloatField()
+            ),
+            updated_at=now,
+            revision=F('revision') + 1
+        )
+        if not appended:
+            stale.append(result_id)
+    if len(stale) > 0:
+        recompute_summaries(stale)
+
+
+def recompute_summaries(result_ids):
+    """
+    Recompute the summary fields of results from their series after values were replaced or removed, which also marks
+    the new revision as a rewrite. The results are locked first, so an append committing while the series is read
+    waits and then merges into the recomputed summary instead of being overwritten by it. Callers are responsible for
+    running this inside a transaction.
+    """
+    now = timezone.now()
+    modes = dict(Result.objects.select_for_update().filter(id__in=list(result_ids)).order_by('id').values_list(
+        'id', 'metric__mode'
+    ))
+    series = get_storage().read_series(list(modes))
+    for result_id, mode in modes.items():
+        steps, values = series.get(result_id, ([], []))
+        Result.objects.filter(id=result_id).update(
+            updated_at=now, revision=F('revision') + 1, rewritten_revision=F('revision') + 1,
+            **series_summary(steps, values, mode)
+        )
+
+
+def _cache_set(cache, key, value):
+    if len(cache) >= MAX_CACHE_SIZE:
+        cache.clear()
+    cache[key] = value
+
+
+def _cache_add(cache, key):
+    if len(cache) >= MAX_CACHE_SIZE:
+        cache.clear()
+    cache.add(key)
+
+
+def _cache_on_commit(created, fn):
+    if created:
+        transaction.on_commit(fn)
+    else:
+        fn()
+
+
+def clear_caches():
+    _trial_experiments.clear()
+    _experiment_metrics.clear()
+    _results.clear()
+    _metric_modes.clear()
+
+
+@receiver(post_delete, sender=Experiment)
+@receiver(post_delete, sender=Trial)
+@receiver(post_delete, sender=Metric)
+@receiver(post_delete, sender=Result)
+def _clear_caches_on_delete(sender, **kwargs):
+    clear_caches()
+
+
+@receiver(pre_save, sender=Metric)
+def _read_metric_mode(sender, instance, **kwargs):
+    instance._saved_mode = None
+    if instance.id is not None:
+        instance._saved_mode = Metric.objects.filter(id=instance.id).values_list('mode', flat=True).first()
+
+
+@receiver(post_save, sender=Metric)
+def _update_metric_mode(sender, instance, created, **kwargs):
+    _metric_modes.pop(instance.id, None)
+    # The best values of the metric's results were chosen with the old mode. Updating mode with QuerySet.update skips
+    # this, recompute_summaries must then be called for the metric's results.
+    if not created and getattr(instance, '_saved_mode', None) not in (None, instance.mode):
+        result_ids = list(Result.objects.filter(metric_id=instance.id).order_by('id').values_list('id', flat=True))
+        with transaction.atomic():
+            for start in range(0, len(result_ids), RECOMPUTE_BATCH_SIZE):
+                recompute_summaries(result_ids[start:start + RECOMPUTE_BATCH_SIZE])
+            bump_versions(RESULT_VALUES)
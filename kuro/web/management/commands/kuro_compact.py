@@ -0,0 +1,87 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from kuro.web.compaction import downsample
+from kuro.web.ingest import recompute_summaries
+from kuro.web.models import Result
+from kuro.web.storage import VALUE_DTYPE, STEP_DTYPE, get_storage
+from kuro.web.versions import RESULT_VALUES, bump_versions
+
+
+class Command(BaseCommand):
+    help = (
+        'Downsample the result series of trials completed more than --older-than days ago to at most --points values '
+        'each with LTTB, always keeping the best and the last value. Each batch of results is compacted in its own '
+        'transaction so reporting is only blocked for one batch at a time.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=float, default=30, help='days since the trial was completed')
+        parser.add_argument('--points', type=int, default=1000, help='number of values kept per result')
+        parser.add_argument('--batch-size', type=int, default=20, help='number of results compacted per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='report what would be removed without removing it')
+
+    def handle(self, *args, **options):
+        n_points = options['points']
+        if n_points < 2:
+            raise CommandError('--points must be at least 2 to keep the best and the last value')
+        batch_size = options['batch_size']
+        storage = get_storage()
+        cutoff = timezone.now() - timedelta(days=options['older_than'])
+        # Trials completed before completed_at was recorded are aged by when they started
+        results = Result.objects.filter(trial__complete=True).filter(
+            Q(trial__completed_at__lt=cutoff) | Q(trial__completed_at__isnull=True, trial__started_at__lt=cutoff)
+        ).order_by('id').values_list('id', 'metric__mode')
+        result_modes = dict(results)
+        result_ids = list(result_modes)
+
+        free_bytes = _free_bytes()
+        n_compacted = 0
+        n_removed = 0
+        for start in range(0, len(result_ids), batch_size):
+            batch = result_ids[start:start + batch_size]
+            # Results that were already compacted are skipped without reading their values
+            stats = storage.value_stats(batch)
+            batch = [r for r in batch if r in stats and stats[r][0] > n_points]
+            if len(batch) > 0:
+                with transaction.atomic():
+                    series = storage.read_series(batch)
+                    compacted = {}
+                    for result_id, (steps, values) in series.items():
+                        selected = downsample(steps, values, n_points, result_modes[result_id])
+                        compacted[result_id] = dict(zip(steps[selected].tolist(), values[selected].tolist()))
+                        n_removed += len(steps) - len(selected)
+                    if not options['dry_run']:
+                        storage.delete(compacted)
+                        storage.write_values(compacted)
+                        recompute_summaries(compacted)
+                        bump_versions(RESULT_VALUES)
+                n_compacted += len(compacted)
+            self.stdout.write(f'Compacted {min(start + batch_size, len(result_ids))}/{len(result_ids)} results')
+
+        verb = 'Would remove' if options['dry_run'] else 'Removed'
+        value_bytes = n_removed * (STEP_DTYPE.itemsize + VALUE_DTYPE.itemsize)
+        message = (
+            f'{verb} {n_removed} values ({value_bytes / 2 ** 20:.1f} MiB of steps and values) from {n_compacted} of '
+            f'{len(result_ids)} results stored as {storage.name}'
+        )
+        if free_bytes is not None and not options['dry_run']:
+            message += f', {max(_free_bytes() - free_bytes, 0) / 2 ** 20:.1f} MiB of database pages freed for reuse'
+        self.stdout.write(self.style.SUCCESS(message))
+
+
+def _free_bytes():
+    """
+    :return: bytes of free pages in a SQLite database, None for other databases
+    """
+    if connection.vendor != 'sqlite':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA freelist_count')
+        free_pages = cursor.fetchone()[0]
+        cursor.execute('PRAGMA page_size')
+        return free_pages * cursor.fetchone()[0]
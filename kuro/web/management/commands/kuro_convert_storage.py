@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from kuro.web.models import Result
+from kuro.web.storage import get_storage
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy result values from one storage backend to the other, see kuro.web.storage. Run it before changing '
+        'KURO_RESULT_STORAGE and while no values are being reported.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--to', required=True, choices=['rows', 'chunks'], help='storage backend to convert to')
+        parser.add_argument('--batch-size', type=int, default=100, help='number of results converted per transaction')
+        parser.add_argument(
+            '--keep', action='store_true', help='keep the values in the old backend instead of deleting them'
+        )
+
+    def handle(self, *args, **options):
+        target = get_storage(options['to'])
+        source = get_storage('chunks' if target.name == 'rows' else 'rows')
+        batch_size = options['batch_size']
+        result_ids = list(Result.objects.order_by('id').values_list('id', flat=True))
+        n_values = 0
+        for start in range(0, len(result_ids), batch_size):
+            batch = result_ids[start:start + batch_size]
+            with transaction.atomic():
+                series = source.read_series(batch)
+                # Deleting first makes the conversion safe to run again after an interruption
+                target.delete(batch)
+                target.write_values({
+                    result_id: dict(zip(steps.tolist(), values.tolist()))
+                    for result_id, (steps, values) in series.items()
+                })
+                if not options['keep']:
+                    source.delete(batch)
+            n_values += sum(len(steps) for steps, _ in series.values())
+            self.stdout.write(f'Converted {min(start + batch_size, len(result_ids))}/{len(result_ids)} results')
+        self.stdout.write(self.style.SUCCESS(
+            f'Converted {n_values} values of {len(result_ids)} results from {source.name} to {target.name}'
+        ))
@@ -0,0 +1,36 @@
+# Generated by Django 2.0.13 on 2026-10-18 04:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.IntegerField()),
+                ('count', models.IntegerField()),
+                ('min_step', models.BigIntegerField()),
+                ('max_step', models.BigIntegerField()),
+                ('min_value', models.FloatField()),
+                ('max_value', models.FloatField()),
+                ('step_data', models.BinaryField()),
+                ('value_data', models.BinaryField()),
+                ('result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='web.Result')),
+            ],
+            options={
+                'ordering': ('result', 'index'),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='resultchunk',
+            unique_together={('result', 'index')},
+        ),
+    ]
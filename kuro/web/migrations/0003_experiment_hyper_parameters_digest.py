@@ -0,0 +1,31 @@
+from django.db import migrations, models
+import kuro.web.models
+
+
+def backfill_digests(apps, schema_editor):
+    Experiment = apps.get_model('web', 'Experiment')
+    for experiment in Experiment.objects.all().only('id', 'hyper_parameters'):
+        Experiment.objects.filter(id=experiment.id).update(
+            hyper_parameters_digest=kuro.web.models.hyper_parameters_digest(experiment.hyper_parameters)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0002_result_chunk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='experiment',
+            name='hyper_parameters_digest',
+            field=models.CharField(default='', editable=False, max_length=64),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_digests, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='experiment',
+            unique_together={('group', 'identifier', 'hyper_parameters_digest')},
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+def backfill_n_claimed(apps, schema_editor):
+    Experiment = apps.get_model('web', 'Experiment')
+    Trial = apps.get_model('web', 'Trial')
+    counts = Trial.objects.order_by().values('experiment_id').annotate(n=models.Count('id')).values_list('experiment_id', 'n')
+    for experiment_id, n in counts:
+        Experiment.objects.filter(id=experiment_id).update(n_claimed=n)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0003_experiment_hyper_parameters_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='experiment',
+            name='n_claimed',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_n_claimed, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+NAMES = ('experiment', 'trial', 'worker', 'metric', 'result', 'resultvalue')
+
+
+def create_versions(apps, schema_editor):
+    DataVersion = apps.get_model('web', 'DataVersion')
+    DataVersion.objects.bulk_create([DataVersion(name=name) for name in NAMES])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0004_experiment_n_claimed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('version', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(create_versions, migrations.RunPython.noop),
+    ]
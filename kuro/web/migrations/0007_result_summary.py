@@ -0,0 +1,104 @@
+from django.db import migrations, models
+from django.utils import timezone
+import numpy as np
+
+
+# Frozen copies of kuro.web.storage and kuro.web.summaries as of this migration, so later changes to them do not
+# change what it does
+STEP_DTYPE = np.dtype('<i8')
+VALUE_DTYPE = np.dtype('<f8')
+
+
+def series_summary(steps, values, mode):
+    if len(steps) == 0:
+        return {
+            'count': 0, 'first_step': None, 'last_step': None, 'last_value': None, 'best_step': None,
+            'best_value': None
+        }
+    if mode == 'max':
+        best = int(np.argmax(np.where(np.isnan(values), -np.inf, values)))
+    else:
+        best = int(np.argmin(np.where(np.isnan(values), np.inf, values)))
+    return {
+        'count': len(steps),
+        'first_step': int(steps[0]),
+        'last_step': int(steps[-1]),
+        'last_value': float(values[-1]),
+        'best_step': int(steps[best]),
+        'best_value': float(values[best])
+    }
+
+
+def backfill_summaries(apps, schema_editor):
+    Result = apps.get_model('web', 'Result')
+    ResultValue = apps.get_model('web', 'ResultValue')
+    ResultChunk = apps.get_model('web', 'ResultChunk')
+    now = timezone.now()
+    result_modes = list(Result.objects.order_by('id').values_list('id', 'metric__mode'))
+    batch_size = 500
+    for start in range(0, len(result_modes), batch_size):
+        batch = dict(result_modes[start:start + batch_size])
+        # A result's values are stored as rows or chunks depending on the storage it was written with
+        series = {result_id: ([], []) for result_id in batch}
+        for result_id, step, value in ResultValue.objects.filter(result_id__in=batch).values_list(
+            'result_id', 'step', 'value'
+        ):
+            series[result_id][0].append(step)
+            series[result_id][1].append(value)
+        for result_id, step_data, value_data in ResultChunk.objects.filter(result_id__in=batch).values_list(
+            'result_id', 'step_data', 'value_data'
+        ):
+            series[result_id][0].extend(np.frombuffer(step_data, dtype=STEP_DTYPE).tolist())
+            series[result_id][1].extend(np.frombuffer(value_data, dtype=VALUE_DTYPE).tolist())
+        for result_id, (steps, values) in series.items():
+            steps = np.array(steps, dtype=np.int64)
+            values = np.array(values, dtype=np.float64)
+            order = np.argsort(steps, kind='mergesort')
+            summary = series_summary(steps[order], values[order], batch[result_id])
+            Result.objects.filter(id=result_id).update(updated_at=now, **summary)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0006_trial_completed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='result',
+            name='count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='result',
+            name='first_step',
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='result',
+            name='last_step',
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='result',
+            name='last_value',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='result',
+            name='best_step',
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='result',
+            name='best_value',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='result',
+            name='updated_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
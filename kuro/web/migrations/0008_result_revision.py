@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0007_result_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='result',
+            name='revision',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='result',
+            name='rewritten_revision',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
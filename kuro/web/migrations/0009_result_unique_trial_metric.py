@@ -0,0 +1,101 @@
+from django.db import migrations
+from django.db.models import Count, F
+from django.utils import timezone
+import numpy as np
+
+
+# Frozen copies of kuro.web.storage and kuro.web.summaries as of this migration, so later changes to them do not
+# change what it does
+CHUNK_SIZE = 512
+STEP_DTYPE = np.dtype('<i8')
+VALUE_DTYPE = np.dtype('<f8')
+
+
+def series_summary(steps, values, mode):
+    if len(steps) == 0:
+        return {
+            'count': 0, 'first_step': None, 'last_step': None, 'last_value': None, 'best_step': None,
+            'best_value': None
+        }
+    if mode == 'max':
+        best = int(np.argmax(np.where(np.isnan(values), -np.inf, values)))
+    else:
+        best = int(np.argmin(np.where(np.isnan(values), np.inf, values)))
+    return {
+        'count': len(steps),
+        'first_step': int(steps[0]),
+        'last_step': int(steps[-1]),
+        'last_value': float(values[-1]),
+        'best_step': int(steps[best]),
+        'best_value': float(values[best])
+    }
+
+
+def merge_duplicate_results(apps, schema_editor):
+    """
+    Concurrent reports could create several results for a trial and metric. Their values are merged into the first
+    result, which keeps its own value where both have one, before the others are deleted.
+    """
+    Result = apps.get_model('web', 'Result')
+    ResultValue = apps.get_model('web', 'ResultValue')
+    ResultChunk = apps.get_model('web', 'ResultChunk')
+    duplicates = Result.objects.values('trial_id', 'metric_id').annotate(n=Count('id')).filter(n__gt=1)
+    for duplicate in duplicates:
+        results = list(Result.objects.filter(
+            trial_id=duplicate['trial_id'], metric_id=duplicate['metric_id']
+        ).order_by('id').values_list('id', 'metric__mode'))
+        kept_id, mode = results[0]
+        others = [r for r, _ in results[1:]]
+
+        points = {}
+        for result_id in reversed([kept_id] + others):
+            for step, value in ResultValue.objects.filter(result_id=result_id).values_list('step', 'value'):
+                points[step] = value
+            for step_data, value_data in ResultChunk.objects.filter(result_id=result_id).order_by('index').values_list(
+                'step_data', 'value_data'
+            ):
+                steps = np.frombuffer(step_data, dtype=STEP_DTYPE).tolist()
+                points.update(zip(steps, np.frombuffer(value_data, dtype=VALUE_DTYPE).tolist()))
+        steps = np.array(sorted(points), dtype=STEP_DTYPE)
+        values = np.array([points[s] for s in steps.tolist()], dtype=VALUE_DTYPE)
+
+        # The merged values are stored the way the kept result stores them, as rows unless it has chunks
+        has_chunks = ResultChunk.objects.filter(result_id__in=[kept_id] + others).exists()
+        ResultValue.objects.filter(result_id__in=[kept_id] + others).delete()
+        ResultChunk.objects.filter(result_id__in=[kept_id] + others).delete()
+        if has_chunks:
+            chunks = []
+            for i, start in enumerate(range(0, len(steps), CHUNK_SIZE)):
+                chunk_steps = steps[start:start + CHUNK_SIZE]
+                chunk_values = values[start:start + CHUNK_SIZE]
+                chunks.append(ResultChunk(
+                    result_id=kept_id, index=i, count=len(chunk_steps),
+                    min_step=int(chunk_steps[0]), max_step=int(chunk_steps[-1]),
+                    min_value=float(chunk_values.min()), max_value=float(chunk_values.max()),
+                    step_data=chunk_steps.tobytes(), value_data=chunk_values.tobytes()
+                ))
+            ResultChunk.objects.bulk_create(chunks)
+        else:
+            ResultValue.objects.bulk_create([
+                ResultValue(result_id=kept_id, step=int(s), value=float(v)) for s, v in zip(steps, values)
+            ])
+        Result.objects.filter(id__in=others).delete()
+        Result.objects.filter(id=kept_id).update(
+            updated_at=timezone.now(), revision=F('revision') + 1, rewritten_revision=F('revision') + 1,
+            **series_summary(steps, values, mode)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0008_result_revision'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_results, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='result',
+            unique_together={('trial', 'metric')},
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0009_result_unique_trial_metric'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trial',
+            name='failed',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0010_trial_failed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultTailValue',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('step', models.BigIntegerField()),
+                ('value', models.FloatField()),
+                ('result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tail_values', to='web.Result')),
+            ],
+            options={
+                'ordering': ('result', 'step'),
+            },
+        ),
+        migrations.AlterField(
+            model_name='resultvalue',
+            name='step',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterUniqueTogether(
+            name='resulttailvalue',
+            unique_together={('result', 'step')},
+        ),
+    ]
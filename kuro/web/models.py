@@ -1,4 +1,11 @@
+import hashlib
+import json
+
 from django.db import models
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
 from jsonfield import JSONField
 
 
@@ -34,19 +41,58 @@ class Metric(models.Model):
         return f'Metric(name="{self.name}" mode="{self.mode}")'
 
 
+def hyper_parameters_digest(hyper_parameters) -> str:
+    """
+    sha256 hex digest of the canonical JSON (sorted keys) of hyper parameters given as a dictionary or JSON string
+    """
+    if isinstance(hyper_parameters, str):
+        hyper_parameters = json.loads(hyper_parameters)
+    return hashlib.sha256(json.dumps(hyper_parameters, sort_keys=True).encode('utf8')).hexdigest()
+
+
+class ExperimentQuerySet(models.QuerySet):
+    """
+    Keeps hyper_parameters_digest in sync with hyper_parameters in the bulk writes that bypass Experiment.save
+    """
+    def update(self, **kwargs):
+        if 'hyper_parameters' in kwargs:
+            if hasattr(kwargs['hyper_parameters'], 'resolve_expression'):
+                raise ValueError('hyper_parameters can only be updated to a value, not an expression')
+            kwargs['hyper_parameters_digest'] = hyper_parameters_digest(kwargs['hyper_parameters'])
+        return super().update(**kwargs)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for experiment in objs:
+            experiment.hyper_parameters_digest = hyper_parameters_digest(experiment.hyper_parameters)
+        return super().bulk_create(objs, *args, **kwargs)
+
+
 class Experiment(models.Model):
     group = models.CharField(max_length=100, blank=False)
     identifier = models.CharField(max_length=200, blank=False)
     hyper_parameters = JSONField(default=dict)
+    # Experiments are identified by the digest so lookups use a fixed size index however large the hyper parameters are
+    hyper_parameters_digest = models.CharField(max_length=64, editable=False)
     metrics = models.ManyToManyField(Metric, blank=True)
     n_trials = models.IntegerField(default=1)
+    # Number of trials created for the experiment, trial slots are claimed by incrementing it while it is below n_trials
+    n_claimed = models.IntegerField(default=0, editable=False)
 
+    objects = ExperimentQuerySet.as_manager()
 
     def __str__(self):
         return f'Experiment(id="{self.id}" group="{self.group}" identifier="{self.identifier}" hyper_parameters="{self.hyper_parameters}")'
 
+    def save(self, *args, **kwargs):
+        self.hyper_parameters_digest = hyper_parameters_digest(self.hyper_parameters)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'hyper_parameters' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'hyper_parameters_digest'}
+        super().save(*args, **kwargs)
+
     class Meta:
-        unique_together = ('group', 'identifier', 'hyper_parameters')
+        unique_together = ('group', 'identifier', 'hyper_parameters_digest')
 
 
 class Trial(models.Model):
@@ -54,6 +100,10 @@ class Trial(models.Model):
     experiment = models.ForeignKey(Experiment, on_delete=models.CASCADE, related_name='trials')
     started_at = models.DateTimeField(auto_now_add=True)
     complete = models.BooleanField(default=False)
+    # Set the first time the trial is saved as complete, null for trials completed before it was added
+    completed_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Set when the client reports that the trial raised, cleared when the trial completes
+    failed = models.BooleanField(default=False)
 
     class Meta:
         ordering = ('id', )
@@ -61,18 +111,46 @@ class Trial(models.Model):
     def __str__(self):
         return f'Trial(worker="{self.worker}", experiment="{self.experiment}" started_at="{self.started_at}" complete="{self.complete}")'
 
+    def save(self, *args, **kwargs):
+        if self.complete and self.completed_at is None:
+            self.completed_at = timezone.now()
+        super().save(*args, **kwargs)
+
+
+@receiver(post_delete, sender=Trial)
+def _release_trial_slot(sender, instance, **kwargs):
+    Experiment.objects.filter(id=instance.experiment_id, n_claimed__gt=0).update(n_claimed=F('n_claimed') - 1)
+
 
 class Result(models.Model):
     trial = models.ForeignKey(Trial, on_delete=models.CASCADE, related_name='results')
     metric = models.ForeignKey(Metric, on_delete=models.CASCADE, related_name='results')
+    # Summary of the result's values maintained by kuro.web.ingest as values are written, so tables and leaderboards
+    # read one row per result instead of its series. The best value is the max or min according to the metric's mode,
+    # the earliest step wins ties. All are null while the result has no values.
+    count = models.IntegerField(default=0, editable=False)
+    first_step = models.BigIntegerField(null=True, editable=False)
+    last_step = models.BigIntegerField(null=True, editable=False)
+    last_value = models.FloatField(null=True, editable=False)
+    best_step = models.BigIntegerField(null=True, editable=False)
+    best_value = models.FloatField(null=True, editable=False)
+    updated_at = models.DateTimeField(null=True, editable=False)
+    # Incremented by every write of the result's values. rewritten_revision is the last revision that replaced or
+    # inserted values before the last step, readers holding an older revision must reload the series while newer ones
+    # only need the values after the last step they have (see kuro.web.series)
+    revision = models.IntegerField(default=0, editable=False)
+    rewritten_revision = models.IntegerField(default=0, editable=False)
 
     def __str__(self):
         return f'Result(trial="{self.trial}" metric="{self.metric}")'
 
+    class Meta:
+        unique_together = ('trial', 'metric')
+
 
 class ResultValue(models.Model):
     result = models.ForeignKey(Result, on_delete=models.CASCADE, related_name='result_values')
-    step = models.IntegerField(default=0)
+    step = models.BigIntegerField(default=0)
     value = models.FloatField(blank=False)
 
     def __str__(self):
@@ -81,3 +159,58 @@ class ResultValue(models.Model):
     class Meta:
         unique_together = ('result', 'step')
         ordering = ('result', 'step')
+
+
+class ResultChunk(models.Model):
+    """
+    A contiguous run of a result's values stored as packed little-endian int64 steps and float64 values, used instead
+    of ResultValue rows when KURO_RESULT_STORAGE is chunks (see kuro.web.storage). Chunks of a result are ordered by
+    index and their step ranges do not overlap.
+    """
+    result = models.ForeignKey(Result, on_delete=models.CASCADE, related_name='chunks')
+    index = models.IntegerField()
+    count = models.IntegerField()
+    min_step = models.BigIntegerField()
+    max_step = models.BigIntegerField()
+    min_value = models.FloatField()
+    max_value = models.FloatField()
+    step_data = models.BinaryField()
+    value_data = models.BinaryField()
+
+    def __str__(self):
+        return f'ResultChunk(result="{self.result}" index="{self.index}" count="{self.count}")'
+
+    class Meta:
+        unique_together = ('result', 'index')
+        ordering = ('result', 'index')
+
+
+class ResultTailValue(models.Model):
+    """
+    A value appended to a result with chunk storage that is not packed into a ResultChunk yet. Appends are written as
+    these rows, which are packed into a chunk once a result has a chunk's worth of them, so appending a value does not
+    rewrite a chunk. Their steps are after the last step of the result's chunks.
+    """
+    result = models.ForeignKey(Result, on_delete=models.CASCADE, related_name='tail_values')
+    step = models.BigIntegerField()
+    value = models.FloatField()
+
+    def __str__(self):
+        return f'ResultTailValue(result="{self.result}" step="{self.step}" value="{self.value}")'
+
+    class Meta:
+        unique_together = ('result', 'step')
+        ordering = ('result', 'step')
+
+
+class DataVersion(models.Model):
+    """
+    A counter incremented after every committed write to the table called name, read endpoints derive their ETag and
+    Last-Modified headers from it so unchanged polls are answered without reading the table (see kuro.web.versions)
+    """
+    name = models.CharField(max_length=50, unique=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'DataVersion(name="{self.name}" version="{self.version}")'
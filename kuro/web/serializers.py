@@ -1,10 +1,112 @@
+import sys
+from collections import OrderedDict
+
 from django.contrib.auth.models import User, Group
+from django.core.exceptions import FieldDoesNotExist
+from kuro.web.filters import query_list
 from kuro.web.models import (
     Experiment, Worker, Trial, Metric, Result, ResultValue
 )
+from kuro.web.series import parse_since
 from rest_framework import serializers
 
 
+_FROM_REQUEST = object()
+
+
+class ExpandableFieldsMixin:
+    """
+    Serializer mixin for choosing the fields of a response and expanding related objects, which are otherwise rendered
+    as hyperlinks. Meta.expandable_fields is a dictionary from field name to the name of the serializer that expands
+    it. Clients choose with the query parameters ?fields=id,url,experiment and ?expand=experiment.metrics, where dots
+    expand the fields of an expanded object. Views can instead pass the fields and expand arguments to shape a
+    response that clients depend on. ExpansionBackend loads the related objects a response needs with select_related
+    and prefetch_related according to related_lookups.
+    """
+    def __init__(self, *args, fields=_FROM_REQUEST, expand=_FROM_REQUEST, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if fields is _FROM_REQUEST:
+            fields = query_list(request, 'fields')
+        if expand is _FROM_REQUEST:
+            expand = query_list(request, 'expand')
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+        for name, nested_expand in self.expansions(expand).items():
+            if name in self.fields:
+                self.fields[name] = self.expanded_serializer(name)(
+                    many=self.is_many(name), read_only=True, fields=None, expand=nested_expand
+                )
+
+    @classmethod
+    def expansions(cls, expand) -> OrderedDict:
+        """
+        :return: dictionary from each expanded field to the expansions of its fields
+        """
+        expandable_fields = getattr(cls.Meta, 'expandable_fields', {})
+        expansions = OrderedDict()
+        for path in expand or []:
+            name, _, rest = path.partition('.')
+            if name not in expandable_fields:
+                raise serializers.ValidationError(
+                    {'expand': f'{name} cannot be expanded, expected one of {sorted(expandable_fields)}'}
+                )
+            expansions.setdefault(name, [])
+            if len(rest) > 0:
+                expansions[name].append(rest)
+        return expansions
+
+    @classmethod
+    def expanded_serializer(cls, name):
+        return getattr(sys.modules[cls.__module__], cls.Meta.expandable_fields[name])
+
+    @classmethod
+    def is_many(cls, name):
+        model_field = cls.Meta.model._meta.get_field(name)
+        return model_field.many_to_many or model_field.one_to_many
+
+    @classmethod
+    def related_lookups(cls, fields=None, expand=None, prefix='', many=False):
+        """
+        :return: the select_related and prefetch_related lookups that render the given fields and expansions without
+        a query per object
+        """
+        select, prefetch = [], []
+        expansions = cls.expansions(expand)
+        for name in cls.Meta.fields:
+            if fields is not None and name not in fields:
+                continue
+            try:
+                model_field = cls.Meta.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if not model_field.is_relation:
+                continue
+            path = prefix + name
+            field_many = many or cls.is_many(name)
+            if name in expansions:
+                (prefetch if field_many else select).append(path)
+                nested_select, nested_prefetch = cls.expanded_serializer(name).related_lookups(
+                    expand=expansions[name], prefix=path + '__', many=field_many
+                )
+                select.extend(nested_select)
+                prefetch.extend(nested_prefetch)
+            elif cls.is_many(name):
+                # Hyperlinks only need the ids of related objects, which are free for foreign keys
+                prefetch.append(path)
+        return select, prefetch
+
+
+class HyperlinkedIdField(serializers.HyperlinkedRelatedField):
+    """
+    Hyperlinked field that resolves a URL to the primary key it refers to without fetching the object. This lets
+    views validate many hyperlinks at once with a single query instead of one query per link.
+    """
+    def get_object(self, view_name, view_args, view_kwargs):
+        return int(view_kwargs[self.lookup_url_kwarg])
+
+
 class UserSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = User
@@ -17,27 +119,27 @@ class GroupSerializer(serializers.HyperlinkedModelSerializer):
         fields = ('id', 'url', 'name')
 
 
-class ExperimentSerializer(serializers.HyperlinkedModelSerializer):
+class ExperimentSerializer(ExpandableFieldsMixin, serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Experiment
         fields = ('id', 'url', 'group', 'identifier', 'hyper_parameters', 'metrics', 'n_trials')
-        depth = 1
+        expandable_fields = {'metrics': 'MetricSerializer'}
 
 
-class TrialSerializer(serializers.HyperlinkedModelSerializer):
+class TrialSerializer(ExpandableFieldsMixin, serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Trial
-        fields = ('id', 'url', 'worker', 'experiment', 'started_at', 'complete')
-        depth = 1
+        fields = ('id', 'url', 'worker', 'experiment', 'started_at', 'complete', 'completed_at', 'failed')
+        expandable_fields = {'worker': 'WorkerSerializer', 'experiment': 'ExperimentSerializer'}
 
 
-class WorkerSerializer(serializers.HyperlinkedModelSerializer):
+class WorkerSerializer(ExpandableFieldsMixin, serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Worker
         fields = ('id', 'url', 'name', 'created_at', 'active', 'cpu_brand', 'memory', 'gpus')
 
 
-class MetricSerializer(serializers.HyperlinkedModelSerializer):
+class MetricSerializer(ExpandableFieldsMixin, serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Metric
         fields = ('id', 'url', 'name', 'mode')
@@ -51,24 +153,43 @@ class TrialCompleteSerializer(serializers.Serializer):
     )
 
 
+class TrialFailSerializer(serializers.Serializer):
+    trial = serializers.HyperlinkedRelatedField(
+        queryset=Trial.objects.all(),
+        view_name='trial-detail',
+        required=True
+    )
+
+
 class TrialGetOrCreateSerializer(serializers.Serializer):
-    worker = serializers.HyperlinkedRelatedField(
+    worker = HyperlinkedIdField(
         queryset=Worker.objects.all(),
         view_name='worker-detail',
         required=True
     )
-    experiment = serializers.HyperlinkedRelatedField(
+    experiment = HyperlinkedIdField(
         queryset=Experiment.objects.all(),
         view_name='experiment-detail',
         required=True
     )
 
 
+class WorkerGetOrCreateSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=100, allow_null=False, allow_blank=False, required=True)
+    cpu_brand = serializers.CharField(max_length=200, allow_blank=True, required=False, default='')
+    memory = serializers.FloatField(required=False, default=0)
+    gpus = serializers.CharField(required=False, default=None, allow_null=True)
+
+
 class MetricGetOrCreateSerializer(serializers.Serializer):
     name = serializers.CharField(max_length=50, allow_null=False, allow_blank=False, required=True)
     mode = serializers.CharField(max_length=20, allow_null=True, allow_blank=True, required=False)
 
 
+class MetricBulkGetOrCreateSerializer(serializers.Serializer):
+    metrics = MetricGetOrCreateSerializer(many=True, required=True)
+
+
 class ExperimentGetOrCreateSerializer(serializers.Serializer):
     group = serializers.CharField(max_length=100, required=True, allow_blank=False)
     identifier = serializers.CharField(max_length=200, required=True, allow_blank=False)
@@ -83,29 +204,76 @@ class ExperimentGetOrCreateSerializer(serializers.Serializer):
     n_trials = serializers.IntegerField(required=False, default=None, allow_null=True)
 
 
-class ResultSerializer(serializers.HyperlinkedModelSerializer):
+class ResultSerializer(ExpandableFieldsMixin, serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Result
-        fields = ('url', 'trial', 'metric')
+        fields = (
+            'url', 'trial', 'metric', 'count', 'first_step', 'last_step', 'last_value', 'best_step', 'best_value',
+            'updated_at'
+        )
+        expandable_fields = {'trial': 'TrialSerializer', 'metric': 'MetricSerializer'}
 
 
-class ResultValueSerializer(serializers.HyperlinkedModelSerializer):
+class ResultValueSerializer(ExpandableFieldsMixin, serializers.HyperlinkedModelSerializer):
     class Meta:
         model = ResultValue
         fields = ('url', 'result', 'step', 'value')
-        depth = 1
+        expandable_fields = {'result': 'ResultSerializer'}
 
 
 class ResultValueCreateSerializer(serializers.Serializer):
-    trial = serializers.HyperlinkedRelatedField(
+    trial = HyperlinkedIdField(
         required=True,
         queryset=Trial.objects.all(),
         view_name='trial-detail'
     )
-    metric = serializers.HyperlinkedRelatedField(
+    metric = HyperlinkedIdField(
         required=True,
         queryset=Metric.objects.all(),
         view_name='metric-detail'
     )
     step = serializers.IntegerField(required=True)
-    value = serializers.FloatField(required=True)
\ No newline at end of file
+    value = serializers.FloatField(required=True)
+
+
+class ResultValuePointSerializer(serializers.Serializer):
+    trial = HyperlinkedIdField(
+        required=True,
+        queryset=Trial.objects.all(),
+        view_name='trial-detail'
+    )
+    metric = HyperlinkedIdField(
+        required=True,
+        queryset=Metric.objects.all(),
+        view_name='metric-detail'
+    )
+    step = serializers.IntegerField(required=False, default=0)
+    value = serializers.FloatField(required=True)
+
+
+class ResultValueBulkCreateSerializer(serializers.Serializer):
+    points = ResultValuePointSerializer(many=True, required=True)
+
+
+class ResultValueStreamPointSerializer(serializers.Serializer):
+    metric = HyperlinkedIdField(
+        required=True,
+        queryset=Metric.objects.all(),
+        view_name='metric-detail'
+    )
+    step = serializers.IntegerField(required=False, default=0)
+    value = serializers.FloatField(required=True)
+
+
+class ResultSeriesUpdatesSerializer(serializers.Serializer):
+    experiments = serializers.ListField(child=serializers.IntegerField(), required=True)
+    since = serializers.ListField(
+        child=serializers.CharField(), required=False, default=list,
+        help_text='result:revision:last_step of each result held, the step may be empty'
+    )
+
+    def validate_since(self, value):
+        try:
+            return parse_since(value)
+        except ValueError:
+            raise serializers.ValidationError('Expected result:revision:last_step values')
@@ -0,0 +1,78 @@
+"""
+Incremental reads of the series of experiments' results. A reader holding series sends the revision of each result it
+holds and the last step it has (see Result.revision). Results at the same revision are skipped, results that were only
+appended to since then return their values after that step, and the others return their whole series, so polling
+costs a query for the results plus reads of the new values rather than of every value.
+"""
+from typing import Dict, Optional, Tuple
+
+from kuro.web.models import Result
+from kuro.web.storage import get_storage
+
+
+# Result id to the revision and last step of the series held by a reader, the step is None if it holds no values
+Since = Dict[int, Tuple[int, Optional[int]]]
+
+
+def series_updates(experiment_ids, since: Since) -> Dict:
+    """
+    :param experiment_ids: experiments whose results are read
+    :param since: the revision and last step of each result held by the reader, results missing from it are read in
+    full
+    :return: a dictionary with the changed results and the removed results. Each changed result has its id, trial,
+    experiment, experiment identifier, metric name, mode, and revision, its steps and values, and replace, which is
+    true if they are the whole series and false if they follow the held series. removed lists the results of since
+    that are not results of the experiments, such as deleted ones.
+    """
+    results = list(Result.objects.filter(trial__experiment_id__in=experiment_ids).order_by(
+        'trial__experiment_id', 'trial_id', 'id'
+    ).values_list(
+        'id', 'trial_id', 'trial__experiment_id', 'trial__experiment__identifier', 'metric__name', 'metric__mode',
+        'revision', 'rewritten_revision'
+    ))
+    full = []
+    after_steps = {}
+    for result_id, *_, revision, rewritten_revision in results:
+        held = since.get(result_id)
+        if held is not None and held[0] == revision:
+            continue
+        if held is None or held[1] is None or held[0] > revision or rewritten_revision > held[0]:
+            full.append(result_id)
+        else:
+            after_steps[result_id] = held[1]
+
+    storage = get_storage()
+    series = storage.read_series(full) if len(full) > 0 else {}
+    if len(after_steps) > 0:
+        series.update(storage.read_series_after(after_steps))
+    full = set(full)
+    changed = []
+    for result_id, trial_id, experiment_id, identifier, metric_name, mode, revision, _ in results:
+        if result_id not in full and result_id not in after_steps:
+            continue
+        steps, values = series.get(result_id, ([], []))
+        changed.append({
+            'result': result_id,
+            'trial': trial_id,
+            'experiment': experiment_id,
+            'identifier': identifier,
+            'metric': metric_name,
+            'mode': mode,
+            'revision': revision,
+            'replace': result_id in full,
+            'steps': [int(s) for s in steps],
+            'values': [float(v) for v in values]
+        })
+    return {'results': changed, 'removed': sorted(set(since) - {r[0] for r in results})}
+
+
+def parse_since(values) -> Since:
+    """
+    :param values: strings of a result id, revision, and last step separated by colons, the step may be empty
+    :raises ValueError: if a value is malformed
+    """
+    since = {}
+    for value in values:
+        result_id, revision, step = value.split(':')
+        since[int(result_id)] = (int(revision), int(step) if step != '' else None)
+    return since
@@ -0,0 +1,375 @@
+"""
+Storage backends for the values of results. The backend is chosen with the KURO_RESULT_STORAGE setting:
+
+* rows: one ResultValue row per (result, step), the original layout
+* chunks: each result's series is stored in ResultChunk rows of up to CHUNK_SIZE packed steps and values, so a whole
+  curve is read from few rows. Appended values are written as ResultTailValue rows and packed into a new chunk once a
+  result has CHUNK_SIZE of them, so appending costs about as much as with rows storage
+
+Existing data is converted between backends with `python manage.py kuro_convert_storage --to chunks`.
+"""
+import operator
+import sqlite3
+from collections import defaultdict
+from functools import reduce
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.db.models import Count, Max, Min, Q, Sum
+
+from kuro.web.models import Result, ResultValue, ResultChunk, ResultTailValue
+
+
+CHUNK_SIZE = 512
+# Results per query of read_series_after, which filters on one condition per result. This keeps the query well under
+# the expression depth limit of SQLite.
+AFTER_BATCH_SIZE = 200
+# Values per upsert statement of RowStorage.write_values, three parameters each stay under SQLite's default limit of
+# 999 parameters per statement
+UPSERT_BATCH_SIZE = 300
+STEP_DTYPE = np.dtype('<i8')
+VALUE_DTYPE = np.dtype('<f8')
+
+Series = Tuple[np.ndarray, np.ndarray]
+# Number of values, minimum value, and maximum value of a result
+Stats = Tuple[int, float, float]
+
+
+def get_storage(name=None):
+    if name is None:
+        name = getattr(settings, 'KURO_RESULT_STORAGE', 'rows')
+    if name == 'rows':
+        return RowStorage()
+    elif name == 'chunks':
+        return ChunkStorage()
+    else:
+        raise ImproperlyConfigured(f'Invalid KURO_RESULT_STORAGE={name}, expected rows or chunks')
+
+
+def _empty_series() -> Series:
+    return np.empty(0, dtype=STEP_DTYPE), np.empty(0, dtype=VALUE_DTYPE)
+
+
+class RowStorage:
+    name = 'rows'
+
+    def write_values(self, result_values: Dict[int, Dict[int, float]]):
+        """
+        Store values with upsert semantics, with one INSERT ... ON CONFLICT statement per UPSERT_BATCH_SIZE values
+        where the database supports it so concurrent writes of the same steps do not conflict
+        :param result_values: dictionary from result id to a dictionary from step to value
+        """
+        _write_rows(ResultValue, result_values)
+
+    def write_value(self, result_id, step, value) -> Optional[int]:
+        """
+        Store a single value with one INSERT ... ON CONFLICT statement where the database supports it
+        :return: id of the ResultValue
+        """
+        sqlite_version = sqlite3.sqlite_version_info
+        if connection.vendor == 'postgresql' or (connection.vendor == 'sqlite' and sqlite_version >= (3, 35, 0)):
+            with connection.cursor() as cursor:
+                cursor.execute(_upsert_sql(ResultValue, 1) + ' RETURNING id', [result_id, step, value])
+                return cursor.fetchone()[0]
+        elif _supports_upsert():
+            with connection.cursor() as cursor:
+                cursor.execute(_upsert_sql(ResultValue, 1), [result_id, step, value])
+            return ResultValue.objects.filter(result_id=result_id, step=step).values_list('id', flat=True).get()
+        else:
+            result_value, _ = ResultValue.objects.update_or_create(
+                result_id=result_id, step=step, defaults={'value': value}
+            )
+            return result_value.id
+
+    def read_series(self, result_ids: Iterable[int]) -> Dict[int, Series]:
+        """
+        Read the values of many results with one query
+        :return: dictionary from result id to arrays of steps and values sorted by step, results without values are
+        omitted
+        """
+        return _split_rows(ResultValue.objects.filter(result_id__in=list(result_ids)))
+
+    def read_series_after(self, after_steps: Dict[int, int]) -> Dict[int, Series]:
+        """
+        Read the values of many results after a step of each, with one query per AFTER_BATCH_SIZE results
+        :param after_steps: dictionary from result id to the step after which its values are read
+        :return: dictionary from result id to arrays of steps and values sorted by step, results without values after
+        their step are omitted
+        """
+        series = {}
+        for batch in _batches(after_steps):
+            series.update(_split_rows(ResultValue.objects.filter(
+                reduce(operator.or_, (Q(result_id=result_id, step__gt=step) for result_id, step in batch))
+            )))
+        return series
+
+    def value_stats(self, result_ids) -> Dict[int, Stats]:
+        """
+        :param result_ids: result ids or a queryset of them, which is used as a subquery
+        :return: dictionary from result id to its number of values, minimum, and maximum computed by the database,
+        results without values are omitted
+        """
+        return {
+            result_id: (n, min_value, max_value)
+            for result_id, n, min_value, max_value in ResultValue.objects.filter(
+                result_id__in=result_ids
+            ).order_by().values('result_id').annotate(
+                n=Count('id'), min_value=Min('value'), max_value=Max('value')
+            ).values_list('result_id', 'n', 'min_value', 'max_value')
+        }
+
+    def delete(self, result_ids: Iterable[int]):
+        ResultValue.objects.filter(result_id__in=list(result_ids)).delete()
+
+
+class ChunkStorage:
+    name = 'chunks'
+
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+
+    def write_values(self, result_values: Dict[int, Dict[int, float]]):
+        """
+        Store values with upsert semantics. Values after the last step of a result's chunks are written to its tail
+        rows, which are packed into new chunks once there are chunk_size of them. Values at or before that step cause
+        the result's chunks and tail to be rewritten.
+        :param result_values: dictionary from result id to a dictionary from step to value
+        """
+        if len(result_values) == 0:
+            return
+        result_ids = list(result_values)
+        # Lock the results being written so concurrent writes to a result are serialized, including the first ones
+        # when it has no chunks to lock yet. SQLite ignores this because it only allows one writer at a time.
+        list(Result.objects.select_for_update().filter(id__in=result_ids).order_by('id').values_list('id', flat=True))
+        last_chunks = {
+            result_id: (max_step, max_index)
+            for result_id, max_step, max_index in ResultChunk.objects.filter(
+                result_id__in=result_ids
+            ).order_by().values('result_id').annotate(
+                max_step=Max('max_step'), max_index=Max('index')
+            ).values_list('result_id', 'max_step', 'max_index')
+        }
+
+        appends = {}
+        new_chunks = []
+        for result_id, points in result_values.items():
+            if result_id not in last_chunks or min(points) > last_chunks[result_id][0]:
+                appends[result_id] = points
+            else:
+                new_chunks.extend(self._rewrite(result_id, points))
+        if len(appends) > 0:
+            _write_rows(ResultTailValue, appends)
+            full = [
+                result_id for result_id, n in ResultTailValue.objects.filter(
+                    result_id__in=list(appends)
+                ).order_by().values('result_id').annotate(n=Count('id')).values_list('result_id', 'n')
+                if n >= self.chunk_size
+            ]
+            if len(full) > 0:
+                new_chunks.extend(self._pack(full, last_chunks))
+        ResultChunk.objects.bulk_create(new_chunks)
+
+    def write_value(self, result_id, step, value) -> Optional[int]:
+        """
+        Store a single value, chunks have no per value id so None is returned. Appending a value writes one tail row,
+        the tail is packed into a chunk every chunk_size values.
+        """
+        self.write_values({result_id: {step: value}})
+        return None
+
+    def _pack(self, result_ids, last_chunks):
+        """
+        Pack the tail rows of results into chunks of chunk_size values, leaving the rest of the tail as rows
+        """
+        new_chunks = []
+        packed = []
+        for result_id, (steps, values) in _split_rows(ResultTailValue.objects.filter(result_id__in=result_ids)).items():
+            n_packed = len(steps) - len(steps) % self.chunk_size
+            index = last_chunks[result_id][1] + 1 if result_id in last_chunks else 0
+            new_chunks.extend(self._new_chunks(result_id, index, steps[:n_packed], values[:n_packed]))
+            packed.append(Q(result_id=result_id, step__lte=int(steps[n_packed - 1])))
+        ResultTailValue.objects.filter(reduce(operator.or_, packed)).delete()
+        return new_chunks
+
+    def _rewrite(self, result_id, points):
+        steps = np.array(sorted(points), dtype=STEP_DTYPE)
+        values = np.array([points[s] for s in steps.tolist()], dtype=VALUE_DTYPE)
+        old_steps, old_values = self.read_series([result_id]).get(result_id, _empty_series())
+        keep = ~np.isin(old_steps, steps)
+        all_steps = np.concatenate([old_steps[keep], steps])
+        all_values = np.concatenate([old_values[keep], values])
+        order = np.argsort(all_steps, kind='mergesort')
+        self.delete([result_id])
+        return self._new_chunks(result_id, 0, all_steps[order], all_values[order])
+
+    def _new_chunks(self, result_id, index, steps, values):
+        return [
+            ResultChunk(
+                result_id=result_id, index=index + i,
+                **_chunk_fields(steps[start:start + self.chunk_size], values[start:start + self.chunk_size])
+            )
+            for i, start in enumerate(range(0, len(steps), self.chunk_size))
+        ]
+
+    def read_series(self, result_ids: Iterable[int]) -> Dict[int, Series]:
+        """
+        Read the values of many results with one query for their chunks and one for their tails
+        :return: dictionary from result id to arrays of steps and values sorted by step, results without values are
+        omitted
+        """
+        result_ids = list(result_ids)
+        return _append_tails(
+            _concatenate_chunks(ResultChunk.objects.filter(result_id__in=result_ids)),
+            _split_rows(ResultTailValue.objects.filter(result_id__in=result_ids))
+        )
+
+    def read_series_after(self, after_steps: Dict[int, int]) -> Dict[int, Series]:
+        """
+        Read the values of many results after a step of each, with two queries per AFTER_BATCH_SIZE results that only
+        read the chunks ending after the step and the tail rows after it
+        :param after_steps: dictionary from result id to the step after which its values are read
+        :return: dictionary from result id to arrays of steps and values sorted by step, results without values after
+        their step are omitted
+        """
+        series = {}
+        for batch in _batches(after_steps):
+            chunks = _concatenate_chunks(ResultChunk.objects.filter(
+                reduce(operator.or_, (Q(result_id=result_id, max_step__gt=step) for result_id, step in batch))
+            ))
+            for result_id, (steps, values) in chunks.items():
+                after = steps > after_steps[result_id]
+                chunks[result_id] = steps[after], values[after]
+            series.update(_append_tails(chunks, _split_rows(ResultTailValue.objects.filter(
+                reduce(operator.or_, (Q(result_id=result_id, step__gt=step) for result_id, step in batch))
+            ))))
+        return series
+
+    def value_stats(self, result_ids) -> Dict[int, Stats]:
+        """
+        :param result_ids: result ids or a queryset of them, which is used as a subquery
+        :return: dictionary from result id to its number of values, minimum, and maximum computed from chunk metadata
+        without reading the packed data and from the tail rows, results without values are omitted
+        """
+        stats = {
+            result_id: (n, min_value, max_value)
+            for result_id, n, min_value, max_value in ResultChunk.objects.filter(
+                result_id__in=result_ids
+            ).order_by().values('result_id').annotate(
+                n=Sum('count'), min_value=Min('min_value'), max_value=Max('max_value')
+            ).values_list('result_id', 'n', 'min_value', 'max_value')
+        }
+        for result_id, n, min_value, max_value in ResultTailValue.objects.filter(
+            result_id__in=result_ids
+        ).order_by().values('result_id').annotate(
+            n=Count('id'), min_value=Min('value'), max_value=Max('value')
+        ).values_list('result_id', 'n', 'min_value', 'max_value'):
+            if result_id in stats:
+                chunk_n, chunk_min, chunk_max = stats[result_id]
+                stats[result_id] = (chunk_n + n, min(chunk_min, min_value), max(chunk_max, max_value))
+            else:
+                stats[result_id] = (n, min_value, max_value)
+        return stats
+
+    def delete(self, result_ids: Iterable[int]):
+        result_ids = list(result_ids)
+        ResultChunk.objects.filter(result_id__in=result_ids).delete()
+        ResultTailValue.objects.filter(result_id__in=result_ids).delete()
+
+
+def _supports_upsert():
+    return connection.vendor == 'postgresql' or (
+        connection.vendor == 'sqlite' and sqlite3.sqlite_version_info >= (3, 24, 0)
+    )
+
+
+def _write_rows(model, result_values: Dict[int, Dict[int, float]]):
+    """
+    Upsert values into the table of model, ResultValue or ResultTailValue, with one INSERT ... ON CONFLICT statement
+    per UPSERT_BATCH_SIZE values where the database supports it
+    """
+    rows = [
+        (result_id, step, value) for result_id, points in result_values.items() for step, value in points.items()
+    ]
+    if len(rows) == 0:
+        return
+    if _supports_upsert():
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+                batch = rows[start:start + UPSERT_BATCH_SIZE]
+                cursor.execute(_upsert_sql(model, len(batch)), [v for row in batch for v in row])
+        return
+    for result_id, points in result_values.items():
+        model.objects.filter(result_id=result_id, step__in=list(points)).delete()
+    model.objects.bulk_create([model(result_id=result_id, step=step, value=value) for result_id, step, value in rows])
+
+
+def _upsert_sql(model, n_rows):
+    table = connection.ops.quote_name(model._meta.db_table)
+    return (
+        f'INSERT INTO {table} (result_id, step, value) VALUES ' + ', '.join(['(%s, %s, %s)'] * n_rows) +
+        ' ON CONFLICT (result_id, step) DO UPDATE SET value = excluded.value'
+    )
+
+
+def _batches(after_steps: Dict[int, int]):
+    items = list(after_steps.items())
+    return [items[start:start + AFTER_BATCH_SIZE] for start in range(0, len(items), AFTER_BATCH_SIZE)]
+
+
+def _split_rows(queryset) -> Dict[int, Series]:
+    rows = queryset.order_by('result_id', 'step').values_list('result_id', 'step', 'value')
+    rows = np.array(list(rows), dtype=[('result_id', STEP_DTYPE), ('step', STEP_DTYPE), ('value', VALUE_DTYPE)])
+    if len(rows) == 0:
+        return {}
+    # Rows are sorted by result so each result's values are one contiguous slice
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(rows['result_id'])) + 1])
+    ends = np.concatenate([starts[1:], [len(rows)]])
+    return {
+        int(rows['result_id'][start]): (rows['step'][start:end].copy(), rows['value'][start:end].copy())
+        for start, end in zip(starts, ends)
+    }
+
+
+def _concatenate_chunks(queryset) -> Dict[int, Series]:
+    chunks = defaultdict(list)
+    for result_id, step_data, value_data in queryset.order_by('result_id', 'index').values_list(
+        'result_id', 'step_data', 'value_data'
+    ):
+        chunks[result_id].append(_decode(step_data, value_data))
+    return {
+        result_id: (np.concatenate([s for s, _ in c]), np.concatenate([v for _, v in c]))
+        for result_id, c in chunks.items()
+    }
+
+
+def _append_tails(series: Dict[int, Series], tails: Dict[int, Series]) -> Dict[int, Series]:
+    """
+    Append the tail rows of results to the values of their chunks, tail steps are after every chunk step
+    """
+    for result_id, (steps, values) in tails.items():
+        if result_id in series:
+            chunk_steps, chunk_values = series[result_id]
+            series[result_id] = np.concatenate([chunk_steps, steps]), np.concatenate([chunk_values, values])
+        else:
+            series[result_id] = steps, values
+    return series
+
+
+def _decode(step_data, value_data) -> Series:
+    # Postgres returns memoryview and SQLite bytes, frombuffer reads both without copying
+    return np.frombuffer(step_data, dtype=STEP_DTYPE), np.frombuffer(value_data, dtype=VALUE_DTYPE)
+
+
+def _chunk_fields(steps, values):
+    return {
+        'count': len(steps),
+        'min_step': int(steps[0]),
+        'max_step': int(steps[-1]),
+        'min_value': float(values.min()),
+        'max_value': float(values.max()),
+        'step_data': steps.astype(STEP_DTYPE).tobytes(),
+        'value_data': values.astype(VALUE_DTYPE).tobytes()
+    }
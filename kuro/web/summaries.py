@@ -0,0 +1,76 @@
+"""
+Per result and per experiment metric statistics computed without reading series. Each Result row holds a summary of
+its values (count, first step, last step and value, best step and value) that kuro.web.ingest keeps up to date as
+values are written, statistics across trials are computed from the few best values.
+"""
+from collections import OrderedDict, defaultdict
+from typing import Dict, List
+
+import numpy as np
+
+from kuro.web.compaction import best_index
+from kuro.web.models import Metric, Result
+
+
+def series_summary(steps: np.ndarray, values: np.ndarray, mode: str) -> Dict:
+    """
+    :param steps: steps of a result sorted in increasing order
+    :param values: values of the steps
+    :return: the summary fields of a Result with these values
+    """
+    if len(steps) == 0:
+        return {
+            'count': 0, 'first_step': None, 'last_step': None, 'last_value': None, 'best_step': None,
+            'best_value': None
+        }
+    best = best_index(values, mode)
+    return {
+        'count': len(steps),
+        'first_step': int(steps[0]),
+        'last_step': int(steps[-1]),
+        'last_value': float(values[-1]),
+        'best_step': int(steps[best]),
+        'best_value': float(values[best])
+    }
+
+
+def summarize_experiments(experiment_ids) -> List[Dict]:
+    """
+    Summarize experiments with one query reading the summary of each result
+    :return: one summary per id in experiment_ids, in order. Each has the experiment id, a row per metric with its
+    mode, number of trials, the best value across trials, and the mean, min, max, and standard deviation of the
+    trials' best values, and a row per trial that has values with the best value of each of its metrics.
+    """
+    rows = Result.objects.filter(trial__experiment_id__in=experiment_ids, count__gt=0).order_by(
+        'trial__experiment_id', 'trial_id', 'metric__name'
+    ).values_list('trial_id', 'trial__experiment_id', 'metric__name', 'metric__mode', 'best_value')
+
+    trials = defaultdict(OrderedDict)
+    metric_bests = defaultdict(OrderedDict)
+    for trial_id, experiment_id, metric_name, mode, best in rows:
+        trials[experiment_id].setdefault(trial_id, OrderedDict())[metric_name] = best
+        metric_bests[experiment_id].setdefault((metric_name, mode), []).append(best)
+
+    summaries = []
+    for experiment_id in OrderedDict.fromkeys(experiment_ids):
+        metrics = []
+        for (metric_name, mode), bests in sorted(metric_bests[experiment_id].items()):
+            bests = np.array(bests, dtype=np.float64)
+            metrics.append({
+                'metric': metric_name,
+                'mode': mode,
+                'n_trials': len(bests),
+                'best': float(bests.max() if mode == Metric.MAX else bests.min()),
+                'mean': float(bests.mean()),
+                'min': float(bests.min()),
+                'max': float(bests.max()),
+                'std': float(bests.std())
+            })
+        summaries.append({
+            'experiment': experiment_id,
+            'metrics': metrics,
+            'trials': [
+                {'trial': trial_id, 'values': values} for trial_id, values in trials.get(experiment_id, {}).items()
+            ]
+        })
+    return summaries
@@ -1,3 +1,1662 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipIf
 
-# Create your tests here.
+import coreapi
+import numpy as np
+import requests
+from django.core.management import call_command
+from django.core.servers import basehttp
+from django.db import OperationalError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import Client, LiveServerTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from kuro import aio
+from kuro.aio import AsyncKuroClient, AsyncWorker, aiohttp
+from kuro.cache import ClientCache
+from kuro.policies import EveryN, Throttle, Window
+from kuro.client import BatchReporter, StreamReporter, Worker as ClientWorker
+from kuro.spool import Spool, replay_directory
+from kuro.transport import Transport
+from kuro.web.buffer import WriteBuffer
+from kuro.web.compaction import downsample
+from kuro.web import dash_app
+from kuro.web.dash_app import create_metric_series, experiment_table, get_app, update_metric_series
+from kuro.web.ingest import MissingObjects, clear_caches, write_point, write_points
+from kuro.web import versions
+from kuro.web.models import (
+    DataVersion, Experiment, Metric, Result, ResultChunk, ResultTailValue, ResultValue, Trial, Worker,
+    hyper_parameters_digest
+)
+from kuro.web.series import series_updates
+from kuro.web.storage import ChunkStorage, get_storage
+from kuro.web.summaries import summarize_experiments
+
+
+API = 'http://testserver/api/v1.0/'
+
+# Bump the result values version on every commit, so throttled bumps do not leak from one test into the next
+_immediate_versions = override_settings(KURO_RESULT_VALUES_VERSION_INTERVAL=0)
+
+
+def setUpModule():
+    _immediate_versions.enable()
+
+
+def tearDownModule():
+    _immediate_versions.disable()
+
+
+def claim_trial(client, worker, experiment):
+    response = client.post(
+        '/api/v1.0/trials/get-or-create/',
+        json.dumps({'worker': f'{API}workers/{worker.id}/', 'experiment': f'{API}experiments/{experiment.id}/'}),
+        content_type='application/json'
+    )
+    return response.status_code, response.json()
+
+
+class TrialSlotTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.worker = Worker.objects.create(name='worker')
+        self.experiment = Experiment.objects.create(group='group', identifier='identifier', n_trials=2)
+
+    def test_claims_until_n_trials(self):
+        first = claim_trial(self.client, self.worker, self.experiment)[1]
+        second = claim_trial(self.client, self.worker, self.experiment)[1]
+        self.assertNotEqual(first['id'], second['id'])
+        # Once all slots are claimed the worker gets back its first incomplete trial
+        self.assertEqual(claim_trial(self.client, self.worker, self.experiment)[1]['id'], first['id'])
+        Trial.objects.filter(experiment=self.experiment).update(complete=True)
+        self.assertEqual(claim_trial(self.client, self.worker, self.experiment)[1]['error'], 'TooManyTrials')
+        self.experiment.refresh_from_db()
+        self.assertEqual(self.experiment.n_claimed, 2)
+
+    def test_deleting_trial_releases_slot(self):
+        first = claim_trial(self.client, self.worker, self.experiment)[1]
+        claim_trial(self.client, self.worker, self.experiment)
+        Trial.objects.get(id=first['id']).delete()
+        Trial.objects.filter(experiment=self.experiment).update(complete=True)
+        status, trial = claim_trial(self.client, self.worker, self.experiment)
+        self.assertEqual(status, 200)
+        self.assertNotIn('error', trial)
+
+    def test_missing_worker_does_not_claim(self):
+        status, response = claim_trial(self.client, Worker(id=1000), self.experiment)
+        self.assertEqual((status, response['error']), (400, 'DoesNotExist'))
+        self.experiment.refresh_from_db()
+        self.assertEqual(self.experiment.n_claimed, 0)
+
+
+class HyperParametersDigestTest(TestCase):
+    def test_bulk_writes_set_digest(self):
+        Experiment.objects.bulk_create([
+            Experiment(group='group', identifier='a', hyper_parameters={'lr': 0.1, 'dropout': 0.5}),
+            Experiment(group='group', identifier='b')
+        ])
+        Experiment.objects.filter(identifier='b').update(hyper_parameters={'lr': 0.2})
+        a = Experiment.objects.get(identifier='a')
+        a.hyper_parameters = {'lr': 0.3}
+        a.save(update_fields=['hyper_parameters'])
+        for experiment in Experiment.objects.all():
+            self.assertEqual(experiment.hyper_parameters_digest, hyper_parameters_digest(experiment.hyper_parameters))
+        self.assertEqual(
+            Experiment.objects.get(identifier='b').hyper_parameters_digest, hyper_parameters_digest({'lr': 0.2})
+        )
+
+
+class DigestMigrationTest(TransactionTestCase):
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([target])
+        return executor.loader.project_state([target]).apps
+
+    def test_backfill(self):
+        apps = self.migrate(('web', '0002_result_chunk'))
+        try:
+            HistoricalExperiment = apps.get_model('web', 'Experiment')
+            HistoricalExperiment.objects.create(group='group', identifier='a', hyper_parameters={'b': 2, 'a': 1})
+            HistoricalExperiment.objects.create(group='group', identifier='b', hyper_parameters={'a': 2})
+            self.migrate(('web', '0003_experiment_hyper_parameters_digest'))
+        finally:
+            self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes('web')[0])
+        digests = dict(Experiment.objects.values_list('identifier', 'hyper_parameters_digest'))
+        self.assertEqual(digests, {
+            'a': hyper_parameters_digest({'a': 1, 'b': 2}),
+            'b': hyper_parameters_digest({'a': 2})
+        })
+
+
+class TrialStreamTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        experiment = Experiment.objects.create(group='group', identifier='identifier', n_trials=1)
+        self.trial = Trial.objects.create(worker=Worker.objects.create(name='worker'), experiment=experiment)
+        self.metric = Metric.objects.create(name='loss', mode='min')
+
+    def stream(self, lines, batch_size=2):
+        body = ''.join(line + '\n' for line in lines)
+        response = self.client.post(
+            f'/api/v1.0/trials/{self.trial.id}/stream/?batch_size={batch_size}', body,
+            content_type='application/x-ndjson'
+        )
+        return response.status_code, response.json()
+
+    def test_commits_batches(self):
+        metric = f'{API}metrics/{self.metric.id}/'
+        lines = [json.dumps({'metric': metric, 'step': step, 'value': step / 10}) for step in range(5)]
+        status, ack = self.stream(lines)
+        self.assertEqual(status, 200)
+        self.assertEqual((ack['n_lines'], ack['n_values'], ack['n_errors']), (5, 5, 0))
+        self.assertEqual([(b['first_line'], b['n_lines']) for b in ack['batches']], [(0, 2), (2, 2), (4, 1)])
+        self.assertEqual(ResultValue.objects.filter(result__trial=self.trial).count(), 5)
+
+    def test_rejects_invalid_batch_only(self):
+        metric = f'{API}metrics/{self.metric.id}/'
+        lines = [
+            json.dumps({'metric': metric, 'step': 0, 'value': 1}),
+            json.dumps({'metric': metric, 'step': 1, 'value': 'nan?'}),
+            json.dumps({'metric': metric, 'step': 2, 'value': 3}),
+        ]
+        status, ack = self.stream(lines)
+        self.assertEqual((ack['n_values'], ack['n_errors']), (1, 1))
+        self.assertEqual(ack['batches'][0]['error'], 'ValidationError')
+        self.assertEqual(ack['batches'][0]['message'][0]['line'], 1)
+        self.assertEqual(list(ResultValue.objects.values_list('step', flat=True)), [2])
+
+    def test_missing_trial(self):
+        Trial.objects.filter(id=self.trial.id).delete()
+        status, response = self.stream([])
+        self.assertEqual((status, response['error']), (400, 'DoesNotExist'))
+
+
+class BulkReportTest(TestCase):
+    def setUp(self):
+        worker = Worker.objects.create(name='worker')
+        experiment = Experiment.objects.create(group='group', identifier='identifier')
+        self.trial = Trial.objects.create(worker=worker, experiment=experiment)
+        self.loss = Metric.objects.create(name='loss', mode='min')
+
+    def report(self, points, trial_id=None):
+        return Client().post('/api/v1.0/result_values/bulk-report/', json.dumps({'points': [{
+            'trial': f'{API}trials/{trial_id or self.trial.id}/', 'metric': f'{API}metrics/{self.loss.id}/',
+            'step': step, 'value': value
+        } for step, value in points]}), content_type='application/json')
+
+    def test_upserts_values(self):
+        for storage in ('rows', 'chunks'):
+            with self.settings(KURO_RESULT_STORAGE=storage):
+                Result.objects.all().delete()
+                self.assertEqual(self.report([(s, float(s)) for s in range(500)]).json(), {'n_values': 500})
+                self.assertEqual(self.report([(499, -1.0), (500, 2.0), (500, 3.0)]).json(), {'n_values': 2})
+                result = Result.objects.get()
+                steps, values = get_storage().read_series([result.id])[result.id]
+                self.assertEqual(len(steps), 501)
+                self.assertEqual((values[499], values[500]), (-1.0, 3.0))
+                self.assertEqual((result.count, result.best_value), (501, -1.0))
+
+    def test_missing_trial_writes_nothing(self):
+        response = self.report([(0, 1.0)], trial_id=self.trial.id + 1)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Result.objects.count(), 0)
+        self.assertEqual(ResultValue.objects.count(), 0)
+
+
+class WorkerGetOrCreateTest(TestCase):
+    def get_or_create(self, **worker):
+        return Client().post('/api/v1.0/workers/get-or-create/', json.dumps(worker), content_type='application/json')
+
+    def test_creates_once(self):
+        response = self.get_or_create(name='worker', cpu_brand='cpu', memory=16.0, gpus='{"gpus": []}')
+        self.assertEqual(response.status_code, 200)
+        created = response.json()
+        self.assertEqual((created['name'], created['cpu_brand'], created['memory']), ('worker', 'cpu', 16.0))
+        # The existing worker is returned as it is, whatever hardware is sent
+        response = self.get_or_create(name='worker', cpu_brand='other', memory=8.0)
+        self.assertEqual(response.json(), created)
+        self.assertEqual(Worker.objects.count(), 1)
+
+    def test_invalid_hardware(self):
+        response = self.get_or_create(name='worker', cpu_brand='cpu', memory='lots')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()), ['memory'])
+        response = self.get_or_create(name='worker', cpu_brand='c' * 201)
+        self.assertEqual(list(response.json()), ['cpu_brand'])
+        self.assertEqual(list(self.get_or_create(cpu_brand='cpu').json()), ['name'])
+        self.assertFalse(Worker.objects.exists())
+
+
+class MetricBulkGetOrCreateTest(TestCase):
+    def bulk_get_or_create(self, metrics):
+        return Client().post(
+            '/api/v1.0/metrics/bulk-get-or-create/', json.dumps({'metrics': metrics}), content_type='application/json'
+        )
+
+    def test_creates_missing_metrics(self):
+        Metric.objects.create(name='loss', mode='min')
+        response = self.bulk_get_or_create([{'name': 'loss'}, {'name': 'acc'}, {'name': 'f1', 'mode': 'max'}])
+        self.assertEqual([m['name'] for m in response.json()['metrics']], ['loss', 'acc', 'f1'])
+        self.assertEqual(Metric.objects.count(), 3)
+
+    def test_invalid_entry_creates_nothing(self):
+        Metric.objects.create(name='loss', mode='min')
+        for metrics in (
+            [{'name': 'acc'}, {'name': 'loss', 'mode': 'max'}],
+            [{'name': 'acc'}, {'name': 'f1', 'mode': 'sideways'}],
+            [{'name': 'acc'}, {'name': 'acc', 'mode': 'min'}],
+        ):
+            self.assertEqual(self.bulk_get_or_create(metrics).status_code, 400)
+            self.assertEqual(list(Metric.objects.values_list('name', flat=True)), ['loss'])
+
+
+class ListPaginationTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        experiment = Experiment.objects.create(group='group', identifier='identifier', n_trials=1)
+        trial = Trial.objects.create(worker=Worker.objects.create(name='worker'), experiment=experiment)
+        metric = Metric.objects.create(name='loss', mode='min')
+        self.result = Result.objects.create(trial=trial, metric=metric)
+        ResultValue.objects.bulk_create([ResultValue(result=self.result, step=step, value=step) for step in range(10)])
+
+    def test_pages_through_filtered_values(self):
+        url = f'/api/v1.0/result_values/?trial={self.result.trial_id}&step__gt=3&page_size=4'
+        steps = []
+        while url is not None:
+            page = self.client.get(url, HTTP_ACCEPT='application/json').json()
+            self.assertLessEqual(len(page['results']), 4)
+            steps.extend(v['step'] for v in page['results'])
+            url = page['next']
+            if len(steps) == 4:
+                # Values inserted while paging appear on later pages without shifting them
+                ResultValue.objects.create(result=self.result, step=10, value=10)
+        self.assertEqual(steps, list(range(4, 11)))
+
+    def test_invalid_filter(self):
+        response = self.client.get('/api/v1.0/result_values/?step__gt=one', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('step__gt', response.json())
+
+
+class ExpandFieldsTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.metrics = [Metric.objects.create(name=name, mode='min') for name in ('loss', 'error')]
+
+    def create_values(self, n):
+        experiment = Experiment.objects.create(group='group', identifier=f'identifier-{n}', n_trials=n)
+        experiment.metrics.set(self.metrics)
+        for i in range(n):
+            trial = Trial.objects.create(worker=Worker.objects.create(name=f'worker-{n}-{i}'), experiment=experiment)
+            result = Result.objects.create(trial=trial, metric=self.metrics[0])
+            ResultValue.objects.create(result=result, step=0, value=i)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url, HTTP_ACCEPT='application/json').status_code, 200)
+        return len(queries)
+
+    def test_constant_queries(self):
+        url = '/api/v1.0/result_values/?expand=result.trial.experiment.metrics,result.metric'
+        self.create_values(2)
+        n_queries = self.count_queries(url)
+        self.create_values(5)
+        self.assertEqual(self.count_queries(url), n_queries)
+        # Data versions, experiments, and their metrics
+        self.assertEqual(self.count_queries('/api/v1.0/experiments/'), 3)
+
+    def test_fields_and_expand(self):
+        self.create_values(1)
+        trial = self.client.get(
+            '/api/v1.0/trials/?fields=id,experiment&expand=experiment.metrics', HTTP_ACCEPT='application/json'
+        ).json()['results'][0]
+        self.assertEqual(set(trial), {'id', 'experiment'})
+        self.assertEqual({m['name'] for m in trial['experiment']['metrics']}, {'loss', 'error'})
+        value = self.client.get('/api/v1.0/result_values/', HTTP_ACCEPT='application/json').json()['results'][0]
+        self.assertTrue(value['result'].startswith(API + 'results/'))
+
+
+class WritePointTest(TransactionTestCase):
+    def setUp(self):
+        worker = Worker.objects.create(name='worker')
+        experiment = Experiment.objects.create(group='group', identifier='identifier')
+        self.trial = Trial.objects.create(worker=worker, experiment=experiment)
+        self.loss = Metric.objects.create(name='loss', mode='min')
+
+    def report(self, step, value):
+        return Client().post('/api/v1.0/result_values/report/', json.dumps({
+            'trial': f'{API}trials/{self.trial.id}/', 'metric': f'{API}metrics/{self.loss.id}/',
+            'step': step, 'value': value
+        }), content_type='application/json')
+
+    def test_upserts_with_every_sqlite_version(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('the fallbacks are chosen by SQLite version')
+        # RETURNING, ON CONFLICT without RETURNING, and update_or_create
+        for version in ((3, 40, 0), (3, 30, 0), (3, 20, 0)):
+            with mock.patch('sqlite3.sqlite_version_info', version):
+                ResultValue.objects.all().delete()
+                result = Result.objects.get_or_create(trial=self.trial, metric=self.loss)[0]
+                storage = get_storage('rows')
+                result_value_id = storage.write_value(result.id, 0, 1.0)
+                self.assertEqual(storage.write_value(result.id, 0, 2.0), result_value_id)
+                storage.write_values({result.id: {0: 3.0, 1: 4.0}})
+                self.assertEqual(list(ResultValue.objects.values_list('step', 'value')), [(0, 3.0), (1, 4.0)])
+
+    def test_trial_deleted_by_other_process(self):
+        self.assertEqual(self.report(0, 1.0).status_code, 200)
+        # Another server process deletes the trial, so this process's caches are not cleared
+        with connection.cursor() as cursor:
+            for model, column in ((ResultValue, 'result_id IN (SELECT id FROM web_result)'), (Result, 'TRUE'),
+                                  (Trial, 'TRUE')):
+                cursor.execute(f'DELETE FROM {model._meta.db_table} WHERE {column}')
+        response = self.report(1, 1.0)
+        self.assertEqual((response.status_code, response.json()['error']), (400, 'DoesNotExist'))
+
+
+class ConcurrentBulkReportTest(TransactionTestCase):
+    n_threads = 16
+
+    def test_concurrent_reports_of_same_steps(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('in-memory SQLite databases do not support concurrent connections')
+        worker = Worker.objects.create(name='worker')
+        experiment = Experiment.objects.create(group='group', identifier='identifier')
+        trial = Trial.objects.create(worker=worker, experiment=experiment)
+        loss = Metric.objects.create(name='loss', mode='min')
+        start = threading.Barrier(self.n_threads)
+
+        def report(i):
+            body = json.dumps({'points': [
+                {'trial': f'{API}trials/{trial.id}/', 'metric': f'{API}metrics/{loss.id}/', 'step': s, 'value': i}
+                for s in range(i, i + 50)
+            ]})
+            start.wait()
+            try:
+                while True:
+                    try:
+                        return Client().post(
+                            '/api/v1.0/result_values/bulk-report/', body, content_type='application/json'
+                        ).status_code
+                    except OperationalError:
+                        connection.close()
+                        time.sleep(.01)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            statuses = list(executor.map(report, range(self.n_threads)))
+        self.assertEqual(statuses, [200] * self.n_threads)
+        self.assertEqual(Result.objects.count(), 1)
+        self.assertEqual(ResultValue.objects.count(), self.n_threads + 49)
+        self.assertEqual(Result.objects.get().count, self.n_threads + 49)
+
+
+class TrialSlotStressTest(TransactionTestCase):
+    n_trials = 20
+    n_workers = 200
+    n_threads = 32
+
+    def test_concurrent_claims_respect_n_trials(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('in-memory SQLite databases do not support concurrent connections')
+        experiment = Experiment.objects.create(group='group', identifier='stress', n_trials=self.n_trials)
+        workers = [Worker.objects.create(name=f'worker-{i}') for i in range(self.n_workers)]
+        start = threading.Barrier(self.n_threads)
+
+        def claim(worker):
+            if worker.id <= workers[0].id + self.n_threads - 1:
+                start.wait()
+            client = Client()
+            begin = time.perf_counter()
+            n_retries = 0
+            try:
+                while True:
+                    try:
+                        _, response = claim_trial(client, worker, experiment)
+                        return response, time.perf_counter() - begin, n_retries
+                    except OperationalError:
+                        # SQLite gives up waiting for the write lock after its timeout, so like a client the claimant
+                        # retries with a new connection
+                        n_retries += 1
+                        connection.close()
+                        time.sleep(.01)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            outcomes = list(executor.map(claim, workers))
+
+        claimed = [r['id'] for r, _, _ in outcomes if 'id' in r]
+        rejected = [r for r, _, _ in outcomes if r.get('error') == 'TooManyTrials']
+        self.assertEqual(len(claimed), self.n_trials)
+        self.assertEqual(len(set(claimed)), self.n_trials)
+        self.assertEqual(len(rejected), self.n_workers - self.n_trials)
+        self.assertEqual(Trial.objects.filter(experiment=experiment).count(), self.n_trials)
+        experiment.refresh_from_db()
+        self.assertEqual(experiment.n_claimed, self.n_trials)
+
+        # Claims wait for each other briefly instead of failing with lock errors or deadlocking
+        self.assertEqual(sum(n_retries for _, _, n_retries in outcomes), 0)
+        latencies = sorted(latency for _, latency, _ in outcomes)
+        self.assertLess(latencies[int(.99 * len(latencies))], 5)
+
+
+class WriteBufferTest(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('in-memory SQLite databases do not support concurrent connections')
+        experiment = Experiment.objects.create(group='group', identifier='identifier', n_trials=2)
+        worker = Worker.objects.create(name='worker')
+        self.trials = [Trial.objects.create(worker=worker, experiment=experiment) for _ in range(2)]
+        self.metric = Metric.objects.create(name='loss', mode='min')
+
+    def test_sync_writes_are_committed_together(self):
+        write_buffer = WriteBuffer(durability='sync', interval=.5)
+        try:
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                futures = [
+                    executor.submit(write_buffer.write, [(trial.id, self.metric.id, step, step) for step in range(3)])
+                    for trial in self.trials
+                ]
+                missing = executor.submit(write_buffer.write, [(1000, self.metric.id, 0, 0)])
+                self.assertEqual([f.result() for f in futures], [3, 3])
+                # Invalid values only fail the request that sent them
+                with self.assertRaises(MissingObjects):
+                    missing.result()
+            self.assertEqual(ResultValue.objects.count(), 6)
+        finally:
+            write_buffer.drain()
+
+    def test_drain_flushes_async_writes(self):
+        write_buffer = WriteBuffer(durability='async', interval=60)
+        write_buffer.write([(self.trials[0].id, self.metric.id, 0, 1), (self.trials[0].id, self.metric.id, 0, 2)])
+        self.assertEqual(ResultValue.objects.count(), 0)
+        write_buffer.drain()
+        self.assertEqual(list(ResultValue.objects.values_list('value', flat=True)), [2])
+        # Writes after draining go directly to the database
+        self.assertEqual(write_buffer.write([(self.trials[1].id, self.metric.id, 0, 3)]), 1)
+        self.assertEqual(ResultValue.objects.count(), 2)
+
+
+class ConditionalGetTest(TransactionTestCase):
+    def setUp(self):
+        self.client = Client()
+        worker = Worker.objects.create(name='worker')
+        experiment = Experiment.objects.create(group='group', identifier='identifier')
+        self.trial = Trial.objects.create(worker=worker, experiment=experiment)
+        self.metric = Metric.objects.create(name='loss', mode='min')
+
+    def write(self, step):
+        response = self.client.post('/api/v1.0/result_values/bulk-report/', json.dumps({'points': [{
+            'trial': f'{API}trials/{self.trial.id}/', 'metric': f'{API}metrics/{self.metric.id}/',
+            'step': step, 'value': 1.0
+        }]}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_unchanged_polls_are_not_modified(self):
+        self.write(0)
+        response = self.client.get('/api/v1.0/experiments/')
+        etag = response['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1.0/experiments/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(len(queries), 1)
+        # Different query parameters are different responses
+        self.assertEqual(self.client.get('/api/v1.0/experiments/?fields=id', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_writes_change_etag(self):
+        self.write(0)
+        values_etag = self.client.get('/api/v1.0/result_values/')['ETag']
+        trials_etag = self.client.get('/api/v1.0/trials/')['ETag']
+        self.write(1)
+        response = self.client.get('/api/v1.0/result_values/', HTTP_IF_NONE_MATCH=values_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 2)
+        self.assertEqual(self.client.get('/api/v1.0/trials/', HTTP_IF_NONE_MATCH=trials_etag).status_code, 304)
+        self.trial.complete = True
+        self.trial.save()
+        self.assertEqual(self.client.get('/api/v1.0/trials/', HTTP_IF_NONE_MATCH=trials_etag).status_code, 200)
+
+    @override_settings(KURO_RESULT_VALUES_VERSION_INTERVAL=0.5)
+    def test_result_values_version_is_throttled(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('in-memory SQLite databases do not support concurrent connections')
+        with mock.patch('kuro.web.versions._result_values_bumped_at', None):
+            self.assertIsNone(versions._result_values_timer)
+            self.write(0)
+            version = DataVersion.objects.get(name=versions.RESULT_VALUES).version
+            for step in range(1, 5):
+                self.write(step)
+            self.assertEqual(DataVersion.objects.get(name=versions.RESULT_VALUES).version, version)
+            # A single bump at the end of the interval covers the throttled writes
+            versions._result_values_timer.join()
+            self.assertEqual(DataVersion.objects.get(name=versions.RESULT_VALUES).version, version + 1)
+            self.assertIsNone(versions._result_values_timer)
+
+
+class ChunkStorageTest(TestCase):
+    def setUp(self):
+        worker = Worker.objects.create(name='worker')
+        experiment = Experiment.objects.create(group='group', identifier='identifier')
+        trial = Trial.objects.create(worker=worker, experiment=experiment)
+        self.results = [
+            Result.objects.create(trial=trial, metric=Metric.objects.create(name=name, mode='min'))
+            for name in ('loss', 'val_loss')
+        ]
+        self.storage = ChunkStorage(chunk_size=4)
+
+    def assert_series(self, result, expected):
+        steps, values = self.storage.read_series([result.id])[result.id]
+        self.assertEqual(dict(zip(steps.tolist(), values.tolist())), expected)
+        chunks = list(ResultChunk.objects.filter(result=result).values_list('index', 'count', 'min_step', 'max_step'))
+        self.assertEqual([c[0] for c in chunks], list(range(len(chunks))))
+        self.assertTrue(all(c[1] <= 4 for c in chunks))
+        self.assertTrue(all(a[3] < b[2] for a, b in zip(chunks, chunks[1:])))
+        tail_steps = ResultTailValue.objects.filter(result=result).values_list('step', flat=True)
+        if len(chunks) > 0:
+            self.assertTrue(all(step > chunks[-1][3] for step in tail_steps))
+
+    def test_append(self):
+        result = self.results[0]
+        expected = {s: float(s) for s in range(6)}
+        self.storage.write_values({result.id: dict(expected)})
+        for step in range(6, 10):
+            self.storage.write_value(result.id, step, -step)
+            expected[step] = -step
+        self.assert_series(result, expected)
+        # Full chunks are packed from the tail, the rest stays in it
+        self.assertEqual(ResultChunk.objects.filter(result=result).count(), 2)
+        self.assertEqual(ResultTailValue.objects.filter(result=result).count(), 2)
+        self.assertEqual(self.storage.value_stats([result.id]), {result.id: (10, -9.0, 5.0)})
+        steps, values = self.storage.read_series_after({result.id: 6})[result.id]
+        self.assertEqual((steps.tolist(), values.tolist()), ([7, 8, 9], [-7.0, -8.0, -9.0]))
+
+    def test_append_does_not_rewrite_chunks(self):
+        result = self.results[0]
+        self.storage.write_values({result.id: {s: float(s) for s in range(5)}})
+        with CaptureQueriesContext(connection) as queries:
+            self.storage.write_value(result.id, 5, 5.0)
+        self.assertFalse(any('step_data' in q['sql'] for q in queries.captured_queries))
+        self.assert_series(result, {s: float(s) for s in range(6)})
+
+    def test_overwrite_and_fill(self):
+        result, other = self.results
+        expected = {s: float(s) for s in range(0, 20, 2)}
+        self.storage.write_values({result.id: dict(expected), other.id: {0: 1.0}})
+        points = {4: -1.0, 5: -2.0, 30: 3.0}
+        self.storage.write_values({result.id: points})
+        expected.update(points)
+        self.assert_series(result, expected)
+        self.assert_series(other, {0: 1.0})
+        # Overwriting a value of the tail
+        self.storage.write_values({other.id: {0: 2.0}})
+        self.assert_series(other, {0: 2.0})
+
+    def test_convert_storage(self):
+        expected = {s: s / 2 for s in range(1000)}
+        # Steps are stored as 64 bit integers by both backends
+        expected[2 ** 40] = 1.0
+        get_storage('rows').write_values({self.results[0].id: expected})
+        call_command('kuro_convert_storage', '--to', 'chunks', stdout=io.StringIO())
+        self.assertEqual(ResultValue.objects.count(), 0)
+        steps, values = get_storage('chunks').read_series([self.results[0].id])[self.results[0].id]
+        self.assertEqual(dict(zip(steps.tolist(), values.tolist())), expected)
+
+        call_command('kuro_convert_storage', '--to', 'rows', '--keep', stdout=io.StringIO())
+        self.assertEqual(dict(ResultValue.objects.values_list('step', 'value')), expected)
+        self.assertGreater(ResultChunk.objects.count(), 0)
+        # Converting again after an interrupted or kept conversion does not duplicate values
+        call_command('kuro_convert_storage', '--to', 'rows', stdout=io.StringIO())
+        self.assertEqual(ResultValue.objects.count(), 1001)
+        self.assertEqual(ResultChunk.objects.count(), 0)
+        self.assertEqual(ResultTailValue.objects.count(), 0)
+
+
+class CompactTest(TestCase):
+    def setUp(self):
+        worker = Worker.objects.create(name='worker')
+        experiment = Experiment.objects.create(group='group', identifier='identifier')
+        self.trial = Trial.objects.create(worker=worker, experiment=experiment)
+        self.metric = Metric.objects.create(name='acc', mode='max')
+        self.result = Result.objects.create(trial=self.trial, metric=self.metric)
+        # A noisy curve whose best value is in the middle
+        values = np.sin(np.arange(500) / 50.0) + np.random.RandomState(0).normal(0, 0.1, 500)
+        values[250] = 10.0
+        ResultValue.objects.bulk_create([ResultValue(result=self.result, step=s, value=v) for s, v in enumerate(values)])
+
+    def compact(self, **options):
+        call_command('kuro_compact', stdout=io.StringIO(), **options)
+        return ResultValue.objects.filter(result=self.result).values_list('step', 'value')
+
+    def test_downsample_keeps_best_and_last(self):
+        steps = np.arange(1000)
+        values = np.random.RandomState(0).normal(0, 1, 1000)
+        selected = downsample(steps, values, 50, 'min')
+        self.assertLessEqual(len(selected), 50)
+        self.assertIn(int(np.argmin(values)), selected)
+        self.assertIn(999, selected)
+        self.assertEqual(list(selected), sorted(set(selected)))
+
+    def test_compacts_old_complete_trials(self):
+        self.assertEqual(len(self.compact(points=100, older_than=0)), 500)
+        self.trial.complete = True
+        self.trial.save()
+        self.assertIsNotNone(self.trial.completed_at)
+        self.assertEqual(len(self.compact(points=100, older_than=1)), 500)
+        self.assertEqual(len(self.compact(points=100, older_than=0, dry_run=True)), 500)
+        values = dict(self.compact(points=100, older_than=0))
+        self.assertLessEqual(len(values), 100)
+        self.assertEqual(values[250], 10.0)
+        self.assertIn(499, values)
+        self.result.refresh_from_db()
+        self.assertEqual((self.result.count, self.result.best_step, self.result.last_step), (len(values), 250, 499))
+
+
+class DashAppTest(TestCase):
+    def test_layout_is_built_per_page_load(self):
+        client = Client()
+        self.assertEqual(client.get('/_dash-layout').status_code, 200)
+        app = get_app()
+        Experiment.objects.create(group='new-group', identifier='identifier', hyper_parameters='{}')
+        self.assertIn(b'new-group', client.get('/_dash-layout').content)
+        self.assertIs(get_app(), app)
+
+    def test_metric_series_queries_are_constant(self):
+        worker = Worker.objects.create(name='worker')
+        metrics = [Metric.objects.create(name='loss', mode='min'), Metric.objects.create(name='final', mode='max')]
+        experiment_ids = []
+        for i in range(3):
+            experiment = Experiment.objects.create(group='group', identifier=f'identifier-{i}', hyper_parameters='{}')
+            experiment_ids.append(experiment.id)
+            for _ in range(2):
+                trial = Trial.objects.create(worker=worker, experiment=experiment)
+                loss = Result.objects.create(trial=trial, metric=metrics[0])
+                ResultValue.objects.bulk_create([ResultValue(result=loss, step=s, value=s) for s in range(3)])
+                ResultValue.objects.create(result=Result.objects.create(trial=trial, metric=metrics[1]), value=1)
+
+        with CaptureQueriesContext(connection) as queries:
+            step_data, summary_data = create_metric_series(experiment_ids)
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(len(step_data[(experiment_ids[0], 'loss')]), 2)
+        self.assertEqual(step_data[(experiment_ids[0], 'loss')][0].steps, [0, 1, 2])
+        self.assertEqual(summary_data[(experiment_ids[2], 'final')][1].values, [1.0])
+
+
+class DashRefreshTest(TestCase):
+    def setUp(self):
+        worker = Worker.objects.create(name='worker')
+        self.experiment = Experiment.objects.create(group='group', identifier='identifier', hyper_parameters='{}')
+        self.trial = Trial.objects.create(worker=worker, experiment=self.experiment)
+        self.loss = Metric.objects.create(name='loss', mode='min')
+        patcher = mock.patch.object(dash_app, '_held_pages', dash_app.OrderedDict())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def update(self, output, inputs, state=()):
+        response = Client().post('/_dash-update-component', json.dumps({
+            'output': {'id': output, 'property': 'children'},
+            'inputs': [{'id': i, 'property': p, 'value': v} for i, p, v in inputs],
+            'state': [{'id': i, 'property': p, 'value': v} for i, p, v in state]
+        }), content_type='application/json')
+        if len(response.content) == 0:
+            return None
+        return json.loads(response.content)['response']['props']['children']
+
+    def refresh(self, page_key, trials_json):
+        return self.update('experiment-trials-json', [
+            ('update-tables-plots', 'n_clicks', 1), ('interval-component', 'n_intervals', 0)
+        ], [
+            ('experiment-detail-table', 'rows', [{'id': self.experiment.id}]),
+            ('experiment-detail-table', 'selected_row_indices', [0]),
+            ('page-key', 'children', page_key), ('experiment-trials-json', 'children', trials_json)
+        ])
+
+    def plot(self, trials_json):
+        return self.update('content', [
+            ('experiment-trials-json', 'children', trials_json), ('aggregate-mode', 'value', 'all')
+        ])
+
+    def test_series_are_held_by_server(self):
+        write_points([(self.trial.id, self.loss.id, s, 1.0) for s in range(3)])
+        trials_json = self.refresh('page', None)
+        self.assertNotIn('steps', trials_json)
+        self.assertEqual(self.refresh('page', trials_json), None)
+
+        write_points([(self.trial.id, self.loss.id, s, 1.0) for s in range(3, 5)])
+        with CaptureQueriesContext(connection) as queries:
+            new_trials_json = self.refresh('page', trials_json)
+        self.assertNotEqual(new_trials_json, trials_json)
+        self.assertEqual(len(queries), 2)
+        m, = dash_app.get_held_series('page').series.values()
+        self.assertEqual(m.steps, list(range(5)))
+        figure = self.plot(new_trials_json)['props']['children']['props']['children'][0]['props']['figure']
+        self.assertEqual(figure['data'][0]['x'], list(range(5)))
+
+        # Series held by another process or dropped are read again
+        dash_app._held_pages.clear()
+        figure = self.plot(new_trials_json)['props']['children']['props']['children'][0]['props']['figure']
+        self.assertEqual(figure['data'][0]['x'], list(range(5)))
+
+    def test_held_pages_are_bounded(self):
+        for i in range(dash_app.MAX_HELD_PAGES + 1):
+            dash_app.refresh_held_series(f'page-{i}', [self.experiment.id])
+        self.assertIsNone(dash_app.get_held_series('page-0'))
+        self.assertIsNotNone(dash_app.get_held_series(f'page-{dash_app.MAX_HELD_PAGES}'))
+
+
+class ExperimentSummaryTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        worker = Worker.objects.create(name='worker')
+        self.experiment = Experiment.objects.create(group='group', identifier='identifier')
+        self.other = Experiment.objects.create(group='group', identifier='other')
+        self.acc = Metric.objects.create(name='acc', mode='max')
+        self.loss = Metric.objects.create(name='loss', mode='min')
+        self.trials = [Trial.objects.create(worker=worker, experiment=self.experiment) for _ in range(2)]
+        self.points = [
+            (self.trials[0].id, self.acc.id, 0, .5), (self.trials[0].id, self.acc.id, 1, .7),
+            (self.trials[0].id, self.loss.id, 0, 2.0), (self.trials[0].id, self.loss.id, 1, 1.0),
+            (self.trials[1].id, self.acc.id, 0, .9), (self.trials[1].id, self.loss.id, 0, 3.0),
+        ]
+
+    def test_summary_respects_mode(self):
+        for storage in ('rows', 'chunks'):
+            with self.settings(KURO_RESULT_STORAGE=storage):
+                write_points(self.points)
+                summary = self.client.get(f'/api/v1.0/experiments/{self.experiment.id}/summary/').json()
+                acc, loss = summary['metrics']
+                self.assertEqual((acc['metric'], acc['best'], acc['min'], acc['n_trials']), ('acc', .9, .7, 2))
+                self.assertEqual((loss['metric'], loss['best'], loss['mean']), ('loss', 1.0, 2.0))
+                self.assertEqual(summary['trials'][0]['values'], {'acc': .7, 'loss': 1.0})
+                self.assertEqual(experiment_table([summary])[1], {
+                    'experiment_id': self.experiment.id, 'trial_id': self.trials[1].id, 'acc': .9, 'loss': 3.0
+                })
+                get_storage(storage).delete(Result.objects.values_list('id', flat=True))
+
+    def test_batched_summaries(self):
+        write_points(self.points)
+        response = self.client.get(f'/api/v1.0/experiments/summaries/?ids={self.other.id},{self.experiment.id}')
+        summaries = response.json()['experiments']
+        self.assertEqual([s['experiment'] for s in summaries], [self.other.id, self.experiment.id])
+        self.assertEqual(summaries[0]['metrics'], [])
+        self.assertEqual(len(summaries[1]['trials']), 2)
+        response = self.client.get('/api/v1.0/experiments/summaries/?ids=0')
+        self.assertEqual(response.json()['error'], 'DoesNotExist')
+
+
+class ResultSummaryTest(TestCase):
+    def setUp(self):
+        # Rolled back tests reuse ids that write_point may have cached
+        clear_caches()
+        worker = Worker.objects.create(name='worker')
+        self.experiment = Experiment.objects.create(group='group', identifier='identifier')
+        self.trial = Trial.objects.create(worker=worker, experiment=self.experiment)
+        self.loss = Metric.objects.create(name='loss', mode='min')
+
+    def summary(self):
+        result = Result.objects.get(trial=self.trial, metric=self.loss)
+        return result.count, result.first_step, result.last_step, result.last_value, result.best_step, result.best_value
+
+    def test_appends_and_overwrites(self):
+        for storage in ('rows', 'chunks'):
+            with self.settings(KURO_RESULT_STORAGE=storage):
+                Result.objects.all().delete()
+                write_points([(self.trial.id, self.loss.id, 0, 3.0), (self.trial.id, self.loss.id, 1, 2.0)])
+                write_point(self.trial.id, self.loss.id, 2, 2.5)
+                self.assertEqual(self.summary(), (3, 0, 2, 2.5, 1, 2.0))
+                write_points([(self.trial.id, self.loss.id, 3, 2.0), (self.trial.id, self.loss.id, 4, 1.0)])
+                self.assertEqual(self.summary(), (5, 0, 4, 1.0, 4, 1.0))
+                # Replacing the best value recomputes the summary from the series
+                write_point(self.trial.id, self.loss.id, 4, 4.0)
+                self.assertEqual(self.summary(), (5, 0, 4, 4.0, 1, 2.0))
+
+    def test_mode_change_recomputes_best(self):
+        write_points([(self.trial.id, self.loss.id, s, v) for s, v in enumerate([2.0, 1.0, 3.0])])
+        self.assertEqual(self.summary()[4:], (1, 1.0))
+        self.loss.mode = 'max'
+        self.loss.save()
+        self.assertEqual(self.summary()[4:], (2, 3.0))
+        write_point(self.trial.id, self.loss.id, 3, 4.0)
+        self.assertEqual(self.summary()[4:], (3, 4.0))
+
+    def test_summaries_read_one_row_per_result(self):
+        write_points([(self.trial.id, self.loss.id, s, float(s)) for s in range(100)])
+        with self.assertNumQueries(1):
+            summary, = summarize_experiments([self.experiment.id])
+        self.assertEqual(summary['trials'], [{'trial': self.trial.id, 'values': {'loss': 0.0}}])
+
+
+class SeriesUpdatesTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        worker = Worker.objects.create(name='worker')
+        self.experiment = Experiment.objects.create(group='group', identifier='identifier', hyper_parameters='{}')
+        self.trial = Trial.objects.create(worker=worker, experiment=self.experiment)
+        self.loss = Metric.objects.create(name='loss', mode='min')
+
+    def write(self, steps, value=1.0):
+        write_points([(self.trial.id, self.loss.id, s, value) for s in steps])
+
+    def test_reads_values_since_revision(self):
+        for storage in ('rows', 'chunks'):
+            with self.settings(KURO_RESULT_STORAGE=storage):
+                Result.objects.all().delete()
+                self.write(range(3))
+                update, = series_updates([self.experiment.id], {})['results']
+                self.assertEqual((update['replace'], update['steps']), (True, [0, 1, 2]))
+                since = {update['result']: (update['revision'], 2)}
+                self.assertEqual(series_updates([self.experiment.id], since)['results'], [])
+
+                self.write(range(3, 5))
+                update, = series_updates([self.experiment.id], since)['results']
+                self.assertEqual((update['replace'], update['steps']), (False, [3, 4]))
+                # Rewriting an earlier step returns the whole series
+                self.write([1], 2.0)
+                update, = series_updates([self.experiment.id], since)['results']
+                self.assertEqual((update['replace'], update['steps'], update['values'][1]), (True, list(range(5)), 2.0))
+
+                Result.objects.all().delete()
+                self.assertEqual(series_updates([self.experiment.id], since)['removed'], [update['result']])
+
+    def test_dashboard_merges_new_values(self):
+        self.write(range(3))
+        series = {}
+        self.assertTrue(update_metric_series([self.experiment.id], series))
+        self.assertFalse(update_metric_series([self.experiment.id], series))
+        self.write(range(3, 5))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(update_metric_series([self.experiment.id], series))
+        self.assertEqual(len(queries), 2)
+        m, = series.values()
+        self.assertEqual(m.steps, list(range(5)))
+
+    def test_updates_endpoint(self):
+        self.write(range(3))
+        response = self.client.get(f'/api/v1.0/results/updates/?experiments={self.experiment.id}').json()
+        result = response['results'][0]
+        since = f'{result["result"]}:{result["revision"]}:2'
+        self.write([3])
+        response = self.client.get(f'/api/v1.0/results/updates/?experiments={self.experiment.id}&since={since}')
+        self.assertEqual(response.json()['results'][0]['steps'], [3])
+        response = self.client.get(f'/api/v1.0/results/updates/?experiments={self.experiment.id}&since=1:x:2')
+        self.assertEqual(response.status_code, 400)
+
+    def test_updates_query_endpoint(self):
+        self.write(range(3))
+        result = self.client.get(f'/api/v1.0/results/updates/?experiments={self.experiment.id}').json()['results'][0]
+        self.write([3])
+        since = [f'{result["result"]}:{result["revision"]}:2'] + [f'{i}:1:' for i in range(10 ** 6, 10 ** 6 + 1000)]
+        response = self.client.post('/api/v1.0/results/updates-query/', json.dumps({
+            'experiments': [self.experiment.id], 'since': since
+        }), content_type='application/json').json()
+        self.assertEqual(response['results'][0]['steps'], [3])
+        self.assertEqual(len(response['removed']), 1000)
+        response = self.client.post('/api/v1.0/results/updates-query/', json.dumps({
+            'experiments': [self.experiment.id], 'since': ['1:x:2']
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ReportPolicyTest(TestCase):
+    def offer(self, policy, values, mode):
+        return [policy.offer(step, value, mode) for step, value in enumerate(values)]
+
+    def test_every_n_sends_best_with_next_points(self):
+        policy = EveryN(3).new()
+        self.assertEqual(self.offer(policy, [5, 4, 3, 6, 7, 2, 8], 'min'), [
+            [(0, 5)], [], [], [(3, 6), (2, 3)], [], [], [(6, 8), (5, 2)]
+        ])
+        self.assertEqual(policy.finish(), [])
+
+    def test_window_finish(self):
+        policy = Window(3).new()
+        self.assertEqual(self.offer(policy, [1, 3, 2, 5, 4], 'max'), [[], [], [(2, 2.0), (1, 3)], [], []])
+        # The mean of the partial window ends the curve at the last step, the best value is still pending
+        self.assertEqual(policy.finish(), [(4, 4.5), (3, 5)])
+
+        policy = Window(2, reduce='best', keep_best=False).new()
+        self.assertEqual(self.offer(policy, [3, 1, 2], 'min'), [[], [(1, 1)], []])
+        self.assertEqual(policy.finish(), [(2, 2)])
+
+    def test_best_replaces_aggregate_at_same_step(self):
+        policy = Window(2).new()
+        self.assertEqual(self.offer(policy, [1, 3], 'max'), [[], [(1, 2.0), (1, 3)]])
+        self.assertEqual(policy.finish(), [])
+
+    def test_throttle(self):
+        template = Throttle(10)
+        policy = template.new()
+        with mock.patch('time.monotonic', side_effect=[0, 1, 2, 11]):
+            self.assertEqual(self.offer(policy, [3, 2, 4, 5], 'min'), [[(0, 3)], [], [], [(3, 5), (1, 2)]])
+        with mock.patch('time.monotonic', return_value=12):
+            self.assertEqual(policy.offer(4, 1, 'min'), [])
+        self.assertEqual(policy.finish(), [(4, 1)])
+        # Trials get their own copy of the policy
+        with mock.patch('time.monotonic', return_value=12):
+            self.assertEqual(template.new().offer(0, 1, 'min'), [(0, 1)])
+
+
+class ClientCacheTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cache.json')
+        self.cache = ClientCache(self.path)
+        self.cache.set_schema('v1', 'schema')
+        self.cache.set_worker({'name': 'worker', 'url': f'{API}workers/1/'})
+        self.cache.set_metric({'name': 'loss', 'url': f'{API}metrics/1/', 'mode': 'min'})
+        self.cache.set_experiment('group', 'identifier', {'lr': 0.1}, {
+            'url': f'{API}experiments/1/', 'n_trials': 2,
+            'metrics': [{'name': 'acc', 'url': f'{API}metrics/2/', 'mode': 'max'}]
+        })
+
+    def test_load_saved(self):
+        cache = ClientCache(self.path)
+        self.assertEqual((cache.schema_version, cache.schema), ('v1', 'schema'))
+        self.assertEqual(cache.get_worker('worker')['url'], f'{API}workers/1/')
+        self.assertEqual(cache.get_metric('loss', None)['url'], f'{API}metrics/1/')
+        self.assertEqual(cache.get_metric('acc', 'max')['url'], f'{API}metrics/2/')
+        # The server decides whether a different mode is an error
+        self.assertIsNone(cache.get_metric('acc', 'min'))
+        experiment = cache.get_experiment('group', 'identifier', {'lr': 0.1}, [f'{API}metrics/2/'], 2)
+        self.assertEqual(experiment['url'], f'{API}experiments/1/')
+        self.assertIsNone(cache.get_experiment('group', 'identifier', {'lr': 0.1}, None, 3))
+        self.assertIsNone(cache.get_experiment('group', 'identifier', {'lr': 0.1}, [f'{API}metrics/1/'], None))
+        self.assertIsNone(cache.get_experiment('group', 'identifier', {'lr': 0.2}, None, None))
+
+    def test_invalidate(self):
+        self.cache.set_schema('v1', 'schema')
+        self.assertIsNotNone(ClientCache(self.path).get_worker('worker'))
+        self.cache.set_schema('v2', 'new schema')
+        cache = ClientCache(self.path)
+        self.assertEqual((cache.schema_version, cache.schema), ('v2', 'new schema'))
+        self.assertEqual((cache.workers, cache.metrics, cache.experiments), ({}, {}, {}))
+
+        self.cache.set_worker({'name': 'worker', 'url': f'{API}workers/1/'})
+        self.cache.clear_objects()
+        cache = ClientCache(self.path)
+        self.assertEqual(cache.schema_version, 'v2')
+        self.assertIsNone(cache.get_worker('worker'))
+
+    def test_ignores_unreadable_files(self):
+        with open(self.path, 'w') as f:
+            f.write('{"format": ')
+        self.assertIsNone(ClientCache(self.path).schema)
+        with open(self.path, 'w') as f:
+            json.dump({'format': 0, 'schema_version': 'v1', 'schema': 'schema'}, f)
+        self.assertIsNone(ClientCache(self.path).schema)
+
+
+class SilentServer:
+    """
+    A server that accepts connections but never responds, so every request times out reading the response
+    """
+    def __init__(self):
+        self.socket = socket.socket()
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.listen(10)
+        self.connections = []
+        threading.Thread(target=self.accept, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.socket.getsockname()[1]}/'
+
+    def accept(self):
+        while True:
+            try:
+                connection, _ = self.socket.accept()
+            except OSError:
+                return
+            self.connections.append(connection)
+
+    def close(self):
+        self.socket.close()
+        for c in self.connections:
+            c.close()
+
+
+class TransportRetryTest(TestCase):
+    def setUp(self):
+        self.server = SilentServer()
+        self.addCleanup(self.server.close)
+        self.transport = Transport(timeout=(1, 0.1), max_retries=2, backoff_factor=0)
+        self.addCleanup(self.transport.close)
+
+    def test_post_read_timeout_is_not_retried(self):
+        with self.assertRaises(requests.exceptions.RequestException):
+            self.transport.session.post(self.server.url + 'trials/get-or-create/', json={})
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_get_read_timeout_is_retried(self):
+        with self.assertRaises(requests.exceptions.RequestException):
+            self.transport.session.get(self.server.url + 'trials/')
+        self.assertEqual(len(self.server.connections), 3)
+
+
+@skipIf(aio.aiohttp is None, 'aiohttp is not installed')
+class AsyncRetryTest(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def request(self, server, method):
+        client = AsyncKuroClient(server=server, timeout=0.2, max_retries=2, backoff_factor=0)
+
+        async def request():
+            try:
+                return await client.request(method, 'trials/get-or-create/')
+            finally:
+                await client.close()
+
+        with self.assertRaises((aiohttp.ClientError, asyncio.TimeoutError)):
+            self.loop.run_until_complete(request())
+        return client.latency.summary()[f'{method} trials/get-or-create/']
+
+    def test_timeouts_are_only_retried_for_get(self):
+        server = SilentServer()
+        self.addCleanup(server.close)
+        self.assertEqual(self.request(server.url, 'POST')['count'], 1)
+        self.assertEqual(len(server.connections), 1)
+        self.assertEqual(self.request(server.url, 'GET')['count'], 3)
+        self.assertEqual(len(server.connections), 4)
+
+    def test_connection_errors_are_retried(self):
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        url = f'http://127.0.0.1:{closed.getsockname()[1]}/'
+        closed.close()
+        self.assertEqual(self.request(url, 'POST')['errors'], 3)
+
+
+def trial_links(trial):
+    return trial.worker, trial.experiment
+
+
+class FailFirstTrial:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.failed_trial_id = None
+
+    def __call__(self, trial):
+        with self.lock:
+            if self.failed_trial_id is None:
+                self.failed_trial_id = trial.id
+                raise RuntimeError('diverged')
+        return trial.id
+
+
+class ChunkedInput:
+    """
+    Decodes a request body sent with chunked transfer encoding
+    """
+    def __init__(self, raw):
+        self.raw = raw
+        self.buffer = b''
+        self.done = False
+
+    def readline(self):
+        while b'\n' not in self.buffer and not self.done:
+            size = int(self.raw.readline().split(b';')[0], 16)
+            if size == 0:
+                self.done = True
+            else:
+                self.buffer += self.raw.read(size)
+            self.raw.readline()
+        end = self.buffer.find(b'\n') + 1 or len(self.buffer)
+        line, self.buffer = self.buffer[:end], self.buffer[end:]
+        return line
+
+
+class LiveServerHandler(basehttp.ServerHandler):
+    """
+    Makes the test server behave like gunicorn for the client: it answers one request per connection without telling
+    the client, which would then send its next request on the closed connection, and does not decode chunked bodies
+    """
+    def get_stdin(self):
+        if self.base_env.get('HTTP_TRANSFER_ENCODING', '').lower() == 'chunked':
+            return ChunkedInput(self.stdin)
+        return self.stdin
+
+    def cleanup_headers(self):
+        self.headers['Connection'] = 'close'
+
+
+class CountingServerHandler(LiveServerHandler):
+    """
+    Records the most requests the test server handled at once, each taking at least delay seconds
+    """
+    lock = threading.Lock()
+    delay = 0
+    in_flight = 0
+    max_in_flight = 0
+
+    def run(self, application):
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        try:
+            time.sleep(cls.delay)
+            super().run(application)
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+
+class ClientTestCase(LiveServerTestCase):
+    """
+    Tests of kuro.client against a live server, with the client cache in a temporary directory
+    """
+    def setUp(self):
+        clear_caches()
+        patcher = mock.patch('django.core.servers.basehttp.ServerHandler', LiveServerHandler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache_dir = tempfile.TemporaryDirectory()
+        patcher = mock.patch(
+            'kuro.client.ClientCache.for_server',
+            lambda server: ClientCache(os.path.join(self.cache_dir.name, 'cache.json'))
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.cache_dir.cleanup)
+        self.worker = ClientWorker('runner', server=self.live_server_url + '/')
+
+
+class RunTrialsTest(ClientTestCase):
+    def test_failed_trial_is_recorded_and_resumed(self):
+        experiment = self.worker.experiment('g', 'runner', metrics=['acc'], n_trials=3)
+        fn = FailFirstTrial()
+        outcomes = experiment.run_trials(fn, n_parallel=2, backend='thread')
+
+        self.assertEqual(len(outcomes), 3)
+        errors = {o.trial_id: o.error for o in outcomes if o.error is not None}
+        self.assertEqual(list(errors), [fn.failed_trial_id])
+        self.assertIsInstance(errors[fn.failed_trial_id], RuntimeError)
+        trials = Trial.objects.filter(experiment__identifier='runner')
+        self.assertEqual(len(trials), 3)
+        for trial in trials:
+            self.assertEqual(trial.failed, trial.id == fn.failed_trial_id)
+            self.assertEqual(trial.complete, trial.id != fn.failed_trial_id)
+
+        outcomes = experiment.run_trials(lambda trial: trial.id, n_parallel=2, backend='thread')
+        self.assertEqual(outcomes, [(fn.failed_trial_id, fn.failed_trial_id, None)])
+        self.assertEqual(Trial.objects.filter(failed=False, complete=True).count(), 3)
+
+    def test_process_backend(self):
+        experiment = self.worker.experiment('g', 'processes', metrics=['acc'], n_trials=3)
+        outcomes = experiment.run_trials(trial_links, n_parallel=2, backend='process')
+        self.assertEqual(len(outcomes), 3)
+        for outcome in outcomes:
+            self.assertIsNone(outcome.error)
+            # Trials get the same urls as with the thread backend
+            self.assertEqual(outcome.result, (self.worker.url, experiment.url))
+        self.assertEqual(Trial.objects.filter(experiment__identifier='processes', complete=True).count(), 3)
+
+        outcomes = experiment.run_trials(trial_links, n_parallel=2, backend='process')
+        self.assertEqual(outcomes, [])
+
+    def test_shared_cache_writes_from_threads(self):
+        cache = self.worker.client.cache
+
+        def set_metrics(thread):
+            for i in range(100):
+                cache.set_metric({'url': f'{API}metrics/{i}/', 'name': f'{thread}-{i}', 'mode': 'max'})
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(set_metrics, range(8)))
+        self.assertEqual(len(ClientCache(cache.path).metrics), 800)
+
+
+class WorkerClientTest(ClientTestCase):
+    def test_cached_worker_skips_hardware(self):
+        with mock.patch('kuro.client.get_worker_hardware') as get_worker_hardware:
+            worker = ClientWorker('runner', server=self.live_server_url + '/')
+        get_worker_hardware.assert_not_called()
+        self.assertEqual(worker.url, self.worker.url)
+        self.assertNotIn('workers/get-or-create/create', worker.client.latency.summary())
+
+    def test_uncached_worker_is_looked_up(self):
+        self.worker.client.cache.clear()
+        with mock.patch('kuro.client.get_worker_hardware', return_value=('cpu', 4.0, '{"gpus": []}')) as hardware:
+            worker = ClientWorker('runner', server=self.live_server_url + '/')
+            other = ClientWorker('other', server=self.live_server_url + '/')
+        self.assertEqual(hardware.call_count, 2)
+        self.assertEqual(worker.url, self.worker.url)
+        self.assertEqual(worker.client.latency.summary()['workers/get-or-create/create']['count'], 1)
+        self.assertEqual((other.name, other.cpu_brand, other.memory), ('other', 'cpu', 4.0))
+        self.assertEqual(Worker.objects.count(), 2)
+
+
+class ReportMetricsTest(ClientTestCase):
+    def setUp(self):
+        super().setUp()
+        self.spool_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.spool_dir.cleanup)
+        self.experiment = self.worker.experiment('g', 'many', metrics=['loss', ('acc', 'max', EveryN(2))], n_trials=1)
+        self.client = self.worker.client
+
+    def series(self, trial):
+        results = Result.objects.filter(trial_id=trial.id).values_list('id', 'metric__name')
+        series = get_storage().read_series([result_id for result_id, _ in results])
+        return {name: dict(zip(map(int, series[result_id][0]), map(float, series[result_id][1])))
+                for result_id, name in results}
+
+    def test_one_request_per_call(self):
+        trial = self.experiment.trial(spool_dir=None)
+        self.client.latency.reset()
+        for step, acc in enumerate([0.5, 0.4, 0.3]):
+            trial.report_metrics(
+                {'loss': 1.0, 'acc': acc, 'f1': 0.1, 'lr': 0.01}, step=step, modes={'lr': 'min', 'f1': 'max'}
+            )
+        latency = self.client.latency.summary()
+        # New metrics are created together the first time and cached after
+        self.assertEqual(latency['metrics/bulk-get-or-create/create']['count'], 1)
+        self.assertEqual(latency['result_values/bulk-report/create']['count'], 3)
+        self.assertEqual(set(latency), {'metrics/bulk-get-or-create/create', 'result_values/bulk-report/create'})
+        # The acc policy sends every second value
+        self.assertEqual(self.series(trial), {
+            'loss': {0: 1.0, 1: 1.0, 2: 1.0}, 'acc': {0: 0.5, 2: 0.3}, 'f1': {0: 0.1, 1: 0.1, 2: 0.1},
+            'lr': {0: 0.01, 1: 0.01, 2: 0.01}
+        })
+
+    def test_invalid_new_metric_sends_nothing(self):
+        trial = self.experiment.trial(spool_dir=self.spool_dir.name)
+        with self.assertRaises(coreapi.exceptions.ErrorMessage):
+            trial.report_metrics({'loss': 1.0, 'unknown': 0.1}, step=0)
+        self.assertEqual(self.series(trial), {})
+        self.assertFalse(trial.spool.pending)
+
+    def test_spooled_when_metrics_cannot_be_created(self):
+        trial = self.experiment.trial(spool_dir=self.spool_dir.name)
+        with mock.patch.object(
+            self.client.transport.session, 'send', side_effect=requests.exceptions.ConnectionError('down')
+        ):
+            trial.report_metrics({'loss': 1.0, 'acc': 0.5, 'f1': 0.1}, step=0, modes={'f1': 'max'})
+        self.assertEqual(
+            sorted(e.get('name', e.get('metric')) for e in trial.spool.read()),
+            sorted(['f1', self.experiment.metrics['loss'].url, self.experiment.metrics['acc'].url])
+        )
+        trial.spool._retry_at = 0
+        trial.end()
+        self.assertEqual(self.series(trial), {'loss': {0: 1.0}, 'acc': {0: 0.5}, 'f1': {0: 0.1}})
+
+
+class SeriesUpdatesClientTest(ClientTestCase):
+    def test_long_since_is_sent_in_body(self):
+        experiment = self.worker.experiment('g', 'updates', metrics=['acc'], n_trials=1)
+        trial = experiment.trial()
+        for step in range(3):
+            trial.report_metric('acc', step, step=step)
+        client = self.worker.client
+        experiment_id = Trial.objects.get(id=trial.id).experiment_id
+
+        update, = client.result_series_updates([experiment_id])['results']
+        self.assertEqual(update['steps'], [0, 1, 2])
+        since = {update['result']: (update['revision'], 1)}
+        # Results the server does not have make the query too long for a query string
+        since.update({result_id: (1, 100) for result_id in range(10 ** 6, 10 ** 6 + 1000)})
+        response = client.result_series_updates([experiment_id], since)
+        self.assertEqual(response['results'], [])
+        self.assertEqual(response['removed'], list(range(10 ** 6, 10 ** 6 + 1000)))
+        self.assertIn('results/updates_query', client.latency.summary())
+
+
+class SpoolTest(ClientTestCase):
+    def setUp(self):
+        super().setUp()
+        self.spool_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.spool_dir.cleanup)
+        self.experiment = self.worker.experiment('g', 'spool', metrics=['acc'], n_trials=1)
+        self.trial = self.experiment.trial(spool_dir=self.spool_dir.name)
+
+    def server_down(self):
+        return mock.patch.object(
+            self.worker.client.transport.session, 'send', side_effect=requests.exceptions.ConnectionError('down')
+        )
+
+    def series(self):
+        results = Result.objects.filter(trial_id=self.trial.id).values_list('id', 'metric__name')
+        series = get_storage().read_series([result_id for result_id, _ in results])
+        return {name: (list(series[result_id][0]), list(series[result_id][1])) for result_id, name in results}
+
+    def test_replay_after_server_failure(self):
+        with self.server_down():
+            self.trial.report_metric('acc', 0.5, step=0)
+            self.trial.report_metric('acc', 0.6, step=1)
+            # The metric cannot be created either, so it is spooled by name
+            self.trial.report_metric('loss', 2.0, step=1, mode='min')
+        self.assertTrue(self.trial.spool.pending)
+        self.assertEqual(self.series(), {})
+
+        # Until the retry interval has passed values are spooled without trying the server, keeping their order
+        self.trial.report_metric('acc', 0.7, step=1)
+        self.assertEqual(len(self.trial.spool.read()), 4)
+        self.trial.end()
+        self.assertFalse(self.trial.spool.pending)
+        self.assertEqual(self.series(), {'acc': ([0, 1], [0.5, 0.7]), 'loss': ([1], [2.0])})
+        self.assertTrue(Trial.objects.get(id=self.trial.id).complete)
+
+    def test_new_metrics_wait_for_retry_interval(self):
+        with self.server_down() as send:
+            self.trial.report_metric('loss', 2.0, step=0, mode='min')
+            n_requests = send.call_count
+            # The server is not tried again until the retry interval has passed
+            self.trial.report_metric('loss', 1.0, step=1, mode='min')
+            self.trial.report_metrics({'acc': 0.5, 'f1': 0.1}, step=1, modes={'f1': 'max'})
+            self.assertEqual(send.call_count, n_requests)
+        self.assertEqual(len(self.trial.spool.read()), 4)
+        self.trial.spool._retry_at = 0
+        self.trial.end()
+        self.assertEqual(self.series(), {'acc': ([1], [0.5]), 'loss': ([0, 1], [2.0, 1.0]), 'f1': ([1], [0.1])})
+
+    def test_replay_directory_completes_trial(self):
+        self.trial.report_metric('acc', 0.5, step=0)
+        with self.server_down():
+            self.trial.report_metric('acc', 0.6, step=1)
+            self.trial.end()
+        self.assertFalse(Trial.objects.get(id=self.trial.id).complete)
+        # A job killed while writing leaves a partial last line
+        with open(self.trial.spool.path, 'a') as f:
+            f.write('{"trial": ')
+
+        outcomes = replay_directory(self.spool_dir.name, self.worker.client)
+        self.assertEqual(outcomes, {self.trial.spool.path: 1})
+        self.assertEqual(self.series(), {'acc': ([0, 1], [0.5, 0.6])})
+        self.assertTrue(Trial.objects.get(id=self.trial.id).complete)
+        self.assertEqual(replay_directory(self.spool_dir.name, self.worker.client), {})
+
+    def test_failed_replay_keeps_spool(self):
+        spool = Spool(os.path.join(self.spool_dir.name, 'other.spool'))
+        spool.append_points([(self.trial.url, self.experiment.metrics['acc'].url, 0, 0.5)])
+        with self.server_down():
+            outcomes = replay_directory(self.spool_dir.name, self.worker.client)
+        self.assertIsInstance(outcomes[spool.path], requests.exceptions.ConnectionError)
+        self.assertEqual(len(spool.read()), 1)
+        self.assertEqual(spool.replay(self.worker.client), 1)
+        self.assertFalse(spool.pending)
+
+
+class ClientCacheResetTest(ClientTestCase):
+    def test_database_reset_drops_cached_objects(self):
+        self.worker.experiment('g', 'reset', metrics=['acc'], n_trials=1)
+        self.assertEqual(len(self.worker.client.cache.experiments), 1)
+        # Reset the server's database, the cache still has the urls of the deleted objects
+        Experiment.objects.all().delete()
+        Worker.objects.all().delete()
+        Metric.objects.all().delete()
+
+        worker = ClientWorker('runner', server=self.live_server_url + '/')
+        experiment = worker.experiment('g', 'reset', metrics=['acc'], n_trials=1)
+        self.assertFalse(Worker.objects.exists())
+        trial = experiment.trial()
+        trial.report_metric('acc', 0.5, step=0)
+        trial.end()
+        self.assertTrue(Trial.objects.get(id=trial.id).complete)
+        self.assertEqual(Result.objects.get().metric.name, 'acc')
+        cached_experiment, = worker.client.cache.experiments.values()
+        self.assertEqual(cached_experiment['url'], experiment.url)
+        self.assertEqual(worker.client.cache.get_worker('runner')['url'], worker.url)
+
+
+class BatchReporterTest(ClientTestCase):
+    def setUp(self):
+        super().setUp()
+        self.experiment = self.worker.experiment('g', 'batch', metrics=['loss'], n_trials=1)
+        self.trial = self.experiment.trial()
+        self.metric_url = self.experiment.metrics['loss'].url
+        self.client = self.worker.client
+
+    def stored(self):
+        result = Result.objects.filter(trial_id=self.trial.id).first()
+        if result is None:
+            return {}
+        steps, values = get_storage().read_series([result.id])[result.id]
+        return dict(zip(map(int, steps), map(float, values)))
+
+    def wait_stored(self, n_values, timeout=5):
+        deadline = time.monotonic() + timeout
+        while len(self.stored()) < n_values and time.monotonic() < deadline:
+            time.sleep(.05)
+        return self.stored()
+
+    def reporter(self, **kwargs):
+        reporter = BatchReporter(self.client, **kwargs)
+        self.addCleanup(reporter.close)
+        return reporter
+
+    def test_report_does_not_wait_for_server(self):
+        sending = threading.Event()
+        release = threading.Event()
+        create_result_values = self.client.create_result_values
+
+        def slow_create_result_values(points):
+            sending.set()
+            release.wait(5)
+            return create_result_values(points)
+
+        reporter = self.reporter(flush_interval=.05)
+        with mock.patch.object(self.client, 'create_result_values', slow_create_result_values):
+            reporter.report(self.trial.url, self.metric_url, 0, 1.0)
+            self.assertTrue(sending.wait(5))
+            # The first batch is stuck sending while more values are reported
+            start = time.monotonic()
+            for step in range(1, 100):
+                reporter.report(self.trial.url, self.metric_url, step, 1.0)
+            self.assertLess(time.monotonic() - start, 1)
+            release.set()
+            reporter.flush()
+        self.assertEqual(len(self.stored()), 100)
+
+    def test_flushes_after_interval(self):
+        reporter = self.reporter(flush_interval=.2)
+        reporter.report(self.trial.url, self.metric_url, 0, 1.0)
+        self.assertEqual(self.wait_stored(1), {0: 1.0})
+
+    def test_flushes_full_buffer(self):
+        reporter = self.reporter(flush_interval=60, max_buffer_size=3)
+        for step in range(2):
+            reporter.report(self.trial.url, self.metric_url, step, 1.0)
+        time.sleep(.2)
+        self.assertEqual(self.stored(), {})
+        reporter.report(self.trial.url, self.metric_url, 2, 1.0)
+        self.assertEqual(self.wait_stored(3), {0: 1.0, 1: 1.0, 2: 1.0})
+
+    def test_flush_waits_for_reported_values(self):
+        reporter = self.reporter(flush_interval=60)
+        for step in range(5):
+            reporter.report(self.trial.url, self.metric_url, step, step / 10)
+        reporter.flush()
+        self.assertEqual(self.stored(), {step: step / 10 for step in range(5)})
+
+    def test_errors_are_raised_by_next_flush_or_close(self):
+        reporter = BatchReporter(self.client, flush_interval=60)
+        missing_metric_url = self.metric_url.replace('/metrics/', '/workers/')
+        reporter.report(self.trial.url, missing_metric_url, 0, 1.0)
+        with self.assertRaises(coreapi.exceptions.ErrorMessage):
+            reporter.flush()
+        # The error is only raised once and reporting continues
+        reporter.report(self.trial.url, self.metric_url, 1, 1.0)
+        reporter.flush()
+        reporter.report(self.trial.url, missing_metric_url, 2, 1.0)
+        with self.assertRaises(coreapi.exceptions.ErrorMessage):
+            reporter.close()
+        self.assertEqual(self.stored(), {1: 1.0})
+
+    def test_end_sends_values_before_completing(self):
+        trial = self.experiment._setup_trial(self.trial, buffered=True, flush_interval=60, spool_dir=None)
+        trial_complete = self.client.trial_complete
+        stored_at_complete = []
+
+        def record_trial_complete(trial_url):
+            stored_at_complete.append(self.stored())
+            return trial_complete(trial_url)
+
+        for step in range(3):
+            trial.report_metric('loss', step / 10, step=step)
+        with mock.patch.object(self.client, 'trial_complete', record_trial_complete):
+            trial.end()
+        self.assertEqual(stored_at_complete, [{0: 0.0, 1: 0.1, 2: 0.2}])
+        self.assertTrue(Trial.objects.get(id=trial.id).complete)
+
+
+class StreamReporterTest(ClientTestCase):
+    def setUp(self):
+        super().setUp()
+        experiment = self.worker.experiment('g', 'stream', metrics=['loss'], n_trials=1)
+        self.trial = experiment.trial()
+        self.metric_url = experiment.metrics['loss'].url
+        self.client = self.worker.client
+
+    def stored(self):
+        result = Result.objects.get(trial_id=self.trial.id)
+        steps, values = get_storage().read_series([result.id])[result.id]
+        return dict(zip(map(int, steps), map(float, values)))
+
+    def test_streams_are_rotated(self):
+        reporter = StreamReporter(self.client, self.trial.url, max_stream_values=5)
+        for step in range(12):
+            reporter.report(self.trial.url, self.metric_url, step, step / 10)
+        reporter.flush()
+        self.assertEqual(self.stored(), {step: step / 10 for step in range(12)})
+        for step in range(12, 15):
+            reporter.report(self.trial.url, self.metric_url, step, step / 10)
+        reporter.close()
+        reporter.close()
+        self.assertEqual(len(self.stored()), 15)
+        latency = self.client.latency.summary()
+        self.assertGreaterEqual(latency['trials/stream/create']['count'], 4)
+        self.assertNotIn('result_values/bulk-report/create', latency)
+        with self.assertRaises(ValueError):
+            reporter.report(self.trial.url, self.metric_url, 15, 1.5)
+
+    def test_failed_stream_is_resent(self):
+        reporter = StreamReporter(self.client, self.trial.url)
+        stream_result_values = self.client.stream_result_values
+
+        def fail_once(trial_url, points):
+            # Consume what the reporter writes before failing, like a connection dropped mid stream
+            list(points)
+            self.client.stream_result_values = stream_result_values
+            raise requests.exceptions.ConnectionError('reset')
+
+        self.client.stream_result_values = fail_once
+        for step in range(3):
+            reporter.report(self.trial.url, self.metric_url, step, step)
+        reporter.flush()
+        self.assertEqual(self.stored(), {0: 0, 1: 1, 2: 2})
+        self.assertEqual(self.client.latency.summary()['result_values/bulk-report/create']['count'], 1)
+        # The next stream uses a new connection
+        reporter.report(self.trial.url, self.metric_url, 3, 3)
+        reporter.close()
+        self.assertEqual(self.stored(), {0: 0, 1: 1, 2: 2, 3: 3})
+        self.assertEqual(self.client.latency.summary()['trials/stream/create']['count'], 1)
+
+    def test_rejected_values_raise_on_flush(self):
+        reporter = StreamReporter(self.client, self.trial.url)
+        reporter.report(self.trial.url, self.metric_url, 0, 1.0)
+        reporter.report(self.trial.url, self.metric_url.replace('/metrics/', '/workers/'), 1, 2.0)
+        with self.assertRaises(coreapi.exceptions.ErrorMessage):
+            reporter.flush()
+        reporter.close()
+        # The stream batch and the resent values are each rejected as a whole
+        self.assertFalse(Result.objects.filter(trial_id=self.trial.id).exists())
+
+
+@skipIf(aio.aiohttp is None, 'aiohttp is not installed')
+class AsyncClientTest(ClientTestCase):
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def run_async(self, fn, max_concurrency=1):
+        client = AsyncKuroClient(server=self.live_server_url, max_concurrency=max_concurrency, backoff_factor=0)
+
+        async def run():
+            try:
+                return await fn(client)
+            finally:
+                await client.close()
+
+        return self.loop.run_until_complete(run()), client.latency.summary()
+
+    def series(self, trial_id):
+        results = Result.objects.filter(trial_id=trial_id).values_list('id', 'metric__name')
+        series = get_storage().read_series([result_id for result_id, _ in results])
+        return {name: dict(zip(map(int, series[result_id][0]), map(float, series[result_id][1])))
+                for result_id, name in results}
+
+    def test_report_and_end(self):
+        async def run(client):
+            worker = await AsyncWorker.create('async', client)
+            experiment = await worker.experiment('g', 'async', metrics=[('loss', 'min', EveryN(3))], n_trials=1)
+            trial = await experiment.trial()
+            for step, value in enumerate([3.0, 2.0, 4.0, 1.0, 5.0]):
+                await trial.report_metric('loss', value, step=step)
+            await trial.report_metrics({'acc': 0.5, 'loss': 0.5}, step=5)
+            await trial.end()
+            return trial.id
+
+        trial_id, latency = self.run_async(run)
+        # The policy sends every third value and the best value with them, and the last value once the trial ends
+        self.assertEqual(self.series(trial_id), {'loss': {0: 3.0, 3: 1.0, 5: 0.5}, 'acc': {5: 0.5}})
+        self.assertTrue(Trial.objects.get(id=trial_id).complete)
+        self.assertEqual(latency['POST metrics/bulk-get-or-create/']['count'], 2)
+
+    def test_concurrent_trials_share_new_metrics(self):
+        async def run(client):
+            worker = await AsyncWorker.create('async', client)
+            experiment = await worker.experiment('g', 'shared', metrics=['loss'], n_trials=3)
+            trials = [await experiment.trial() for _ in range(3)]
+            await asyncio.gather(experiment.get_metric('f1', 'max'), *(
+                trial.report_metrics({'f1': i / 10, 'loss': 1.0}, step=0, modes={'f1': 'max'})
+                for i, trial in enumerate(trials)
+            ))
+            return [trial.id for trial in trials]
+
+        trial_ids, latency = self.run_async(run)
+        for i, trial_id in enumerate(trial_ids):
+            self.assertEqual(self.series(trial_id), {'f1': {0: i / 10}, 'loss': {0: 1.0}})
+        # One request for the experiment's metrics and one for f1
+        self.assertEqual(latency['POST metrics/bulk-get-or-create/']['count'], 2)
+
+    def test_requests_in_flight_are_bounded(self):
+        class Handler(CountingServerHandler):
+            delay = .2
+
+        async def run(client):
+            return await asyncio.gather(*(client.request('GET', 'metrics/') for _ in range(6)))
+
+        with mock.patch('django.core.servers.basehttp.ServerHandler', Handler):
+            self.run_async(run, max_concurrency=2)
+        self.assertEqual(Handler.max_in_flight, 2)
+
+    def test_iterate_pages(self):
+        for name in ('a', 'b', 'c', 'd', 'e'):
+            Metric.objects.create(name=name, mode='max')
+
+        async def run(client):
+            return [m['name'] async for m in client.iterate('metrics', page_size=2)]
+
+        names, latency = self.run_async(run)
+        self.assertEqual(sorted(names), ['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(sum(stats['count'] for key, stats in latency.items() if key.startswith('GET metrics/')), 3)
+
+    def test_client_errors_are_not_retried(self):
+        async def run(client):
+            with self.assertRaises(aio.KuroRequestError) as raised:
+                await client.request('GET', 'trials/1000/')
+            return raised.exception.status
+
+        status, latency = self.run_async(run)
+        self.assertEqual(status, 404)
+        self.assertEqual(latency['GET trials/1000/']['count'], 1)
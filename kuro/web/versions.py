@@ -0,0 +1,187 @@
+"""
+Data versions for conditional GET requests. Each table has a DataVersion that is incremented once a transaction that
+wrote to it commits: ORM saves and deletes are tracked with signals, and the bulk writes of kuro.web.ingest, which
+bypass signals, call bump_versions. Read endpoints using ConditionalGetMixin derive their ETag from the request and the
+versions of the tables their responses are rendered from, so polling an unchanged list costs one query for the
+versions and an empty 304 response.
+
+Every ingest request commits a write to result values, so bumping their version each time would make its row a hot
+spot that all writers wait on. Each process bumps it at most once every KURO_RESULT_VALUES_VERSION_INTERVAL seconds
+instead: a commit shortly after a bump schedules one more bump at the end of the interval, so readers see a new
+version at most that long after a write.
+"""
+from calendar import timegm
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connection as default_connection, transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+from kuro.web.models import DataVersion, Experiment, Trial, Worker, Metric, Result
+
+
+logger = logging.getLogger(__name__)
+
+# Values are written in bulk with either storage backend, so they share one version that does not follow a model name
+RESULT_VALUES = 'resultvalue'
+
+_result_values_lock = threading.Lock()
+_result_values_bumped_at = None
+_result_values_timer = None
+
+
+def bump_versions(*names):
+    """
+    Increment the versions of tables once the current transaction commits, or immediately outside of a transaction.
+    Tables bumped several times in one transaction are incremented once.
+    """
+    connection = transaction.get_connection()
+    pending = getattr(connection, 'kuro_pending_versions', None)
+    if pending is None:
+        pending = connection.kuro_pending_versions = set()
+    pending.update(names)
+    # Rolling back a transaction or savepoint discards its commit hooks but not the pending names, which are then
+    # bumped by the next commit. An extra bump only costs clients a refetch.
+    if connection.in_atomic_block and any(func is _commit_versions for _, func in connection.run_on_commit):
+        return
+    transaction.on_commit(_commit_versions)
+
+
+def _commit_versions():
+    connection = transaction.get_connection()
+    names = set(connection.kuro_pending_versions)
+    connection.kuro_pending_versions.clear()
+    if RESULT_VALUES in names and _defer_result_values():
+        names.remove(RESULT_VALUES)
+    if len(names) == 0:
+        return
+    try:
+        _increment_versions(names)
+    except OperationalError as e:
+        # The write itself has committed, failing its request now would make the client retry it. Clients may be
+        # served the previous data until the next commit bumps these tables.
+        connection.kuro_pending_versions.update(names)
+        logger.warning('Could not bump data versions of %s: %s', sorted(names), e)
+
+
+def _increment_versions(names):
+    now = timezone.now()
+    updated = DataVersion.objects.filter(name__in=names).update(version=F('version') + 1, updated_at=now)
+    if updated < len(names):
+        for name in names - set(DataVersion.objects.filter(name__in=names).values_list('name', flat=True)):
+            DataVersion.objects.get_or_create(name=name, defaults={'version': 1, 'updated_at': now})
+
+
+def _defer_result_values():
+    """
+    :return: True if the result values version is bumped later by a timer instead of by this commit
+    """
+    global _result_values_bumped_at, _result_values_timer
+    interval = getattr(settings, 'KURO_RESULT_VALUES_VERSION_INTERVAL', 1.0)
+    if interval <= 0:
+        return False
+    with _result_values_lock:
+        if _result_values_timer is not None:
+            # The timer fires after this commit, so its bump covers it
+            return True
+        now = time.monotonic()
+        if _result_values_bumped_at is None or now - _result_values_bumped_at >= interval:
+            _result_values_bumped_at = now
+            return False
+        _result_values_timer = threading.Timer(
+            _result_values_bumped_at + interval - now, _bump_result_values_later
+        )
+        _result_values_timer.start()
+        return True
+
+
+def _bump_result_values_later():
+    global _result_values_bumped_at, _result_values_timer
+    with _result_values_lock:
+        _result_values_timer = None
+        _result_values_bumped_at = time.monotonic()
+    try:
+        _increment_versions({RESULT_VALUES})
+    except OperationalError as e:
+        logger.warning('Could not bump data versions of %s: %s', [RESULT_VALUES], e)
+    finally:
+        # The timer's thread has its own connection
+        default_connection.close()
+
+
+@receiver(post_save, sender=Experiment)
+@receiver(post_save, sender=Trial)
+@receiver(post_save, sender=Worker)
+@receiver(post_save, sender=Metric)
+@receiver(post_save, sender=Result)
+@receiver(post_delete, sender=Experiment)
+@receiver(post_delete, sender=Trial)
+@receiver(post_delete, sender=Worker)
+@receiver(post_delete, sender=Metric)
+@receiver(post_delete, sender=Result)
+def _bump_on_write(sender, **kwargs):
+    bump_versions(sender._meta.model_name)
+
+
+@receiver(m2m_changed, sender=Experiment.metrics.through)
+def _bump_on_experiment_metrics(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_versions('experiment')
+
+
+def data_etag(request, names):
+    """
+    :return: (etag, last_modified) of the response to request rendered from the tables in names, last_modified is a
+    timestamp or None if none of the tables has a version yet
+    """
+    versions = {
+        name: (version, updated_at)
+        for name, version, updated_at in DataVersion.objects.filter(name__in=names).values_list(
+            'name', 'version', 'updated_at'
+        )
+    }
+    key = '\n'.join(
+        [request.get_full_path(), request.META.get('HTTP_ACCEPT', '')] +
+        [f'{name}={versions[name][0] if name in versions else 0}' for name in sorted(names)]
+    )
+    etag = '"' + hashlib.sha1(key.encode('utf8')).hexdigest() + '"'
+    if len(versions) == 0:
+        return etag, None
+    return etag, timegm(max(updated_at for _, updated_at in versions.values()).utctimetuple())
+
+
+class ConditionalGetMixin:
+    """
+    Adds ETag and Last-Modified headers to the list and retrieve responses of a viewset and answers requests whose
+    If-None-Match or If-Modified-Since header matches with 304 Not Modified without reading the queryset.
+    data_versions names every table the responses are rendered from, including those of expandable fields.
+    """
+    data_versions = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(request, self.data_versions, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(request, self.data_versions, super().retrieve, *args, **kwargs)
+
+    def conditional(self, request, names, handler, *args, **kwargs):
+        # Versions are read before the data, so a write committing in between leaves an ETag older than the data it is
+        # sent with. That costs the client one refetch, the other order could keep serving it stale data.
+        etag, last_modified = data_etag(request, names)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            patch_vary_headers(response, ['Accept'])
+        return response
@@ -1,24 +1,41 @@
+import hashlib
 import json
+import time
+from collections import OrderedDict
+import coreapi
+import coreschema
+from coreapi.codecs import CoreJSONCodec
 from django.contrib.auth.models import User, Group
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.db.models import F
 from django.views.decorators.csrf import csrf_exempt
-from django.http.response import HttpResponse
+from django.http.response import HttpResponse, HttpResponseNotAllowed, JsonResponse
 from django.shortcuts import render
 
 from rest_framework import viewsets
+from rest_framework.decorators import action, api_view, schema
 from rest_framework.response import Response
+from rest_framework.schemas import AutoSchema, SchemaGenerator
 from rest_framework.exceptions import ValidationError
 from kuro.web.serializers import (
     UserSerializer, GroupSerializer, ExperimentSerializer,
     TrialSerializer, WorkerSerializer, MetricSerializer,
     ResultSerializer, ResultValueSerializer, MetricGetOrCreateSerializer,
     ExperimentGetOrCreateSerializer, TrialGetOrCreateSerializer, ResultValueCreateSerializer,
-    TrialCompleteSerializer
+    TrialCompleteSerializer, TrialFailSerializer, ResultValueBulkCreateSerializer, WorkerGetOrCreateSerializer,
+    MetricBulkGetOrCreateSerializer, ResultValueStreamPointSerializer, ResultSeriesUpdatesSerializer
 )
 from kuro.web.models import (
-    Experiment, Trial, Worker, Metric, Result, ResultValue
+    Experiment, Trial, Worker, Metric, Result, ResultValue, hyper_parameters_digest
 )
 from kuro.web.dash_app import dispatcher
+from kuro.web.ingest import write_point_atomic, write_points, MissingObjects
+from kuro.web.storage import get_storage
+from kuro.web.buffer import get_write_buffer
+from kuro.web.filters import QueryFilter, query_list
+from kuro.web.series import parse_since, series_updates
+from kuro.web.summaries import summarize_experiments
+from kuro.web.versions import RESULT_VALUES, ConditionalGetMixin
 
 
 
@@ -28,7 +45,30 @@ def dash(request, **kwargs):
 
 @csrf_exempt
 def dash_ajax(request):
-    return HttpResponse(dispatcher(request), content_type='application/json')
+    response = dispatcher(request)
+    # Callbacks raising PreventUpdate have an empty response, the renderer only leaves their outputs as they are if
+    # the status is not 200
+    if len(response) == 0:
+        return HttpResponse(status=204)
+    return HttpResponse(response, content_type='application/json')
+
+
+_schema_version = None
+
+
+@api_view(['GET'])
+@schema(None)
+def schema_version(request):
+    """
+    Digest of the API schema that clients use to invalidate their cached copy of the schema, metrics, and experiments.
+    The schema only changes when the server code changes so the digest is computed once per process.
+    """
+    global _schema_version
+    if _schema_version is None:
+        api_schema = SchemaGenerator(title='Kuro API').get_schema(request=None, public=True)
+        encoded_schema = CoreJSONCodec().encode(api_schema)
+        _schema_version = hashlib.sha1(encoded_schema).hexdigest()
+    return Response({'version': _schema_version})
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -41,14 +81,81 @@ class GroupViewSet(viewsets.ModelViewSet):
     serializer_class = GroupSerializer
 
 
-class ExperimentViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Experiment.objects.all()
-    serializer_class = ExperimentSerializer
+class ActionQuerySchema(AutoSchema):
+    """
+    Passing a schema to @action does not bind it to the view in this version of rest framework, so the query
+    parameters of custom actions are added by the viewset's schema
+    :param action_fields: dictionary from action name to its query parameters as (name, required, description)
+    """
+    def __init__(self, action_fields):
+        super().__init__()
+        self.action_fields = action_fields
+
+    def get_manual_fields(self, path, method):
+        fields = self.action_fields.get(getattr(self.view, 'action', None))
+        if fields is not None:
+            return [
+                coreapi.Field(name=name, required=required, location='query', schema=coreschema.String(description=d))
+                for name, required, d in fields
+            ]
+        return super().get_manual_fields(path, method)
 
 
-class TrialViewSet(viewsets.ModelViewSet):
+class ExperimentViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = Experiment.objects.all()
+    serializer_class = ExperimentSerializer
+    schema = ActionQuerySchema({'summaries': [('ids', True, 'Comma separated experiment ids')]})
+    data_versions = ('experiment', 'metric')
+    query_filters = {
+        'group': QueryFilter('group', 'string', 'Experiment group'),
+        'identifier': QueryFilter('identifier', 'string', 'Experiment identifier'),
+        'metric': QueryFilter('metrics', description='Only experiments with this metric id'),
+    }
+    summary_versions = ('experiment', 'trial', 'result', 'metric', RESULT_VALUES)
+
+    @action(detail=True, methods=['get'])
+    def summary(self, request, pk=None):
+        """
+        Statistics across trials of the best value of each of the experiment's metrics, and the best value of each
+        trial's metrics. The database reduces values per result so no series is read.
+        """
+        def summarize(request, pk=None):
+            return Response(summarize_experiments([self.get_object().id])[0])
+        return self.conditional(request, self.summary_versions, summarize, pk=pk)
+
+    @action(detail=False, methods=['get'])
+    def summaries(self, request):
+        """
+        The summaries of many experiments, in the order of the ids query parameter
+        """
+        def summarize(request):
+            try:
+                experiment_ids = [int(i) for i in query_list(request, 'ids') or []]
+            except ValueError:
+                raise ValidationError({'ids': 'Expected comma separated integers'})
+            missing = set(experiment_ids) - set(
+                Experiment.objects.filter(id__in=experiment_ids).values_list('id', flat=True)
+            )
+            if len(missing) > 0:
+                return Response(
+                    data={'message': f'Experiments do not exist: {sorted(missing)}', 'error': 'DoesNotExist'},
+                    status=400
+                )
+            return Response({'experiments': summarize_experiments(experiment_ids)})
+        return self.conditional(request, self.summary_versions, summarize)
+
+
+class TrialViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Trial.objects.all()
     serializer_class = TrialSerializer
+    data_versions = ('trial', 'worker', 'experiment', 'metric')
+    query_filters = {
+        'experiment': QueryFilter('experiment_id', description='Experiment id'),
+        'group': QueryFilter('experiment__group', 'string', 'Experiment group'),
+        'worker': QueryFilter('worker_id', description='Worker id'),
+        'complete': QueryFilter('complete', 'boolean', 'Whether the trial is complete'),
+        'failed': QueryFilter('failed', 'boolean', 'Whether the trial failed the last time it ran'),
+    }
 
 
 class TrialCompleteViewSet(viewsets.GenericViewSet):
@@ -59,6 +166,30 @@ class TrialCompleteViewSet(viewsets.GenericViewSet):
         if validated_trial.is_valid():
             trial = validated_trial.validated_data['trial']
             trial.complete = True
+            trial.failed = False
+            trial.save()
+            return Response(TrialSerializer(trial, context={'request': request}).data)
+        else:
+            return Response(validated_trial.errors, status=400)
+
+
+class TrialFailViewSet(viewsets.GenericViewSet):
+    serializer_class = TrialFailSerializer
+
+    def create(self, request):
+        """
+        Record that a trial raised. The trial stays incomplete and claimed, so the worker resumes it the next time it
+        claims a trial of the experiment, until it completes.
+        """
+        validated_trial = TrialFailSerializer(data=request.data)
+        if validated_trial.is_valid():
+            trial = validated_trial.validated_data['trial']
+            if trial.complete:
+                return Response(
+                    data={'message': f'Trial with id={trial.id} is complete', 'error': 'TrialComplete'},
+                    status=400
+                )
+            trial.failed = True
             trial.save()
             return Response(TrialSerializer(trial, context={'request': request}).data)
         else:
@@ -72,35 +203,94 @@ class TrialGetOrCreateViewSet(viewsets.GenericViewSet):
     def create(self, request):
         validated_trial = TrialGetOrCreateSerializer(data=request.data)
         if validated_trial.is_valid():
-            worker = validated_trial.validated_data['worker']
-            experiment = validated_trial.validated_data['experiment']
-            trials = Trial.objects.filter(experiment=experiment).all()
-            if len(trials) < experiment.n_trials:
-                trial = Trial(worker=worker, experiment=experiment)
-                trial.save()
+            worker_id = validated_trial.validated_data['worker']
+            experiment_id = validated_trial.validated_data['experiment']
+            # Claim a slot with a single conditional update before any read. On Postgres it locks the experiment row
+            # so concurrent claims are serialized and never exceed n_trials. On SQLite starting the transaction with
+            # a write avoids the deadlock of many transactions trying to upgrade a read lock at the same time.
+            claimed = Experiment.objects.filter(
+                id=experiment_id, n_claimed__lt=F('n_trials')
+            ).update(n_claimed=F('n_claimed') + 1)
+            if claimed:
+                if not Worker.objects.filter(id=worker_id).exists():
+                    transaction.set_rollback(True)
+                    return Response(
+                        data={'message': f'Worker with id={worker_id} does not exist', 'error': 'DoesNotExist'},
+                        status=400
+                    )
+                trial = Trial.objects.create(worker_id=worker_id, experiment_id=experiment_id)
             else:
+                n_trials = Experiment.objects.filter(id=experiment_id).values_list('n_trials', flat=True).first()
+                if n_trials is None:
+                    return Response(
+                        data={'message': f'Experiment with id={experiment_id} does not exist', 'error': 'DoesNotExist'},
+                        status=400
+                    )
                 trial = Trial.objects.filter(
-                    worker=worker, experiment=experiment, complete=False
+                    worker_id=worker_id, experiment_id=experiment_id, complete=False
                 ).first()
                 if trial is None:
                     return Response({
-                        'message': f'n_trials={experiment.n_trials}, cannot create more',
+                        'message': f'n_trials={n_trials}, cannot create more',
                         'error': 'TooManyTrials'
                     })
 
-            return Response(TrialSerializer(trial, context={'request': request}).data)
+            # Clients keep the worker and experiment of the trials they claim
+            return Response(
+                TrialSerializer(trial, expand=['worker', 'experiment'], context={'request': request}).data
+            )
         else:
             return Response(validated_trial.errors, status=400)
 
 
-class WorkerViewSet(viewsets.ModelViewSet):
+class WorkerViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Worker.objects.all()
     serializer_class = WorkerSerializer
+    data_versions = ('worker',)
+    query_filters = {
+        'name': QueryFilter('name', 'string', 'Worker name'),
+        'active': QueryFilter('active', 'boolean', 'Whether the worker is active'),
+    }
+
+
+class WorkerGetOrCreateViewSet(viewsets.GenericViewSet):
+    serializer_class = WorkerGetOrCreateSerializer
+
+    @transaction.atomic
+    def create(self, request):
+        validated_worker = WorkerGetOrCreateSerializer(data=request.data)
+        if validated_worker.is_valid():
+            data = validated_worker.validated_data
+            worker = Worker.objects.filter(name=data['name']).first()
+            if worker is None:
+                worker_data = {
+                    'name': data['name'],
+                    'cpu_brand': data['cpu_brand'],
+                    'memory': data['memory'],
+                    'active': True
+                }
+                if data['gpus'] is not None:
+                    worker_data['gpus'] = data['gpus']
+                worker_serializer = WorkerSerializer(data=worker_data, context={'request': request})
+                if worker_serializer.is_valid():
+                    worker_serializer.save()
+                    return Response(worker_serializer.data)
+                else:
+                    return Response(worker_serializer.errors, status=400)
+            else:
+                return Response(WorkerSerializer(worker, context={'request': request}).data)
+        else:
+            return Response(validated_worker.errors, status=400)
 
 
-class MetricViewSet(viewsets.ModelViewSet):
+class MetricViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Metric.objects.all()
     serializer_class = MetricSerializer
+    data_versions = ('metric',)
+    query_filters = {
+        'name': QueryFilter('name', 'string', 'Metric name'),
+        'mode': QueryFilter('mode', 'string', 'Metric mode, min or max'),
+    }
 
 
 class MetricGetOrCreateViewSet(viewsets.GenericViewSet):
@@ -146,6 +336,46 @@ class MetricGetOrCreateViewSet(viewsets.GenericViewSet):
             return Response(validated_metric.errors, status=400)
 
 
+class MetricBulkGetOrCreateViewSet(viewsets.GenericViewSet):
+    serializer_class = MetricBulkGetOrCreateSerializer
+
+    @transaction.atomic
+    def create(self, request):
+        validated_metrics = MetricBulkGetOrCreateSerializer(data=request.data)
+        if validated_metrics.is_valid():
+            requested = validated_metrics.data['metrics']
+            existing = {m.name: m for m in Metric.objects.filter(name__in=[r['name'] for r in requested])}
+            # Every entry is validated before any metric is created, so a request answered with an error creates none
+            new_metrics = OrderedDict()
+            for r in requested:
+                name = r['name']
+                mode = r.get('mode')
+                metric = existing.get(name)
+                if metric is None and name not in new_metrics:
+                    if mode is None or mode == 'auto':
+                        mode = MetricGetOrCreateViewSet.infer_mode(name)
+                    metric_serializer = MetricSerializer(data={'name': name, 'mode': mode}, context={'request': request})
+                    if not metric_serializer.is_valid():
+                        return Response(metric_serializer.errors, status=400)
+                    new_metrics[name] = metric_serializer
+                    continue
+                current_mode = metric.mode if metric is not None else new_metrics[name].validated_data['mode']
+                if mode is not None and mode != 'auto' and current_mode != mode:
+                    return Response(
+                        data={
+                            'message': f'Metric with name={name} exists but with mode={current_mode} instead of the given mode={mode}',
+                            'error': 'InvalidMode'
+                        },
+                        status=400
+                    )
+            for name, metric_serializer in new_metrics.items():
+                existing[name] = metric_serializer.save()
+            metrics = [existing[r['name']] for r in requested]
+            return Response({'metrics': MetricSerializer(metrics, many=True, context={'request': request}).data})
+        else:
+            return Response(validated_metrics.errors, status=400)
+
+
 class ExperimentGetOrCreateViewSet(viewsets.GenericViewSet):
     serializer_class = ExperimentGetOrCreateSerializer
 
@@ -160,72 +390,269 @@ class ExperimentGetOrCreateViewSet(viewsets.GenericViewSet):
             metrics = data['metrics']
             n_trials = data['n_trials']
 
-            str_hyper_parameters = json.dumps(hyper_parameters, sort_keys=True)
+            digest = hyper_parameters_digest(hyper_parameters)
             experiment = Experiment.objects.filter(
                 group=group,
                 identifier=identifier,
-                hyper_parameters=str_hyper_parameters
+                hyper_parameters_digest=digest
             ).first()
             if experiment is None:
-                if n_trials is None:
-                    data['n_trials'] = 1
-                data['hyper_parameters'] = str_hyper_parameters
+                try:
+                    with transaction.atomic():
+                        experiment = Experiment.objects.create(
+                            group=group,
+                            identifier=identifier,
+                            hyper_parameters=json.dumps(hyper_parameters, sort_keys=True),
+                            n_trials=1 if n_trials is None else n_trials
+                        )
+                        experiment.metrics.set(metrics)
+                    return Response(
+                        ExperimentSerializer(experiment, expand=['metrics'], context={'request': request}).data
+                    )
+                except IntegrityError:
+                    # Another job created the experiment since the lookup above
+                    experiment = Experiment.objects.get(
+                        group=group,
+                        identifier=identifier,
+                        hyper_parameters_digest=digest
+                    )
 
-                experiment_serializer = ExperimentSerializer(data=data, context={'request': request})
-                if experiment_serializer.is_valid():
-                    experiment_serializer.save()
-                    return Response(experiment_serializer.data)
-                else:
-                    return Response(experiment_serializer.errors, status=400)
-            else:
-                if n_trials is not None:
-                    experiment.n_trials = n_trials
-                if metrics is not None:
-                    for m in metrics:
-                        experiment.metrics.add(m)
-                experiment.save()
-                return Response(ExperimentSerializer(experiment, context={'request': request}).data)
+            if n_trials is not None and n_trials != experiment.n_trials:
+                experiment.n_trials = n_trials
+                experiment.save(update_fields=['n_trials'])
+            if metrics is not None and len(metrics) > 0:
+                experiment.metrics.add(*metrics)
+            return Response(
+                ExperimentSerializer(experiment, expand=['metrics'], context={'request': request}).data
+            )
         else:
             return Response(validated_experiment.errors, status=400)
 
 
-class ResultViewSet(viewsets.ReadOnlyModelViewSet):
+class ResultViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Result.objects.all()
     serializer_class = ResultSerializer
+    schema = ActionQuerySchema({'updates': [
+        ('experiments', True, 'Comma separated experiment ids'),
+        ('since', False, 'Comma separated result:revision:last_step of each result held, the step may be empty'),
+    ]})
+    # Results include the summary of their values
+    data_versions = ('result', RESULT_VALUES, 'trial', 'worker', 'experiment', 'metric')
+    query_filters = {
+        'trial': QueryFilter('trial_id', description='Trial id'),
+        'metric': QueryFilter('metric_id', description='Metric id'),
+        'experiment': QueryFilter('trial__experiment_id', description='Experiment id'),
+    }
+
+    @action(detail=True, methods=['get'])
+    def series(self, request, pk=None):
+        """
+        All values of the result as arrays of steps and values sorted by step, read with a single query
+        """
+        def read_series(request, pk=None):
+            result = self.get_object()
+            steps, values = get_storage().read_series([result.id]).get(result.id, ([], []))
+            return Response({'steps': list(map(int, steps)), 'values': list(map(float, values))})
+        return self.conditional(request, ('result', RESULT_VALUES), read_series, pk=pk)
+
+    @action(detail=False, methods=['get'])
+    def updates(self, request):
+        """
+        The series of the results of experiments that changed since the revisions given in since. Results only
+        appended to since then return their values after the given last step, others their whole series, see
+        kuro.web.series.series_updates.
+        """
+        def read_updates(request):
+            try:
+                experiment_ids = [int(i) for i in query_list(request, 'experiments') or []]
+            except ValueError:
+                raise ValidationError({'experiments': 'Expected comma separated integers'})
+            try:
+                since = parse_since(query_list(request, 'since') or [])
+            except ValueError:
+                raise ValidationError({'since': 'Expected comma separated result:revision:last_step'})
+            return Response(series_updates(experiment_ids, since))
+        return self.conditional(
+            request, ('result', RESULT_VALUES, 'trial', 'experiment', 'metric'), read_updates
+        )
+
+    @action(detail=False, methods=['post'], url_path='updates-query', serializer_class=ResultSeriesUpdatesSerializer)
+    def updates_query(self, request):
+        """
+        The same as updates with the experiments and since sent as lists in the body, for readers holding too many
+        results to fit in the query string
+        """
+        validated_query = ResultSeriesUpdatesSerializer(data=request.data)
+        if validated_query.is_valid():
+            data = validated_query.validated_data
+            return Response(series_updates(data['experiments'], data['since']))
+        else:
+            return Response(validated_query.errors, status=400)
 
 
-class ResultValueViewSet(viewsets.ReadOnlyModelViewSet):
+class ResultValueViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = ResultValue.objects.all()
     serializer_class = ResultValueSerializer
+    data_versions = (RESULT_VALUES, 'result', 'trial', 'worker', 'experiment', 'metric')
+    query_filters = {
+        'result': QueryFilter('result_id', description='Result id'),
+        'trial': QueryFilter('result__trial_id', description='Trial id'),
+        'metric': QueryFilter('result__metric_id', description='Metric id'),
+        'experiment': QueryFilter('result__trial__experiment_id', description='Experiment id'),
+        'step': QueryFilter('step', description='Step equal to'),
+        'step__gt': QueryFilter('step__gt', description='Step greater than'),
+        'step__gte': QueryFilter('step__gte', description='Step greater than or equal to'),
+        'step__lt': QueryFilter('step__lt', description='Step less than'),
+        'step__lte': QueryFilter('step__lte', description='Step less than or equal to'),
+    }
 
 
 class ResultValueCreateViewSet(viewsets.GenericViewSet):
     serializer_class = ResultValueCreateSerializer
 
-    @transaction.atomic
     def create(self, request):
         validated_result_value = ResultValueCreateSerializer(data=request.data, context={'request': request})
         if validated_result_value.is_valid():
-            trial = validated_result_value.validated_data['trial']
-            metric = validated_result_value.validated_data['metric']
+            trial_id = validated_result_value.validated_data['trial']
+            metric_id = validated_result_value.validated_data['metric']
             step = validated_result_value.validated_data['step']
             value = validated_result_value.validated_data['value']
 
-            experiment = trial.experiment
-            experiment.metrics.add(metric)
-            experiment.save()
-
-            result = Result.objects.filter(trial=trial, metric=metric).first()
-            if result is None:
-                result = Result(trial=trial, metric=metric)
-                result.save()
-            result_value = ResultValue.objects.filter(result=result, step=step).first()
-            if result_value is None:
-                result_value = ResultValue(result=result, step=step, value=value)
-                result_value.save()
-            else:
-                result_value.value = value
-                result_value.save()
+            write_buffer = get_write_buffer()
+            try:
+                if write_buffer is None:
+                    result_id, result_value_id = write_point_atomic(trial_id, metric_id, step, value)
+                else:
+                    write_buffer.write([(trial_id, metric_id, step, value)])
+                    result_id, result_value_id = None, None
+            except MissingObjects as e:
+                return Response(
+                    data={'message': str(e), 'error': 'DoesNotExist'},
+                    status=400
+                )
+            # Only ids are needed to render the hyperlinks so the response is built without querying. With chunk
+            # storage values have no id and with the write buffer neither do results, their urls are None
+            result = Result(id=result_id, trial_id=trial_id, metric_id=metric_id)
+            result_value = ResultValue(id=result_value_id, result=result, step=step, value=value)
             return Response(ResultValueSerializer(result_value, context={'request': request}).data)
         else:
             return Response(validated_result_value.errors, status=400)
+
+
+def _write_points(points):
+    write_buffer = get_write_buffer()
+    if write_buffer is not None:
+        return write_buffer.write(points)
+    with transaction.atomic():
+        return write_points(points)
+
+
+class ResultValueBulkCreateViewSet(viewsets.GenericViewSet):
+    serializer_class = ResultValueBulkCreateSerializer
+
+    def create(self, request):
+        validated_points = ResultValueBulkCreateSerializer(data=request.data, context={'request': request})
+        if validated_points.is_valid():
+            points = [
+                (p['trial'], p['metric'], p['step'], p['value'])
+                for p in validated_points.validated_data['points']
+            ]
+            try:
+                n_values = _write_points(points)
+            except MissingObjects as e:
+                return Response(
+                    data={'message': str(e), 'error': 'DoesNotExist'},
+                    status=400
+                )
+            return Response({'n_values': n_values})
+        else:
+            return Response(validated_points.errors, status=400)
+
+
+STREAM_BATCH_SIZE = 1000
+STREAM_COMMIT_INTERVAL = 1.0
+
+
+@csrf_exempt
+def trial_stream(request, trial_id):
+    """
+    Streaming ingestion for long lived reporters. The body is newline delimited JSON with one
+    {"metric": url, "step": step, "value": value} object per line, usually sent with chunked transfer encoding so the
+    client can keep writing the trial's values on one request as they are reported. Lines are committed in batches of
+    batch_size lines (a query parameter) or once STREAM_COMMIT_INTERVAL seconds have passed since the last commit,
+    checked as lines arrive, and each batch is committed or rejected as a whole. When the body ends the response
+    acknowledges every batch with its first line (counted from zero), number of lines, and number of values written or
+    the error that rejected it.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    trial_id = int(trial_id)
+    if not Trial.objects.filter(id=trial_id).exists():
+        return JsonResponse({'message': f'Trial {trial_id} does not exist', 'error': 'DoesNotExist'}, status=400)
+    try:
+        batch_size = int(request.GET.get('batch_size', STREAM_BATCH_SIZE))
+    except ValueError:
+        batch_size = 0
+    if batch_size < 1:
+        return JsonResponse(
+            {'message': 'batch_size must be a positive integer', 'error': 'InvalidBatchSize'}, status=400
+        )
+
+    # Django only reads bodies that have a Content-Length, chunked bodies are read from the decoded WSGI input
+    if request.META.get('HTTP_TRANSFER_ENCODING', '').lower() == 'chunked':
+        stream = request.META['wsgi.input']
+    else:
+        stream = request
+
+    batches = []
+    lines = []
+    n_lines = 0
+    commit_at = time.monotonic() + STREAM_COMMIT_INTERVAL
+    for line in iter(stream.readline, b''):
+        line = line.strip()
+        if len(line) == 0:
+            continue
+        lines.append(line)
+        n_lines += 1
+        if len(lines) >= batch_size or time.monotonic() >= commit_at:
+            batches.append(_commit_stream_batch(trial_id, n_lines - len(lines), lines))
+            lines = []
+            commit_at = time.monotonic() + STREAM_COMMIT_INTERVAL
+    if len(lines) > 0:
+        batches.append(_commit_stream_batch(trial_id, n_lines - len(lines), lines))
+
+    return JsonResponse({
+        'n_lines': n_lines,
+        'n_values': sum(b['n_values'] for b in batches),
+        'n_errors': sum(1 for b in batches if 'error' in b),
+        'batches': batches
+    })
+
+
+def _commit_stream_batch(trial_id, first_line, lines):
+    batch = {'first_line': first_line, 'n_lines': len(lines), 'n_values': 0}
+    data = []
+    for i, line in enumerate(lines):
+        try:
+            data.append(json.loads(line.decode()))
+        except ValueError as e:
+            batch['message'] = f'Line {first_line + i} is not valid JSON: {e}'
+            batch['error'] = 'InvalidJSON'
+            return batch
+
+    validated_points = ResultValueStreamPointSerializer(data=data, many=True)
+    if not validated_points.is_valid():
+        batch['message'] = [
+            {'line': first_line + i, 'errors': errors} for i, errors in enumerate(validated_points.errors) if errors
+        ]
+        batch['error'] = 'ValidationError'
+        return batch
+
+    try:
+        batch['n_values'] = _write_points(
+            [(trial_id, p['metric'], p['step'], p['value']) for p in validated_points.validated_data]
+        )
+    except MissingObjects as e:
+        batch['message'] = str(e)
+        batch['error'] = 'DoesNotExist'
+    return batch
@@ -24,5 +24,11 @@ setup(
         'pygments',
         'pyfunctional'
     ],
-    packages=find_packages(exclude=['contrib', 'docs', 'test*'])
+    extras_require={
+        'async': ['aiohttp']
+    },
+    packages=find_packages(exclude=['contrib', 'docs', 'test*']),
+    entry_points={
+        'console_scripts': ['kuro=kuro.cli:main']
+    }
 )
\ No newline at end of file